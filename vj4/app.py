@@ -10,7 +10,9 @@ from aiohttp import web
 from vj4 import db
 from vj4 import error
 from vj4.model import system
+from vj4.model.adaptor import contest as contest_adaptor
 from vj4.service import bus
+from vj4.service import procstats
 from vj4.service import smallcache
 from vj4.service import staticmanifest
 from vj4.util import json
@@ -25,6 +27,8 @@ options.define('unsaved_session_expire_seconds', default=43200,
                help='Expire time for unsaved session, in seconds.')
 options.define('saved_session_expire_seconds', default=2592000,
                help='Expire time for saved session, in seconds.')
+options.define('session_refresh_seconds', default=300,
+               help='Minimum interval to refresh the expire time of a session, in seconds.')
 options.define('cookie_domain', default='', help='Cookie domain.')
 options.define('cookie_secure', default=False, help='Enable secure cookie flag.')
 options.define('registration_token_expire_seconds', default=86400,
@@ -85,6 +89,8 @@ class Application(web.Application):
     loop.run_until_complete(system.ensure_db_version())
     loop.run_until_complete(asyncio.gather(tools.ensure_all_indexes(), bus.init()))
     smallcache.init()
+    procstats.init()
+    contest_adaptor.init()
 
     # Load views.
     from vj4.handler import contest
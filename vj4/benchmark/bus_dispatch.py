@@ -0,0 +1,84 @@
+"""Micro-benchmark of the bus fan-out, scanning every subscriber vs the subscriber index.
+
+Usage example:
+
+    python3.5 -m vj4.benchmark.bus_dispatch --num_subscribers=10000
+"""
+import random
+import time
+
+from bson import objectid
+
+from vj4.util import options
+from vj4.util import subscription
+
+options.define('num_subscribers', default=10000, help='Number of subscribed connections.')
+options.define('num_messages', default=1000, help='Number of record_change messages.')
+options.define('detail_ratio', default=0.8, help='Ratio of record detail connections.')
+options.define('unfiltered_ratio', default=0.01, help='Ratio of connections without filter.')
+
+
+class Subscriber(object):
+  def __init__(self, filter):
+    self.filter = filter
+
+  def __call__(self, e):
+    pass
+
+
+def _get_subscribers(rdocs, num_subscribers, detail_ratio, unfiltered_ratio):
+  subscribers = []
+  for i in range(num_subscribers):
+    rdoc = random.choice(rdocs)
+    choice = random.random()
+    if choice < unfiltered_ratio:
+      filter = None
+    elif choice < detail_ratio:
+      filter = {'_id': rdoc['_id']}
+    else:
+      filter = {'uid': rdoc['uid'], 'domain_id': rdoc['domain_id'], 'pid': rdoc['pid']}
+    subscribers.append(Subscriber(filter))
+  return subscribers
+
+
+def _scan(subscribers, rdocs):
+  key_sets = {subscriber: ['record_change'] for subscriber in subscribers}
+  begin = time.perf_counter()
+  num_matches = 0
+  for rdoc in rdocs:
+    for subscriber, key_set in key_sets.items():
+      if 'record_change' not in key_set:
+        continue
+      if subscriber.filter and any(rdoc[key] != value
+                                   for key, value in subscriber.filter.items()):
+        continue
+      num_matches += 1
+  return time.perf_counter() - begin, num_matches
+
+
+def _index(subscribers, rdocs):
+  index = subscription.SubscriberIndex()
+  for subscriber in subscribers:
+    index.add(subscriber, ['record_change'], subscriber.filter)
+  begin = time.perf_counter()
+  num_matches = 0
+  for rdoc in rdocs:
+    num_matches += len(index.match('record_change', rdoc))
+  return time.perf_counter() - begin, num_matches
+
+
+def main():
+  random.seed(0)
+  rdocs = [{'_id': objectid.ObjectId(), 'uid': random.randint(1, 1000), 'domain_id': 'system',
+            'pid': random.randint(1000, 1100)} for _ in range(options.num_messages)]
+  subscribers = _get_subscribers(rdocs, options.num_subscribers,
+                                 options.detail_ratio, options.unfiltered_ratio)
+  for name, func in [('scan', _scan), ('index', _index)]:
+    seconds, num_matches = func(subscribers, rdocs)
+    print('{0:<6} {1} messages to {2} subscribers in {3:.3f}s ({4:.1f} us/message, {5} matches)'
+          .format(name, len(rdocs), len(subscribers), seconds, seconds / len(rdocs) * 1e6,
+                  num_matches))
+
+
+if __name__ == '__main__':
+  main()
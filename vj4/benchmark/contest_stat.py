@@ -0,0 +1,68 @@
+"""Micro-benchmark of the contest status update, replaying the journal vs applying one entry.
+
+Usage example:
+
+    python3.5 -m vj4.benchmark.contest_stat --size=10000
+"""
+import datetime
+import random
+import time
+
+from bson import objectid
+
+from vj4 import constant
+from vj4.model.adaptor import contest
+from vj4.util import options
+
+options.define('size', default=10000, help='Number of submissions in the journal.')
+options.define('num_problems', default=12, help='Number of problems in the contest.')
+options.define('rejudge_ratio', default=0.01, help='Ratio of rejudged submissions.')
+
+BEGIN_AT = datetime.datetime(2020, 1, 1)
+
+
+def _get_journal(size, pids, rejudge_ratio):
+  journal = []
+  for i in range(size):
+    rid = objectid.ObjectId.from_datetime(BEGIN_AT + datetime.timedelta(seconds=i))
+    journal.append({'rid': rid, 'pid': random.choice(pids),
+                    'accept': random.random() < 0.2, 'score': random.randint(0, 100)})
+  for i in random.sample(range(size), int(size * rejudge_ratio)):
+    journal.insert(random.randint(i, size), {**journal[i], 'accept': not journal[i]['accept']})
+  return journal
+
+
+def _run(tdoc, journal, incremental):
+  tsdoc = {'journal': []}
+  num_replays = 0
+  begin = time.perf_counter()
+  for jdoc in journal:
+    tsdoc['journal'].append(jdoc)
+    stats = contest._apply_status_journal(tdoc, tsdoc, jdoc) if incremental else None
+    if stats is None:
+      stats = contest._get_status_stats(tdoc, tsdoc)
+      num_replays += 1
+    tsdoc.update(stats)
+  return time.perf_counter() - begin, num_replays
+
+
+def main():
+  random.seed(0)
+  pids = list(range(1000, 1000 + options.num_problems))
+  tdoc = {'pids': pids, 'begin_at': BEGIN_AT,
+          'penalty_since': BEGIN_AT + datetime.timedelta(seconds=options.size // 2),
+          'penalty_rules': {'3600': 0.8, '86400': 0.5}}
+  journal = _get_journal(options.size, pids, options.rejudge_ratio)
+  for name, rule in [('oi', constant.contest.RULE_OI),
+                     ('acm', constant.contest.RULE_ACM),
+                     ('assignment', constant.contest.RULE_ASSIGNMENT)]:
+    tdoc['rule'] = rule
+    for engine, incremental in [('replay', False), ('incremental', True)]:
+      seconds, num_replays = _run(tdoc, journal, incremental)
+      print('{0:<10} {1:<11} {2} judgements in {3:.3f}s ({4:.1f} us/judgement, {5} replays)'
+            .format(name, engine, len(journal), seconds, seconds / len(journal) * 1e6,
+                    num_replays))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,65 @@
+"""Benchmark of importing vj4.job.difficulty, with the closed-form integral vs the table of the
+Riemann sum it used to build at import time.
+
+Usage example:
+
+    python3.5 -m vj4.benchmark.difficulty_import --table_size=1000000
+"""
+import importlib
+import sys
+import time
+import tracemalloc
+
+from vj4.util import options
+
+options.define('table_size', default=1000000, help='Size of the table built at import time.')
+
+
+def _build_table(y):
+  """Same as the removed job.difficulty._integrate_ensure_cache."""
+  from vj4.job import difficulty
+  values = [0.0]
+  last_y = 0
+  s = 0.0
+  dx = 0.1
+  dT = 2
+  x0 = 0.0
+  while y > last_y:
+    x0 += dx
+    s += difficulty._LOGP(x0) * dx
+    for i in range(dT):
+      values.append(s)
+    last_y += dT
+  return values
+
+
+def _import():
+  sys.modules.pop('vj4.job.difficulty', None)
+  return importlib.import_module('vj4.job.difficulty')
+
+
+def _measure(func, *args):
+  tracemalloc.start()
+  begin = time.perf_counter()
+  result = func(*args)
+  seconds = time.perf_counter() - begin
+  size = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  return result, seconds, size
+
+
+def main():
+  # Import the dependencies first, so that only the module itself is measured.
+  difficulty = _import()
+  _, import_seconds, import_size = _measure(_import)
+  table, table_seconds, table_size = _measure(_build_table, options.table_size)
+  print('closed-form import: {0:.3f}s, {1:.1f} MiB'
+        .format(import_seconds, import_size / 2 ** 20))
+  print('table import:       {0:.3f}s, {1:.1f} MiB'
+        .format(import_seconds + table_seconds, (import_size + table_size) / 2 ** 20))
+  max_error = max(abs(difficulty._integrate(y) - table[y]) for y in range(len(table)))
+  print('max error of the closed form: {0:.2e}'.format(max_error))
+
+
+if __name__ == '__main__':
+  main()
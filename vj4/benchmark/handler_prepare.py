@@ -0,0 +1,68 @@
+"""Benchmark of the request prelude in HandlerBase.prepare, with and without caching.
+
+Usage example:
+
+    python3.5 -m vj4.benchmark.handler_prepare run 2 system 1000
+    python3.5 -m vj4.benchmark.handler_prepare run 2 system 1000 0  # no cache, refresh session
+"""
+import time
+
+from vj4.handler import base
+from vj4.model import token
+from vj4.util import argmethod
+from vj4.util import options
+
+
+class _Transport(object):
+  def get_extra_info(self, name):
+    return ('127.0.0.1', 0)
+
+
+class _Request(object):
+  def __init__(self, sid, domain_id):
+    self.cookies = {'sid': sid}
+    self.match_info = {'domain_id': domain_id}
+    self.headers = {'User-Agent': 'vj4.benchmark.handler_prepare'}
+    self.transport = _Transport()
+
+
+class _Response(object):
+  def set_cookie(self, name, value, **kwargs):
+    pass
+
+
+class _Handler(base.HandlerBase):
+  GLOBAL = False
+
+  def __init__(self, sid, domain_id):
+    self.request = _Request(sid, domain_id)
+    self.response = _Response()
+
+
+def _percentile(values, percent):
+  return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+@argmethod.wrap
+async def run(uid: int, domain_id: str='system', count: int=1000, cached: int=1):
+  """Run prepare count times in a row with a session of uid and report the latency."""
+  if not cached:
+    options.smallcache_doc_ttl = -1
+    options.session_refresh_seconds = 0
+  sid, _ = await token.add(token.TYPE_UNSAVED_SESSION, 3600, uid=uid)
+  try:
+    seconds = []
+    for _ in range(count):
+      handler = _Handler(sid, domain_id)
+      begin = time.perf_counter()
+      await handler.prepare()
+      seconds.append(time.perf_counter() - begin)
+  finally:
+    await token.delete(sid, token.TYPE_UNSAVED_SESSION)
+  seconds.sort()
+  return '{0} prepares: p50 {1:.3f}ms, p99 {2:.3f}ms, max {3:.3f}ms'.format(
+      count, _percentile(seconds, 50) * 1e3, _percentile(seconds, 99) * 1e3, seconds[-1] * 1e3)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
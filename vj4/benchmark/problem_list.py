@@ -0,0 +1,83 @@
+"""Micro-benchmark of the permission checks of a 100-row problem list, with the role permission
+table compiled per domain vs rebuilt on every check.
+
+Usage example:
+
+    python3.5 -m vj4.benchmark.problem_list --num_renders=100
+"""
+import time
+
+import jinja2
+
+from vj4.handler import base
+from vj4.model import builtin
+from vj4.model import domain
+from vj4.util import options
+
+options.define('num_rows', default=100, help='Number of problems in the list.')
+options.define('num_renders', default=100, help='Number of times to render the list.')
+
+_TEMPLATE = jinja2.Template('''
+{% for pdoc in pdocs %}
+<tr>
+  <td>{{ pdoc['title'] }}</td>
+  {% if handler.has_perm(builtin.PERM_SUBMIT_PROBLEM) %}<td>submit</td>{% endif %}
+  {% if handler.has_perm(builtin.PERM_VIEW_PROBLEM_SOLUTION) %}<td>solution</td>{% endif %}
+  {% if handler.own(pdoc, builtin.PERM_EDIT_PROBLEM_SELF) or handler.has_perm(builtin.PERM_EDIT_PROBLEM) %}<td>edit</td>{% endif %}
+</tr>
+{% endfor %}
+''')
+
+
+class _Handler(base.HandlerBase):
+  def __init__(self):
+    self.domain = {'_id': 'benchmark', 'roles': {'student': builtin.DEFAULT_PERMISSIONS},
+                   'roles_rev': 1}
+    self.domain_user = {'role': 'student'}
+    self.user = {'_id': 2, 'priv': builtin.DEFAULT_PRIV}
+
+
+def _get_all_roles_uncompiled(ddoc):
+  builtin_roles = {role: rd.default_permission for role, rd in builtin.BUILTIN_ROLE_DESCRIPTORS.items()}
+  domain_roles = ddoc['roles']
+  return {**builtin_roles, **domain_roles}
+
+
+def _render(handler, pdocs, num_renders):
+  _TEMPLATE.render(handler=handler, builtin=builtin, pdocs=pdocs)
+  begin = time.perf_counter()
+  for _ in range(num_renders):
+    _TEMPLATE.render(handler=handler, builtin=builtin, pdocs=pdocs)
+  return time.perf_counter() - begin
+
+
+def _check(handler, pdocs, num_renders):
+  begin = time.perf_counter()
+  for _ in range(num_renders):
+    for pdoc in pdocs:
+      handler.has_perm(builtin.PERM_SUBMIT_PROBLEM)
+      handler.has_perm(builtin.PERM_VIEW_PROBLEM_SOLUTION)
+      handler.own(pdoc, builtin.PERM_EDIT_PROBLEM_SELF) or handler.has_perm(builtin.PERM_EDIT_PROBLEM)
+  return time.perf_counter() - begin
+
+
+def main():
+  pdocs = [{'doc_id': 1000 + i, 'title': 'Problem {0}'.format(i), 'owner_uid': 1}
+           for i in range(options.num_rows)]
+  handler = _Handler()
+  get_all_roles = domain.get_all_roles
+  for name, func in [('rebuild', _get_all_roles_uncompiled), ('compiled', get_all_roles)]:
+    domain.get_all_roles = func
+    try:
+      render_seconds = _render(handler, pdocs, options.num_renders)
+      check_seconds = _check(handler, pdocs, options.num_renders)
+    finally:
+      domain.get_all_roles = get_all_roles
+    print('{0:<8} {1} renders of {2} rows: {3:.3f} ms/render, of which checks {4:.3f} ms'
+          .format(name, options.num_renders, len(pdocs),
+                  render_seconds / options.num_renders * 1e3,
+                  check_seconds / options.num_renders * 1e3))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,52 @@
+"""Benchmark of the report upload write path.
+
+Usage example:
+
+    python3.5 -m vj4.benchmark.report_upload run 50 4194304
+    python3.5 -m vj4.benchmark.report_upload run 50 4194304 1  # identical content
+"""
+import asyncio
+import os
+import time
+
+from vj4.model import fs
+from vj4.util import argmethod
+
+CHUNK_SIZE = 2 ** 16
+
+
+def _chunk_reader(data):
+  view = memoryview(data)
+  offset = 0
+
+  async def read_chunk():
+    nonlocal offset
+    chunk = bytes(view[offset:offset + CHUNK_SIZE])
+    offset += len(chunk)
+    return chunk
+
+  return read_chunk
+
+
+@argmethod.wrap
+async def run(concurrency: int=50, length: int=2 ** 22, identical: int=0):
+  """Store concurrency uploads of length bytes at the same time and report the throughput."""
+  content = os.urandom(length)
+
+  async def upload(index):
+    data = content if identical else index.to_bytes(8, 'little') + content[8:]
+    return await fs.add_stream('application/pdf', _chunk_reader(data))
+
+  begin = time.perf_counter()
+  results = await asyncio.gather(*[upload(index) for index in range(concurrency)])
+  seconds = time.perf_counter() - begin
+  await asyncio.gather(*[fs.unlink(file_id) for file_id, _ in results])
+  total = concurrency * length
+  return ('{0} uploads of {1} bytes in {2:.3f}s: {3:.2f} MiB/s, {4:.1f} uploads/s, '
+          '{5} files stored').format(concurrency, length, seconds, total / seconds / 2 ** 20,
+                                     concurrency / seconds,
+                                     len(set(file_id for file_id, _ in results)))
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
@@ -0,0 +1,84 @@
+"""Benchmark of the rp updates of a problem being accepted again and again, rescanning all
+accepters on every accept vs job.rp.accept, with the statuses persisted by job.rp.update_problem
+once every compact_interval accepts, as the post-judge work queue does with post_judge_rp_delay.
+
+Runs against a scratch database, which is dropped afterwards.
+
+Usage example:
+
+    python3.5 -m vj4.benchmark.rp_accept --num_accepts=2000 --compact_interval=60
+"""
+import asyncio
+import os
+import time
+
+import pymongo
+from bson import objectid
+
+from vj4 import constant
+from vj4 import db
+from vj4.job import rp
+from vj4.model import domain
+from vj4.model.adaptor import problem
+from vj4.util import options
+from vj4.util import tools
+
+options.define('num_accepts', default=2000, help='Number of accepts of the problem.')
+options.define('compact_interval', default=60,
+               help='Accepts between the persisting of the statuses, as post_judge_rp_delay.')
+
+OWNER_UID = 1
+
+
+async def _add_accept(domain_id, pid, uid):
+  await problem.update_status(domain_id, pid, uid, objectid.ObjectId(),
+                              constant.record.STATUS_ACCEPTED)
+  await problem.inc(domain_id, pid, 'num_accept', 1)
+
+
+async def _rescan(domain_id, pid, num_accepts):
+  for uid in range(1, num_accepts + 1):
+    await _add_accept(domain_id, pid, uid)
+    await rp.update_problem(domain_id, pid)
+
+
+async def _accept(domain_id, pid, num_accepts):
+  num_pending = 0
+  for uid in range(1, num_accepts + 1):
+    await _add_accept(domain_id, pid, uid)
+    if await rp.accept(domain_id, pid, uid):
+      num_pending += 1
+    if num_pending >= options.compact_interval:
+      await rp.update_problem(domain_id, pid)
+      num_pending = 0
+  if num_pending:
+    await rp.update_problem(domain_id, pid)
+
+
+async def _run(name, func):
+  pid = await problem.add(name, 'a+b', 'calc a+b', OWNER_UID)
+  begin = time.perf_counter()
+  await func(name, pid, options.num_accepts)
+  seconds = time.perf_counter() - begin
+  max_error = 0.0
+  # The uid of each accepter is its order.
+  async for dudoc in domain.get_multi_user(domain_id=name, uid={'$ne': OWNER_UID}):
+    max_error = max(max_error, abs(dudoc['rp'] - rp.get_rp(options.num_accepts, dudoc['uid'])))
+  print('{0:<6} {1} accepts: {2:.3f} ms/accept, max error {3:.2e}'
+        .format(name, options.num_accepts, seconds / options.num_accepts * 1e3, max_error))
+
+
+def main():
+  options.db_name = 'benchmark_' + str(os.getpid())
+  loop = asyncio.get_event_loop()
+  loop.run_until_complete(db.init())
+  try:
+    loop.run_until_complete(tools.ensure_all_indexes())
+    for name, func in [('rescan', _rescan), ('accept', _accept)]:
+      loop.run_until_complete(_run(name, func))
+  finally:
+    pymongo.MongoClient(options.db_host).drop_database(options.db_name)
+
+
+if __name__ == '__main__':
+  main()
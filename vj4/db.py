@@ -1,8 +1,6 @@
 import aiomongo
 import functools
 import yarl
-import pymongo
-
 
 from vj4.util import options
 
@@ -40,5 +38,3 @@ def coll(name):
 @functools.lru_cache()
 def fs(name):
   return aiomongo.GridFS(_db, name)
-
-mdb = pymongo.MongoClient(options.db_host, options.db_port)['DSJudge']
@@ -344,6 +344,12 @@ class RecordNotFoundError(NotFoundError):
     return 'Record {0} not found.'
 
 
+class ReportNotFoundError(NotFoundError):
+  @property
+  def message(self):
+    return 'Report {0} not found.'
+
+
 class OpcountExceededError(ForbiddenError):
   @property
   def message(self):
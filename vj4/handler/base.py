@@ -1,12 +1,14 @@
 import accept
 import asyncio
 import calendar
+import datetime
 import functools
 import hmac
 import logging
 import markupsafe
 import pytz
 import sockjs
+import time
 from aiohttp import web
 from email import utils
 
@@ -29,6 +31,8 @@ from vj4.util import tools
 
 _logger = logging.getLogger(__name__)
 
+STREAM_BUFFER_SIZE = 2 ** 16 # 64 KiB
+
 
 class HandlerBase(setting.SettingMixin):
   NAME = None
@@ -48,17 +52,17 @@ class HandlerBase(setting.SettingMixin):
     if 'uid' in self.session:
       uid = self.session['uid']
       self.user, self.domain, self.domain_user, bdoc = await asyncio.gather(
-          user.get_by_uid(uid),
-          domain.get(self.domain_id),
+          user.get_by_uid_cached(uid),
+          domain.get_cached(self.domain_id),
           domain.get_user(self.domain_id, uid),
-          blacklist.get(self.remote_ip))
+          blacklist.get_cached(self.remote_ip))
       if not self.user:
         raise error.UserNotFoundError(uid)
       if not self.domain_user:
         self.domain_user = {}
     else:
       self.domain, bdoc = await asyncio.gather(
-          domain.get(self.domain_id), blacklist.get(self.remote_ip))
+          domain.get_cached(self.domain_id), blacklist.get_cached(self.remote_ip))
     self.view_lang = self.get_setting('view_lang')
     try:
       self.timezone = pytz.timezone(self.get_setting('timezone'))
@@ -109,7 +113,8 @@ class HandlerBase(setting.SettingMixin):
   async def update_session(self, *, new_saved=False, **kwargs):
     """Update or create session if necessary.
 
-    If 'sid' in cookie, the 'expire_at' field is updated.
+    If 'sid' in cookie, the 'expire_at' field is updated, at most once per
+    session_refresh_seconds unless there is extra data.
     If 'sid' not in cookie, only create when there is extra data.
 
     Args:
@@ -129,10 +134,14 @@ class HandlerBase(setting.SettingMixin):
       token_type = token.TYPE_UNSAVED_SESSION
       session_expire_seconds = options.unsaved_session_expire_seconds
     if sid:
-      session = await token.update(sid, token_type, session_expire_seconds,
-                                   **{**kwargs,
-                                      'update_ip': self.remote_ip,
-                                      'update_ua': self.request.headers.get('User-Agent')})
+      if not kwargs:
+        session = await token.get(sid, token_type)
+      if kwargs or (session and datetime.datetime.utcnow() - session['update_at']
+                    >= datetime.timedelta(seconds=options.session_refresh_seconds)):
+        session = await token.update(sid, token_type, session_expire_seconds,
+                                     **{**kwargs,
+                                        'update_ip': self.remote_ip,
+                                        'update_ua': self.request.headers.get('User-Agent')})
     if kwargs and not session:
       sid, session = await token.add(token_type, session_expire_seconds,
                                      **{**kwargs,
@@ -193,6 +202,19 @@ class HandlerBase(setting.SettingMixin):
     return self.locale.get(text, text)
 
   def render_html(self, template_name, **kwargs):
+    begin = time.perf_counter()
+    html = self._get_template(template_name, kwargs).render(kwargs)
+    template.record_render(template_name, time.perf_counter() - begin)
+    return html
+
+  def generate_html(self, template_name, **kwargs):
+    """Like render_html, but returns an iterator of the rendered str chunks."""
+    begin = time.perf_counter()
+    tpl = self._get_template(template_name, kwargs)
+    return template.record_generate(template_name, tpl.generate(kwargs),
+                                    time.perf_counter() - begin)
+
+  def _get_template(self, template_name, kwargs):
     kwargs['handler'] = self
     if '_' not in kwargs:
       kwargs['_'] = self.translate
@@ -206,7 +228,7 @@ class HandlerBase(setting.SettingMixin):
       kwargs['path_components'] = self.build_path((self.translate(self.NAME), None))
     kwargs['reverse_url'] = self.reverse_url
     kwargs['datetime_span'] = functools.partial(_datetime_span, timezone=self.timezone)
-    return template.Environment().get_template(template_name).render(kwargs)
+    return template.get_environment().get_template(template_name)
 
   def render_title(self, page_title=None):
     if not page_title:
@@ -225,6 +247,8 @@ class HandlerBase(setting.SettingMixin):
 
 
 class Handler(web.View, HandlerBase):
+  FILE_MAX_LENGTH = None
+
   def __await__(self):
     try:
       self.response = web.Response()
@@ -265,16 +289,41 @@ class Handler(web.View, HandlerBase):
     self.response.text = json.encode(obj)
 
   async def binary(self, data, content_type='application/octet-stream', file_name=None):
+    await self.binary_stream(content_type, file_name, content_length=len(data))
+    await self.response.write(data)
+
+  async def binary_stream(self, content_type='application/octet-stream', file_name=None, *,
+                          content_length=None, charset=None):
+    """Prepare a streamed binary response. The body is written by the caller."""
     self.response = web.StreamResponse()
-    self.response.content_length = len(data)
+    if content_length is not None:
+      self.response.content_length = content_length
     self.response.content_type = content_type
+    if charset:
+      self.response.charset = charset
     if file_name:
       for char in '/<>:\"\'\\|?* ':
         file_name = file_name.replace(char, '')
       self.response.headers.add('Content-Disposition',
                                 'attachment; filename="{}"'.format(file_name))
     await self.response.prepare(self.request)
-    await self.response.write(data)
+    return self.response
+
+  async def text_stream(self, chunks, content_type='text/plain', file_name=None):
+    """Stream an iterable of str chunks as utf-8, written in batches of STREAM_BUFFER_SIZE."""
+    response = await self.binary_stream(content_type, file_name, charset='utf-8')
+    buffer = []
+    buffer_size = 0
+    for chunk in chunks:
+      data = chunk.encode()
+      buffer.append(data)
+      buffer_size += len(data)
+      if buffer_size >= STREAM_BUFFER_SIZE:
+        await response.write(b''.join(buffer))
+        buffer.clear()
+        buffer_size = 0
+    if buffer:
+      await response.write(b''.join(buffer))
 
   @property
   def prefer_json(self):
@@ -455,6 +504,13 @@ def post_argument(coro):
 
 
 def multipart_argument(coro):
+  """Stores the uploaded files and passes their file ids, with the file name and the length as
+  the arguments <name>_filename and <name>_length.
+
+  The files must come after the csrf_token field, which is checked before anything is stored.
+  The handler provides get_content_type(filename), and may limit the length of each file by
+  FILE_MAX_LENGTH.
+  """
   @functools.wraps(coro)
   async def wrapped(self, **kwargs):
     file_ids = list()
@@ -463,22 +519,14 @@ def multipart_argument(coro):
         if not part.filename:
           kwargs[part.name] = (await part.read()).decode()
         else:
-          grid_in = await fs.add(self.get_content_type(part.filename))
-          try:
-            chunk = await part.read_chunk()
-            while chunk:
-              _, chunk = await asyncio.gather(grid_in.write(chunk), part.read_chunk())
-            await grid_in.close()
-          except:
-            await grid_in.abort()
-            raise
-          file_id = await fs.link_by_md5(grid_in.md5, grid_in._id)
-          if file_id:
-            await fs.unlink(grid_in._id)
-          else:
-            file_id = grid_in._id
+          if self.csrf_token and self.csrf_token != kwargs.get('csrf_token', ''):
+            raise error.CsrfTokenError()
+          file_id, length = await fs.add_stream(self.get_content_type(part.filename),
+                                                part.read_chunk, self.FILE_MAX_LENGTH)
           file_ids.append(file_id)
           kwargs[part.name] = file_id
+          kwargs[part.name + '_filename'] = part.filename
+          kwargs[part.name + '_length'] = length
       return await coro(self, **kwargs)
     except:
       await asyncio.gather(*[fs.unlink(file_id) for file_id in file_ids])
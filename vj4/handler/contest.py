@@ -1,9 +1,8 @@
 import asyncio
 import calendar
 import datetime
-import io
 import pytz
-import zipfile
+import urllib.parse
 from bson import objectid
 
 from vj4 import app
@@ -103,30 +102,14 @@ class ContestDetailHandler(contest.ContestMixin, base.OperationHandler):
 
 
 @app.route('/contest/{tid:\w{24}}/code', 'contest_code')
-class ContestCodeHandler(base.OperationHandler):
+class ContestCodeHandler(contest.ContestMixin, base.OperationHandler):
   @base.limit_rate('contest_code', 3600, 60)
   @base.route_argument
   @base.require_perm(builtin.PERM_VIEW_CONTEST)
   @base.require_perm(builtin.PERM_READ_RECORD_CODE)
   @base.sanitize
   async def get(self, *, tid: objectid.ObjectId):
-    tdoc, tsdocs = await contest.get_and_list_status(self.domain_id, document.TYPE_CONTEST, tid)
-    rnames = {}
-    for tsdoc in tsdocs:
-      for pdetail in tsdoc.get('detail', []):
-        rnames[pdetail['rid']] = 'U{}_P{}_R{}'.format(tsdoc['uid'], pdetail['pid'], pdetail['rid'])
-    output_buffer = io.BytesIO()
-    zip_file = zipfile.ZipFile(output_buffer, 'a', zipfile.ZIP_DEFLATED)
-    rdocs = record.get_multi(get_hidden=True, _id={'$in': list(rnames.keys())})
-    async for rdoc in rdocs:
-      zip_file.writestr(rnames[rdoc['_id']] + '.' + rdoc['lang'], rdoc['code'])
-    # mark all files as created in Windows :p
-    for zfile in zip_file.filelist:
-      zfile.create_system = 0
-    zip_file.close()
-
-    await self.binary(output_buffer.getvalue(), 'application/zip',
-                      file_name='{}.zip'.format(tdoc['title']))
+    await self.export_code(document.TYPE_CONTEST, tid)
 
 
 @app.route('/contest/{tid}/{pid:-?\d+|\w{24}}', 'contest_detail_problem')
@@ -237,43 +220,39 @@ class ContestScoreboardHandler(contest.ContestMixin, base.Handler):
   @base.require_perm(builtin.PERM_VIEW_CONTEST_SCOREBOARD)
   @base.sanitize
   async def get(self, *, tid: objectid.ObjectId):
-    tdoc, rows, udict = await self.get_scoreboard(document.TYPE_CONTEST, tid)
+    tdoc, rows, _ = await self.get_scoreboard(document.TYPE_CONTEST, tid)
     page_title = self.translate('contest_scoreboard')
     path_components = self.build_path(
         (self.translate('contest_main'), self.reverse_url('contest_main')),
         (tdoc['title'], self.reverse_url('contest_detail', tid=tdoc['doc_id'])),
         (page_title, None))
-    dudict = await domain.get_dict_user_by_uid(domain_id=self.domain_id, uids=udict.keys())
-    self.render('contest_scoreboard.html', tdoc=tdoc, rows=rows, dudict=dudict,
-                page_title=page_title, path_components=path_components)
+    url_prefix = '/d/{}'.format(urllib.parse.quote(self.domain_id))
+    self.render('contest_scoreboard.html', tdoc=tdoc, rows=rows,
+                page_title=page_title, path_components=path_components,
+                socket_url=url_prefix + '/contest/{}/scoreboard-conn'.format(tdoc['doc_id']))
 
 
-@app.route('/contest/{tid}/scoreboard/download/{ext}', 'contest_scoreboard_download')
-class ContestScoreboardDownloadHandler(contest.ContestMixin, base.Handler):
-  def _export_status_as_csv(self, rows):
-    # \r\n for notepad compatibility
-    csv_content = '\r\n'.join([','.join([str(c['value']) for c in row]) for row in rows])
-    data = '\uFEFF' + csv_content
-    return data.encode()
+@app.connection_route('/contest/{tid}/scoreboard-conn', 'contest_scoreboard-conn')
+class ContestScoreboardConnection(contest.ContestScoreboardConnectionMixin, base.Connection):
+  @base.require_perm(builtin.PERM_VIEW_CONTEST)
+  @base.require_perm(builtin.PERM_VIEW_CONTEST_SCOREBOARD)
+  async def on_open(self):
+    await super(ContestScoreboardConnection, self).on_open()
+    tid = objectid.ObjectId(self.request.match_info['tid'])
+    await self.open_scoreboard(document.TYPE_CONTEST, tid)
+
+  async def on_close(self):
+    self.close_scoreboard()
 
-  def _export_status_as_html(self, rows):
-    return self.render_html('contest_scoreboard_download_html.html', rows=rows).encode()
 
+@app.route('/contest/{tid}/scoreboard/download/{ext}', 'contest_scoreboard_download')
+class ContestScoreboardDownloadHandler(contest.ContestMixin, base.Handler):
   @base.route_argument
   @base.require_perm(builtin.PERM_VIEW_CONTEST)
   @base.require_perm(builtin.PERM_VIEW_CONTEST_SCOREBOARD)
   @base.sanitize
   async def get(self, *, tid: objectid.ObjectId, ext: str):
-    get_status_content = {
-      'csv': self._export_status_as_csv,
-      'html': self._export_status_as_html,
-    }
-    if ext not in get_status_content:
-      raise error.ValidationError('ext')
-    tdoc, rows, udict = await self.get_scoreboard(document.TYPE_CONTEST, tid, True)
-    data = get_status_content[ext](rows)
-    file_name = tdoc['title']
-    await self.binary(data, file_name='{}.{}'.format(file_name, ext))
+    await self.export_scoreboard(document.TYPE_CONTEST, tid, ext)
 
 
 @app.route('/contest/create', 'contest_create')
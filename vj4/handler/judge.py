@@ -1,11 +1,14 @@
 import asyncio
 import calendar
+import collections
 import datetime
 import logging
+import time
 from bson import objectid
 
 from vj4 import app
 from vj4 import constant
+from vj4 import error
 from vj4 import job
 from vj4.handler import base
 from vj4.model import builtin
@@ -17,10 +20,33 @@ from vj4.model.adaptor import contest
 from vj4.model.adaptor import problem
 from vj4.model.adaptor import setting
 from vj4.service import bus
+from vj4.service import procstats
 from vj4.service import queue
+from vj4.service import workqueue
 from vj4.util import locale
+from vj4.util import options
+
+options.define('judge_next_delay', default=0.05,
+               help='Seconds to coalesce judge progress updates of a record before writing.')
+options.define('judge_timeout', default=600,
+               help='Seconds without progress after which a delivery is requeued.')
+options.define('judge_max_concurrency', default=64,
+               help='Maximum concurrency a judge may advertise.')
+options.define('post_judge_workers', default=4,
+               help='Number of workers recalculating problem difficulty and rp after judging.')
+options.define('post_judge_difficulty_delay', default=5,
+               help='Seconds to coalesce difficulty recalculations of a problem.')
+options.define('post_judge_rp_delay', default=60,
+               help='Seconds to coalesce rp recalculations of a problem.')
 
 _logger = logging.getLogger(__name__)
+_judges = {}  # connection id -> JudgeNotifyConnection
+_post_judge_queue = workqueue.WorkQueue('post_judge', options.post_judge_workers)
+
+
+def _get_judge_stats():
+  """Get the stats of the judges connected to this process."""
+  return [conn.get_stats() for conn in _judges.values()]
 
 
 async def _send_ac_mail(handler, rdoc):
@@ -42,29 +68,49 @@ async def _send_ac_mail(handler, rdoc):
 
 async def _post_judge(handler, rdoc):
   accept = rdoc['status'] == constant.record.STATUS_ACCEPTED
-  bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+  record.publish_change(rdoc)
   post_coros = list()
   # TODO(twd2): ignore no effect statuses like system error, ...
-  if rdoc['type'] == constant.record.TYPE_SUBMISSION:
-    if accept:
-      post_coros.append(_send_ac_mail(handler, rdoc))
-    if rdoc['tid']:
-      post_coros.append(contest.update_status(rdoc['domain_id'],
-                                              rdoc.get('ttype', document.TYPE_CONTEST), rdoc['tid'],
-                                              rdoc['uid'], rdoc['_id'], rdoc['pid'],
-                                              accept, rdoc['score']))
-    if not rdoc.get('rejudged'):
-      if await problem.update_status(rdoc['domain_id'], rdoc['pid'], rdoc['uid'],
-                                     rdoc['_id'], rdoc['status']):
-        if accept:
-          # TODO(twd2): enqueue rdoc['pid'] to recalculate rp.
-          await problem.inc(rdoc['domain_id'], rdoc['pid'], 'num_accept', 1)
-          post_coros.append(domain.inc_user(rdoc['domain_id'], rdoc['uid'], num_accept=1))
-    else:
-      # TODO(twd2): enqueue rdoc['pid'] to recalculate rp.
-      await job.record.user_in_problem(rdoc['uid'], rdoc['domain_id'], rdoc['pid'])
-    post_coros.append(job.difficulty.update_problem(rdoc['domain_id'], rdoc['pid']))
+  if rdoc['type'] != constant.record.TYPE_SUBMISSION:
+    return
+  if accept:
+    post_coros.append(_send_ac_mail(handler, rdoc))
+  if rdoc['tid']:
+    post_coros.append(contest.update_status(rdoc['domain_id'],
+                                            rdoc.get('ttype', document.TYPE_CONTEST), rdoc['tid'],
+                                            rdoc['uid'], rdoc['_id'], rdoc['pid'],
+                                            accept, rdoc['score']))
+  first_accept = False
+  update_rp = False
+  if not rdoc.get('rejudged'):
+    if await problem.update_status(rdoc['domain_id'], rdoc['pid'], rdoc['uid'],
+                                   rdoc['_id'], rdoc['status']):
+      if accept:
+        await problem.inc(rdoc['domain_id'], rdoc['pid'], 'num_accept', 1)
+        post_coros.append(domain.inc_user(rdoc['domain_id'], rdoc['uid'], num_accept=1))
+        first_accept = True
+  else:
+    await asyncio.gather(job.record.user_in_problem(rdoc['uid'], rdoc['domain_id'], rdoc['pid']),
+                         job.rp.mark_dirty(rdoc['domain_id'], rdoc['pid']))
+    update_rp = True
   await asyncio.gather(*post_coros)
+  if first_accept:
+    update_rp = await job.rp.accept(rdoc['domain_id'], rdoc['pid'], rdoc['uid'])
+  # Difficulty and the rp statuses of the earlier accepters only depend on the counters of the
+  # problem, so a burst of submissions to a problem is written once. The users' rp is already
+  # updated by job.rp.accept. The queue is in memory: work lost in a restart is redone by
+  # job.difficulty.recalc and job.rp.compact (rp_dirty is persisted).
+  _post_judge_queue.add(job.difficulty.update_problem, rdoc['domain_id'], rdoc['pid'],
+                        key=('difficulty', rdoc['domain_id'], rdoc['pid']),
+                        delay=options.post_judge_difficulty_delay)
+  if update_rp:
+    _post_judge_queue.add(job.rp.update_problem, rdoc['domain_id'], rdoc['pid'],
+                          key=('rp', rdoc['domain_id'], rdoc['pid']),
+                          delay=options.post_judge_rp_delay)
+
+
+procstats.register('judges', _get_judge_stats)
+procstats.register('post_judge', _post_judge_queue.get_stats)
 
 
 @app.route('/judge/playground', 'judge_playground')
@@ -86,18 +132,19 @@ class JudgeNoopHandler(base.Handler):
 class JudgeDataListHandler(base.Handler):
   @base.get_argument
   @base.sanitize
-  async def get(self, last: int=0):
+  async def get(self, last: int=0, cursor: str=''):
     # TODO(iceboy): This function looks strange.
     # Judge will have PRIV_READ_PROBLEM_DATA,
     # domain administrator will have PERM_READ_PROBLEM_DATA.
     if not self.has_priv(builtin.PRIV_READ_PROBLEM_DATA):
       self.check_perm(builtin.PERM_READ_PROBLEM_DATA)
-    pids = await problem.get_data_list(last)
+    pids, cursor = await problem.get_data_list(last, cursor)
     datalist = []
     for domain_id, pid in pids:
       datalist.append({'domain_id': domain_id, 'pid': pid})
     self.json({'pids': datalist,
-               'time': calendar.timegm(datetime.datetime.utcnow().utctimetuple())})
+               'time': calendar.timegm(datetime.datetime.utcnow().utctimetuple()),
+               'cursor': cursor})
 
 
 # TODO(iceboy): Move this to RecordCancelHandler.
@@ -136,12 +183,40 @@ class JudgeScoreHandler(base.Handler):
 @app.connection_route('/judge/consume-conn', 'judge_consume-conn')
 class JudgeNotifyConnection(base.Connection):
   @base.require_priv(builtin.PRIV_READ_RECORD_CODE | builtin.PRIV_WRITE_RECORD)
-  async def on_open(self):
+  @base.get_argument
+  @base.sanitize
+  async def on_open(self, *, concurrency: int=1):
     self.rids = {}  # delivery_tag -> rid
+    self.next_updates = {}  # delivery_tag -> pending update of next
+    self.next_handles = {}  # delivery_tag -> timer handle to write the pending update
+    self.next_locks = collections.defaultdict(asyncio.Lock)  # delivery_tag -> write lock
     bus.subscribe(self.on_problem_data_change, ['problem_data_change'])
-    self.channel = await queue.consume('judge', self._on_queue_message)
+    self.concurrency = self._clamp_concurrency(concurrency)
+    self.connected_at = time.time()
+    self.num_judged = 0
+    self.channel = await queue.consume_weighted(record.JUDGE_QUEUE_WEIGHTS,
+                                                self._on_queue_message,
+                                                max_prefetch=self.concurrency,
+                                                timeout=options.judge_timeout,
+                                                on_timeout=self._requeue)
+    _judges[self.id] = self
     asyncio.ensure_future(self.channel.close_event.wait()).add_done_callback(lambda _: self.close())
 
+  def _clamp_concurrency(self, concurrency):
+    return min(max(concurrency, 1), options.judge_max_concurrency)
+
+  def _set_concurrency(self, concurrency):
+    """Sets the concurrency advertised by the judge, which is also the maximum prefetch."""
+    self.concurrency = self._clamp_concurrency(concurrency)
+    self.channel.set_max_prefetch(self.concurrency)
+
+  def get_stats(self):
+    seconds = max(time.time() - self.connected_at, 1)
+    return {'id': self.id, 'uid': self.user['_id'], 'concurrency': self.concurrency,
+            'prefetch': self.channel.prefetch, 'inflight': len(self.rids),
+            'num_judged': self.num_judged, 'num_timeouts': self.channel.num_timeouts,
+            'connected_at': self.connected_at, 'judged_per_minute': self.num_judged / seconds * 60}
+
   async def on_problem_data_change(self, e):
     domain_id_pid = dict(e['value'])
     self.send(event=e['key'], **domain_id_pid)
@@ -153,37 +228,110 @@ class JudgeNotifyConnection(base.Connection):
       self.rids[tag] = rdoc['_id']
       self.send(rid=str(rdoc['_id']), tag=tag, pid=str(rdoc['pid']), domain_id=rdoc['domain_id'],
                 lang=rdoc['lang'], code=rdoc['code'], type=rdoc['type'])
-      bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+      record.publish_change(rdoc)
     else:
       # Record not found, eat it.
       await self.channel.basic_client_ack(tag)
 
-  async def on_message(self, *, key, tag, **kwargs):
-    if key == 'next':
-      rid = self.rids[tag]
+  async def _requeue(self, tag):
+    """Returns a delivery the judge made no progress on to the queue."""
+    rid = self.rids.pop(tag, None)
+    if not rid:
+      return
+    handle = self.next_handles.pop(tag, None)
+    if handle:
+      handle.cancel()
+    self.next_updates.pop(tag, None)
+    self.next_locks.pop(tag, None)
+    _logger.warning('Judge %s timed out on record %s, requeueing', self.user['_id'], rid)
+    rdoc = await record.end_judge(rid, self.user['_id'], self.id,
+                                  constant.record.STATUS_WAITING, 0, 0, 0)
+    if rdoc:
+      record.publish_change(rdoc)
+    await self.channel.basic_client_nack(tag)
+
+  def _queue_next(self, tag, kwargs):
+    """Merges a next message into the pending update of the delivery tag.
+
+    A message may carry a batch of cases and texts in cases, compiler_texts and judge_texts,
+    besides the single case, compiler_text and judge_text.
+    """
+    update = self.next_updates.setdefault(tag, {'$set': {}, '$push': {}})
+    if 'status' in kwargs:
+      update['$set']['status'] = int(kwargs['status'])
+    if 'progress' in kwargs:
+      update['$set']['progress'] = float(kwargs['progress'])
+    for key in ['compiler_text', 'judge_text']:
+      texts = list(kwargs.get(key + 's', []))
+      if key in kwargs:
+        texts.append(kwargs[key])
+      if texts:
+        update['$push'].setdefault(key + 's', []).extend(str(text) for text in texts)
+    cases = list(kwargs.get('cases', []))
+    if 'case' in kwargs:
+      cases.append(kwargs['case'])
+    if cases:
+      update['$push'].setdefault('cases', []).extend({
+        'status': int(case['status']),
+        'score': int(case['score']),
+        'time_ms': int(case['time_ms']),
+        'memory_kb': int(case['memory_kb']),
+        'judge_text': str(case['judge_text']),
+      } for case in cases)
+    if tag not in self.next_handles:
+      loop = asyncio.get_event_loop()
+      self.next_handles[tag] = loop.call_later(options.judge_next_delay,
+                                               self._on_next_timer, tag)
+
+  def _on_next_timer(self, tag):
+    del self.next_handles[tag]
+    asyncio.get_event_loop().create_task(self._flush_next(tag))
+
+  async def _flush_next(self, tag):
+    """Writes the pending update of the delivery tag in one next_judge."""
+    handle = self.next_handles.pop(tag, None)
+    if handle:
+      handle.cancel()
+    if tag not in self.rids:
+      self.next_updates.pop(tag, None)
+      return
+    async with self.next_locks[tag]:
+      pending = self.next_updates.pop(tag, None)
+      rid = self.rids.get(tag)
+      if not pending or not rid:
+        return
       update = {}
-      if 'status' in kwargs:
-        update.setdefault('$set', {})['status'] = int(kwargs['status'])
-      if 'compiler_text' in kwargs:
-        update.setdefault('$push', {})['compiler_texts'] = str(kwargs['compiler_text'])
-      if 'judge_text' in kwargs:
-        update.setdefault('$push', {})['judge_texts'] = str(kwargs['judge_text'])
-      if 'case' in kwargs:
-        update.setdefault('$push', {})['cases'] = {
-          'status': int(kwargs['case']['status']),
-          'score': int(kwargs['case']['score']),
-          'time_ms': int(kwargs['case']['time_ms']),
-          'memory_kb': int(kwargs['case']['memory_kb']),
-          'judge_text': str(kwargs['case']['judge_text']),
-        }
-      if 'progress' in kwargs:
-        update.setdefault('$set', {})['progress'] = float(kwargs['progress'])
+      if pending['$set']:
+        update['$set'] = pending['$set']
+      if pending['$push']:
+        update['$push'] = dict((key, {'$each': values})
+                               for key, values in pending['$push'].items())
       rdoc = await record.next_judge(rid, self.user['_id'], self.id, **update)
-      if not rdoc:
+    if rdoc:
+      record.publish_change(rdoc)
+
+  async def on_message(self, *, key, tag=None, **kwargs):
+    if key == 'concurrency':
+      try:
+        concurrency = int(kwargs['concurrency'])
+      except (KeyError, TypeError, ValueError):
+        raise error.InvalidArgumentError('concurrency')
+      self._set_concurrency(concurrency)
+    elif key == 'next':
+      if tag not in self.rids:
         return
-      bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+      self.channel.touch(tag)
+      self._queue_next(tag, kwargs)
     elif key == 'end':
-      rid = self.rids.pop(tag)
+      if tag not in self.rids:
+        return
+      await self._flush_next(tag)
+      self.next_locks.pop(tag, None)
+      rid = self.rids.pop(tag, None)
+      if not rid:
+        # Requeued while writing the progress.
+        return
+      self.num_judged += 1
       rdoc, _ = await asyncio.gather(record.end_judge(rid, self.user['_id'], self.id,
                                                       int(kwargs['status']),
                                                       int(kwargs['score']),
@@ -195,11 +343,17 @@ class JudgeNotifyConnection(base.Connection):
       await _post_judge(self, rdoc)
 
   async def on_close(self):
+    _judges.pop(self.id, None)
+    for handle in self.next_handles.values():
+      handle.cancel()
+    self.next_handles.clear()
+    self.next_updates.clear()
+
     async def close():
       async def reset_record(rid):
         rdoc = await record.end_judge(rid, self.user['_id'], self.id,
                                       constant.record.STATUS_WAITING, 0, 0, 0)
-        bus.publish_throttle('record_change', rdoc, rdoc['_id'])
+        record.publish_change(rdoc)
 
       await asyncio.gather(*[reset_record(rid) for rid in self.rids.values()])
       await self.channel.close()
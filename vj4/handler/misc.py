@@ -1,5 +1,7 @@
 from vj4 import app
 from vj4.handler import base
+from vj4.model import builtin
+from vj4.model import progress
 from vj4.util import misc
 
 
@@ -22,3 +24,11 @@ class PreviewHandler(base.Handler):
   async def post(self, *, text: str):
     self.response.content_type = 'text/html'
     self.response.text = misc.markdown(text)
+
+
+@app.route('/jobs', 'job_main', global_route=True)
+class JobMainHandler(base.Handler):
+  @base.require_priv(builtin.PRIV_MANAGE_ALL_DOMAIN)
+  async def get(self):
+    jpdocs = await progress.get_status()
+    self.render('job_main.html', jpdocs=jpdocs)
@@ -342,19 +342,19 @@ class ProblemPretestConnection(record_handler.RecordVisibilityMixin, base.Connec
   async def on_open(self):
     await super(ProblemPretestConnection, self).on_open()
     self.pid = document.convert_doc_id(self.request.match_info['pid'])
-    bus.subscribe(self.on_record_change, ['record_change'])
+    bus.subscribe(self.on_record_change, ['record_change'],
+                  {'uid': self.user['_id'], 'domain_id': self.domain_id, 'pid': self.pid})
 
   async def on_record_change(self, e):
     rdoc = e['value']
-    if rdoc['uid'] != self.user['_id'] or \
-       rdoc['domain_id'] != self.domain_id or rdoc['pid'] != self.pid:
-      return
     # check permission for visibility: contest
     if rdoc['tid']:
       show_status, tdoc = await self.rdoc_contest_visible(rdoc)
       if not show_status:
         return
-    self.send(rdoc=rdoc)
+    rdoc = await record.get(rdoc['_id'], record.PROJECTION_PUBLIC)
+    if rdoc:
+      self.send(rdoc=rdoc)
 
   async def on_close(self):
     bus.unsubscribe(self.on_record_change)
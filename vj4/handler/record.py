@@ -18,6 +18,7 @@ from vj4.model import user
 from vj4.model.adaptor import contest
 from vj4.model.adaptor import problem
 from vj4.service import bus
+from vj4.service import procstats
 from vj4.util import options
 
 
@@ -92,7 +93,12 @@ class RecordMainHandler(RecordMixin, base.Handler):
               struct.pack('>i', ts - int(365.2425 * 24 * 3600)) + struct.pack('b', -1) * 8)),
           record.get_count())
       statistics = {'day': day_count, 'week': week_count, 'month': month_count,
-                    'year': year_count, 'total': rcount}
+                    'year': year_count, 'total': rcount,
+                    'queues': await record.get_judge_queue_stats(),
+                    'judges': [{'process': process, **jdoc}
+                               for process, jdocs in procstats.get('judges') for jdoc in jdocs],
+                    'post_judge': procstats.get('post_judge'),
+                    'bus': procstats.get('bus')}
     url_prefix = '/d/{}'.format(urllib.parse.quote(self.domain_id))
     query_string = urllib.parse.urlencode(
       [('uid_or_name', uid_or_name), ('pid', pid), ('tid', tid)])
@@ -110,13 +116,10 @@ class RecordMainConnection(RecordMixin, base.Connection):
   async def on_open(self, *, uid_or_name: str='', pid: str='', tid: str=''):
     await super(RecordMainConnection, self).on_open()
     self.query = await self.get_filter_query(uid_or_name, pid, tid)
-    bus.subscribe(self.on_record_change, ['record_change'])
+    bus.subscribe(self.on_record_change, ['record_change'], self.query)
 
   async def on_record_change(self, e):
     rdoc = e['value']
-    for key, value in self.query.items():
-      if rdoc[key] != value:
-        return
     if rdoc['tid']:
       show_status, tdoc = await self.rdoc_contest_visible(rdoc)
       if not show_status:
@@ -192,13 +195,17 @@ class RecordDetailConnection(RecordMixin, base.Connection):
       if not show_status:
         self.close()
         return
-    bus.subscribe(self.on_record_change, ['record_change'])
+    self.rev = rdoc.get('rev', 0)
+    bus.subscribe(self.on_record_change, ['record_change'], {'_id': self.rid})
     self.send_record(rdoc)
 
   async def on_record_change(self, e):
-    rdoc = e['value']
-    if rdoc['_id'] != self.rid:
+    if e['value'].get('rev', self.rev + 1) <= self.rev:
+      return
+    rdoc = await record.get(self.rid, record.PROJECTION_PUBLIC)
+    if not rdoc or rdoc.get('rev', 0) < e['value'].get('rev', 0):
       return
+    self.rev = rdoc.get('rev', 0)
     self.send_record(rdoc)
 
   def send_record(self, rdoc):
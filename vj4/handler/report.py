@@ -1,11 +1,11 @@
 import asyncio
 import collections
 import datetime
-import io
+import logging
+import mimetypes
 import os
 import pytz
 import yaml
-import zipfile
 from bson import objectid
 
 from vj4 import app
@@ -14,6 +14,7 @@ from vj4 import error
 from vj4.model import builtin
 from vj4.model import document
 from vj4.model import record
+from vj4.model import report
 from vj4.model import user
 from vj4.model import domain
 from vj4.model.adaptor import discussion
@@ -21,13 +22,66 @@ from vj4.model.adaptor import contest
 from vj4.model.adaptor import problem
 from vj4.handler import base
 from vj4.util import pagination
+from vj4.util import zipstream
 
 from aiohttp import web
-from vj4.db import mdb
 from vj4.model import fs
-from vj4.model.report import file_rename
 from vj4.model.adaptor.setting import Setting
 
+FILE_MAX_LENGTH = 10 * 1024 ** 2 # 10 MiB
+USER_QUOTA = 2 ** 28 # 256 MiB
+
+_logger = logging.getLogger(__name__)
+
+
+def _unlink_legacy_data(name):
+  """Remove a file stored under data/ before uploads were moved to GridFS."""
+  def unlink():
+    try:
+      os.unlink('data/%s' % name)
+    except FileNotFoundError:
+      pass
+
+  return asyncio.get_event_loop().run_in_executor(None, unlink)
+
+
+def _convert_file_id(value):
+  # An empty file input is posted as an empty field.
+  return objectid.ObjectId(value) if value else None
+
+
+async def _get_archive_entries(ureports):
+  """Get the files of the reports as a list of (name, file id or None for a legacy local file).
+
+  Missing files are skipped and logged here, since a file found missing while streaming the
+  archive would cut it off after the response started.
+  """
+  files = [(ureport, key, ureport[key + '_data'], ureport.get(key + '_file'))
+           for ureport in ureports for key in ['report', 'code'] if ureport.get(key + '_data')]
+  fdict = await fs.get_meta_dict([file_id for _, _, _, file_id in files if file_id])
+  # Legacy local files are checked in one pass in the executor, like zipstream reads them.
+  local_names = [name for _, _, name, file_id in files if not file_id]
+  local_existing = await asyncio.get_event_loop().run_in_executor(
+      None, lambda: set(name for name in local_names if os.path.isfile('data/%s' % name)))
+  entries = []
+  for ureport, key, name, file_id in files:
+    if (file_id in fdict) if file_id else (name in local_existing):
+      entries.append((name, file_id))
+    else:
+      _logger.warning('Skipping missing %s file %s of user %s in report %s',
+                      key, name, ureport['user_id'], ureport['report_id'])
+  return entries
+
+
+async def _write_archive(zip_writer, entries):
+  for name, file_id in entries:
+    if file_id:
+      grid_out = await fs.get(file_id)
+      await zip_writer.write_stream(name, fs.get_chunk_reader(grid_out))
+    else:
+      await zip_writer.write_file(name, 'data/%s' % name)
+  await zip_writer.close()
+
 
 # @app.route('/report', 'report_main')
 # class ReportHandler(base.Handler):
@@ -48,16 +102,16 @@ from vj4.model.adaptor.setting import Setting
 class HomeworkMainHandler(contest.ContestMixin, base.Handler):
   @base.require_perm(builtin.PERM_VIEW_HOMEWORK)
   async def get(self):
-    reports = list(mdb['report'].find().sort('report_id'))
+    reports = await report.get_multi().to_list()
     calendar_reports = []
-    for report in reports:
+    for rdoc in reports:
       cal_report = {
-        'id': report['report_id'],
-        'begin_at': self.datetime_stamp(report['begin_at']),
-        'title': report['title'],
-        'status': self.status_text(report),
-        'end_at': self.datetime_stamp(report['end_at']),
-        'url': self.reverse_url('report_detail', rid=report['_id']),
+        'id': rdoc['report_id'],
+        'begin_at': self.datetime_stamp(rdoc['begin_at']),
+        'title': rdoc['title'],
+        'status': self.status_text(rdoc),
+        'end_at': self.datetime_stamp(rdoc['end_at']),
+        'url': self.reverse_url('report_detail', rid=rdoc['_id']),
       }
       calendar_reports.append(cal_report)
 
@@ -125,18 +179,8 @@ class ReportCreateHandler(contest.ContestMixin, base.Handler):
     if penalty_since > end_at:
       raise error.ValidationError('extension_days')
 
-    current_year = datetime.datetime.now().year
-    rid = objectid.ObjectId()
-    mdb.report.insert_one({
-      "_id": rid,
-      "report_id": report_id,
-      "title": title,
-      "content": content,
-      "year": current_year,
-      "course": course,
-      "begin_at": begin_at,
-      "end_at": end_at,
-    })
+    rid = await report.add(report_id, course, title, content, begin_at, end_at,
+                           year=datetime.datetime.now().year)
     # tid = await contest.add(self.domain_id, document.TYPE_HOMEWORK, title, content, self.user['_id'],
     #                         constant.contest.RULE_ASSIGNMENT, begin_at, end_at, pids,
     #                         penalty_since=penalty_since, penalty_rules=penalty_rules)
@@ -152,9 +196,8 @@ class ReportDetailHandler(contest.ContestMixin, base.OperationHandler):
   @base.get_argument
   @base.sanitize
   async def get(self, *, rid: objectid.ObjectId, page: int = 1):
-    report = mdb.report.find_one({'_id': rid})
-
-    ureport = mdb.ureport.find_one({'report_id': report['_id'], 'user_id': self.user['_id']})
+    rdoc, ureport = await asyncio.gather(report.get(rid),
+                                         report.get_status(rid, self.user['_id']))
 
 
     # tsdoc, pdict = await asyncio.gather(
@@ -191,12 +234,12 @@ class ReportDetailHandler(contest.ContestMixin, base.OperationHandler):
 
     self.render(
       'report_detail.html',
-      tdoc=report,
+      tdoc=rdoc,
       pdoc=ureport,
       attended=True,
       page=page,
       datetime_stamp=self.datetime_stamp,
-      page_title=report['title'],
+      page_title=rdoc['title'],
     )
 
   @base.route_argument
@@ -222,153 +265,90 @@ class ReportDownloadHandler(contest.ContestMixin, base.Handler):
   @base.sanitize
   async def post(self, rid: objectid.ObjectId):
     user_id = self.user['_id']
-    ureport = mdb.ureport.find_one({'user_id': user_id, 'report_id': rid})
-    output_buffer = io.BytesIO()
-    zip_file = zipfile.ZipFile(output_buffer, 'a', zipfile.ZIP_DEFLATED)
-
-    report_name = ureport['report_data']
-    if report_name != None:
-      with open("data/%s" % report_name, "rb") as f:
-        zip_file.writestr(report_name, f.read())
-    code_name = ureport['code_data']
-    if code_name != None:
-      with open("data/%s" % code_name, "rb") as f:
-        zip_file.writestr(code_name, f.read())
-
-    for zfile in zip_file.filelist:
-      zfile.create_system = 0
-    zip_file.close()
-
-    await self.binary(output_buffer.getvalue(), 'application/zip',
-                      file_name='Archive.zip')
+    ureport = await report.get_status(rid, user_id)
+    if not ureport:
+      raise error.FileNotFoundError()
+    entries = await _get_archive_entries([ureport])
+    zip_writer = zipstream.ZipStreamWriter(
+        await self.binary_stream('application/zip', file_name='Archive.zip'))
+    await _write_archive(zip_writer, entries)
 
 
 @app.route('/report/{rid}/upload', 'report_upload')
 class ReportUploadHandler(base.Handler):
-  @base.require_priv(builtin.PRIV_USER_PROFILE)
-  @base.route_argument
-  @base.post_argument
-  @base.require_csrf_token
-  @base.sanitize
-  async def post(self, *, rid: str):
-    data = await self.request.post()
-
-    report = data['report']
-    code = data['code']
-    # 既没有报告，也没有代码
-    if not (hasattr(report, 'file') or hasattr(code, 'file')):
-      raise error.FileNotFoundError()
-
-    has_report = False
-    has_code = False
-
-    if hasattr(report, 'file'):
-      has_report = True
-    if hasattr(code, 'file'):
-      has_code = True
-
-    if has_report:
-      report_data = report.file
-      report_name = report.filename
-      report_extension = report_name.split(".")[-1]
-    if has_code:
-      code_data = code.file
-      code_name = code.filename
-      code_extension = code_name.split('.')[-1]
-
-    # def check_file_type(extension):
-    #   if extension not in ['pdf', 'doc', 'docx']:
-    #     raise error.FileTypeNotAllowedError(extension)
-    if has_report:
-      if report_extension not in ['pdf', 'doc', 'docx']:
-        raise error.ReportFileTypeNotAllowedError(report_extension)
-    if has_code:
-      if code_extension not in ['zip']:
-        raise error.CodeFileTypeNotAllowedError(code_extension)
-
+  FILE_MAX_LENGTH = FILE_MAX_LENGTH
+  # field name: (allowed extensions, error type)
+  FILE_FIELDS = {'report': (['pdf', 'doc', 'docx'], error.ReportFileTypeNotAllowedError),
+                 'code': (['zip'], error.CodeFileTypeNotAllowedError)}
+
+  def get_quota(self):
+    quota = USER_QUOTA
+    if self.has_priv(builtin.PRIV_UNLIMITED_QUOTA):
+      quota = 2 ** 63 - 1
+    return quota
+
+  def get_content_type(self, filename):
+    extension = filename.split('.')[-1]
+    if not any(extension in allowed_extensions
+               for allowed_extensions, _ in self.FILE_FIELDS.values()):
+      raise error.FileTypeNotAllowedError(filename)
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+  async def upload(self, rid, files):
     uid = self.user['_id']
-
     shanghai = pytz.timezone('Asia/Shanghai')
-
     upload_time = datetime.datetime.utcnow().astimezone(shanghai)
-    student = mdb.user.find_one({"_id": uid})
-    rid = objectid.ObjectId(rid)
-    this_report = mdb.report.find_one({"_id": rid})
-    report_id = this_report['_id']
-
+    this_report = await report.get(rid)
     report_deadline = pytz.utc.localize(this_report['end_at']).astimezone(shanghai)
-
-    print(upload_time)
-    print(report_deadline)
-
     if upload_time > report_deadline:
       raise error.HomeworkNotLiveError()
-
+    # 既没有报告，也没有代码
+    if not files:
+      raise error.FileNotFoundError()
+    usage = sum(file['length'] for file in files.values())
+    await report.inc_usage(uid, usage, self.get_quota())
     # 数据结构课设的 course_id 等于 3
-    if has_report:
-      if file_rename(3, 'report', student, this_report, report_extension) is not None:
-        report_name = file_rename(3, 'report', student, this_report, report_extension)
-    if has_code:
-      if file_rename(3, 'code', student, this_report, code_extension) is not None:
-        code_name = file_rename(3, 'code', student, this_report, code_extension)
-
+    fields = {'upload_time': upload_time}
+    for key, file in files.items():
+      fields[key + '_data'] = (report.file_rename(3, key, self.user, this_report, file['extension'])
+                               or file['filename'])
+      fields[key + '_file'] = file['file_id']
+      fields[key + '_length'] = file['length']
+    try:
+      ureport = await report.set_status(rid, uid, **fields)
+    except:
+      await report.dec_usage(uid, usage)
+      raise
 
-    ureport = mdb.ureport.find_one({'user_id': uid, 'report_id': report_id})
-    pdoc = None
+    # release the replaced files
     if ureport:
-      # update report or code
-      if has_report:
-        try:
-          os.unlink('data/%s' % ureport['report_data'])
-        except FileNotFoundError as e:
-          pass
-        pdoc = mdb.ureport.update_one({'user_id': uid, 'report_id': report_id}, {"$set": {"report_data": report_name, "upload_time": upload_time}})
-      if has_code:
-        try:
-          os.unlink('data/%s' % ureport['code_data'])
-        except FileNotFoundError as e:
-          pass
-        pdoc = mdb.ureport.update_one({'user_id': uid, 'report_id': report_id},
-                                      {"$set": {"code_data": code_name, "upload_time": upload_time}})
-    else:
-      # create new report or code
-      if not has_report:
-        report_name = None
-      if not has_code:
-        code_name = None
-      pdoc = mdb.ureport.insert_one({
-        '_id': objectid.ObjectId(),
-        'user_id': uid,
-        'report_id': report_id,
-        'report_data': report_name,
-        'code_data': code_name,
-        'upload_time': upload_time})
-
-    if has_report:
-      with open('data/%s' % report_name, 'wb') as f:
-        f.write(report_data.read())
-    if has_code:
-      with open('data/%s' % code_name, 'wb') as f:
-        f.write(code_data.read())
-    # if report.report_rename(student, report) is not None:
-    #   file_name = report.report_rename(student, report)
-    # ureport = mdb.find_one({'user_id': uid, 'report_id': report_id})
-    # print(file_name)
-
-
-    # if ureport and ureport['data'] is objectid.ObjectId:
-    #   await fs.unlink(ureport['data'])
-
-
-    # pdoc = await problem.get(self.domain_id, pid)
-    # if not self.own(pdoc, builtin.PERM_EDIT_PROBLEM_SELF):
-    #   self.check_perm(builtin.PERM_EDIT_PROBLEM)
-    # if (not self.own(pdoc, builtin.PERM_READ_PROBLEM_DATA_SELF)
-    #     and not self.has_perm(builtin.PERM_READ_PROBLEM_DATA)):
-    #   self.check_priv(builtin.PRIV_READ_PROBLEM_DATA)
-    # if pdoc.get('data') and type(pdoc['data']) is objectid.ObjectId:
-    #   await fs.unlink(pdoc['data'])
-    # await problem.set_data(self.domain_id, pid, file)
+      for key in files:
+        if ureport.get(key + '_file'):
+          await asyncio.gather(fs.unlink(ureport[key + '_file']),
+                               report.dec_usage(uid, ureport.get(key + '_length', 0)))
+        elif ureport.get(key + '_data'):
+          await _unlink_legacy_data(ureport[key + '_data'])
+
+  @base.require_priv(builtin.PRIV_USER_PROFILE)
+  @base.route_argument
+  @base.multipart_argument
+  @base.require_csrf_token
+  @base.sanitize
+  async def post(self, *, rid: objectid.ObjectId,
+                 report: _convert_file_id=None, report_filename: str='', report_length: int=0,
+                 code: _convert_file_id=None, code_filename: str='', code_length: int=0):
+    files = {}
+    for key, file_id, filename, length in [('report', report, report_filename, report_length),
+                                           ('code', code, code_filename, code_length)]:
+      if not file_id:
+        continue
+      extension = filename.split('.')[-1]
+      allowed_extensions, error_type = self.FILE_FIELDS[key]
+      if extension not in allowed_extensions:
+        raise error_type(extension)
+      files[key] = {'file_id': file_id, 'length': length,
+                    'filename': filename, 'extension': extension}
+    await self.upload(rid, files)
     self.json_or_redirect(self.reverse_url('report_detail', rid=rid))
 
 
@@ -379,7 +359,7 @@ class ReportEditHandler(contest.ContestMixin, base.Handler):
   @base.route_argument
   @base.sanitize
   async def get(self, *, rid: objectid.ObjectId):
-    tdoc = mdb.report.find_one({'_id': rid})
+    tdoc = await report.get(rid)
     # if not self.own(tdoc, builtin.PERM_EDIT_HOMEWORK_SELF):
     self.check_perm(builtin.PERM_EDIT_HOMEWORK)
     begin_at = pytz.utc.localize(tdoc['begin_at']).astimezone(self.timezone)
@@ -413,7 +393,6 @@ class ReportEditHandler(contest.ContestMixin, base.Handler):
                  begin_at_date: str, begin_at_time: str,
                  penalty_since_date: str, penalty_since_time: str):
 
-    tdoc = mdb.report.find_one({"_id": rid})
     self.check_perm(builtin.PERM_EDIT_HOMEWORK)
     try:
       begin_at = datetime.datetime.strptime(begin_at_date + ' ' + begin_at_time, '%Y-%m-%d %H:%M')
@@ -431,17 +410,8 @@ class ReportEditHandler(contest.ContestMixin, base.Handler):
     if penalty_since > end_at:
       raise error.ValidationError('extension_days')
 
-    mdb.report.update_one({'_id': rid},
-                          {'$set':
-                             {'begin_at': begin_at,
-                              'end_at': end_at,
-                              'report_id': report_id,
-                              'course': course,
-                              'title': title,
-                              'content': content}
-                           })
-
-    pdoc = mdb.ureport.find_one({'user_id': self.user['_id'], 'report_id': rid})
+    await report.edit(rid, begin_at=begin_at, end_at=end_at, report_id=report_id,
+                      course=course, title=title, content=content)
     self.json_or_redirect(self.reverse_url('report_detail', rid=rid))
 
 
@@ -454,23 +424,12 @@ class ReportCodeHandler(contest.ContestMixin, base.Handler):
   async def get(self, rid: objectid.ObjectId):
     # Report Download Settings
     # rid = objectid.ObjectId("5f5cc9314e26cb78f6bd108b")
-    ureports = mdb.ureport.find({"report_id": rid})
-
-    all_uid = set()
-    all_year = set()
-    all_group = set()
-    all_class = set()
-    all_uid.add("All")
-    all_year.add("All")
-    all_group.add("All")
-    all_class.add("All")
-
-    for ureport in ureports:
-      all_uid.add(ureport['user_id'])
-      this_user =  mdb.user.find_one({'_id': ureport['user_id']})
-      all_year.add(this_user['year'])
-      all_group.add(this_user['group'])
-      all_class.add(this_user['_class'])
+    roster, rdoc = await asyncio.gather(report.get_roster(rid), report.get(rid))
+
+    all_uid = {"All", *roster['uid']}
+    all_year = {"All", *roster['year']}
+    all_group = {"All", *roster['group']}
+    all_class = {"All", *roster['_class']}
 
     all_uid = {r: r for i, r in enumerate(all_uid)}
     all_year = {r: r for i, r in enumerate(all_year)}
@@ -490,8 +449,7 @@ class ReportCodeHandler(contest.ContestMixin, base.Handler):
       Setting('setting_download', 'group', str, range=all_group,
               ui='select', name='By group',default="All"),
     ]
-    report = mdb.report.find_one({'_id': rid})
-    self.render('report_download.html', category='report_download', settings=download_settings, tdoc=report)
+    self.render('report_download.html', category='report_download', settings=download_settings, tdoc=rdoc)
 
   @base.route_argument
   @base.post_argument
@@ -511,24 +469,12 @@ class ReportCodeHandler(contest.ContestMixin, base.Handler):
       user_filters["group"] = group
     if uid != "All":
       user_filters["_id"] = int(uid)
-    all_users = mdb.user.find(user_filters)
-    all_user_ids = [tuser["_id"] for tuser in all_users]
-
-    all_reports = mdb.ureport.find({"report_id": rid, "user_id": {"$in": all_user_ids}})
-    print(all_reports)
-    output_buffer = io.BytesIO()
-    zip_file = zipfile.ZipFile(output_buffer, 'a', zipfile.ZIP_DEFLATED)
-    for report in all_reports:
-      report_name = report['report_data']
-      code_name = report['code_data']
-      if report_name != None:
-        with open("data/%s" % report_name, "rb") as f:
-          zip_file.writestr(report_name, f.read())
-      if code_name != None:
-        with open("data/%s" % code_name, "rb") as f:
-          zip_file.writestr(code_name, f.read())
-    for zfile in zip_file.filelist:
-      zfile.create_system = 0
-    zip_file.close()
-    await self.binary(output_buffer.getvalue(), 'application/zip',
-                      file_name='Archive.zip')
+    all_users = await user.get_multi(**user_filters, fields={'_id': 1}).to_list()
+    all_user_ids = [tuser['_id'] for tuser in all_users]
+
+    all_reports = await report.get_multi_status(report_id=rid,
+                                                user_id={'$in': all_user_ids}).to_list()
+    entries = await _get_archive_entries(all_reports)
+    zip_writer = zipstream.ZipStreamWriter(
+        await self.binary_stream('application/zip', file_name='Archive.zip'))
+    await _write_archive(zip_writer, entries)
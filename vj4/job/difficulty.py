@@ -13,11 +13,9 @@ from vj4.util import domainjob
 _logger = logging.getLogger(__name__)
 
 
-_CACHE_INFO = {
-  'last_s': 0.0,
-  'last_y': 0,
-  'values': [0.0]
-}
+_SIGMA = 0.5
+_DX = 0.1
+_DT = 2
 
 
 @argmethod.wrap
@@ -26,31 +24,9 @@ def _LOGP(x: float):
   return math.exp(-1.0 * pow(math.log(x, math.e), 2) / 0.5) / x / 0.5 / sqrt_2_pi
 
 
-@argmethod.wrap
-def _integrate_ensure_cache(y: int):
-  last_y = _CACHE_INFO['last_y']
-  if y <= last_y:
-    return _CACHE_INFO
-  s = _CACHE_INFO['last_s']
-  dx = 0.1
-  dT = 2
-  x0 = last_y / dT * dx
-  while y > last_y:
-    x0 += dx
-    s += _LOGP(x0) * dx
-    for i in range(dT):
-      _CACHE_INFO['values'].append(s)
-    last_y += dT
-  _CACHE_INFO['last_y'] = last_y
-  _CACHE_INFO['last_s'] = s
-  return _CACHE_INFO
-
-
-_integrate_ensure_cache(1000000)
-
-
 @argmethod.wrap
 def _integrate_direct(y: int):
+  """Riemann sum of _LOGP, for reference."""
   last_y = 0
   s = 0.0
   dx = 0.1
@@ -65,8 +41,11 @@ def _integrate_direct(y: int):
 
 @argmethod.wrap
 def _integrate(y: int):
-  _integrate_ensure_cache(y)
-  return _CACHE_INFO['values'][y]
+  """Integral of _LOGP, the log-normal pdf, from 0 to the x of y, i.e. the log-normal cdf."""
+  if y <= 0:
+    return 0.0
+  x = math.ceil(y / _DT) * _DX
+  return 0.5 + 0.5 * math.erf(math.log(x) / (_SIGMA * math.sqrt(2)))
 
 
 @argmethod.wrap
@@ -108,7 +87,10 @@ async def update_problem(domain_id: str, pid: document.convert_doc_id):
 
 @domainjob.wrap
 async def recalc(domain_id: str):
-  pdocs = problem.get_multi(domain_id=domain_id)
+  pdocs = problem.get_multi(domain_id=domain_id,
+                            fields={'_id': 1, 'num_submit': 1, 'num_accept': 1,
+                                    'difficulty': 1, 'difficulty_algo': 1,
+                                    'difficulty_setting': 1, 'difficulty_admin': 1})
   coll = db.coll('document')
   bulk = coll.initialize_unordered_bulk_op()
   execute = False
@@ -116,6 +98,8 @@ async def recalc(domain_id: str):
   async for pdoc in pdocs:
     difficulty_algo = difficulty_algorithm(pdoc['num_submit'], pdoc['num_accept'])
     difficulty = _get_difficulty(pdoc, difficulty_algo)
+    if difficulty == pdoc.get('difficulty') and difficulty_algo == pdoc.get('difficulty_algo'):
+      continue
     bulk.find({'_id': pdoc['_id']}) \
         .update_one({'$set': {'difficulty': difficulty,
                               'difficulty_algo': difficulty_algo}})
@@ -123,7 +107,7 @@ async def recalc(domain_id: str):
   if execute:
     _logger.info('Committing')
     await bulk.execute()
-  
+
 
 if __name__ == '__main__':
   argmethod.invoke_by_args()
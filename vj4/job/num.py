@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 from vj4 import db
@@ -193,9 +192,17 @@ async def problem_solution(domain_id: str):
 
 
 @domainjob.wrap
-async def num(domain_id: str):
-  await asyncio.gather(discussion(domain_id), contest(domain_id), training(domain_id),
-                       problem(domain_id), problem_solution(domain_id))
+async def num(domain_id: str, checkpoint=None):
+  """Run the counting jobs in turn, resuming after the last one done."""
+  jobs = [discussion, contest, training, problem, problem_solution]
+  begin = 0
+  if checkpoint:
+    await checkpoint.set_total(len(jobs))
+    begin = checkpoint.value or 0
+  for index in range(begin, len(jobs)):
+    await jobs[index](domain_id)
+    if checkpoint:
+      await checkpoint.save(index + 1)
 
 
 if __name__ == '__main__':
@@ -12,6 +12,11 @@ _logger = logging.getLogger(__name__)
 
 @domainjob.wrap
 async def run(domain_id: str, keyword: str='rp', rank_field: str='rank', level_field: str='level'):
+  """Rank the users of a domain by keyword.
+
+  The ranks depend on the whole order of the users, which is read in one pass, so a run which did
+  not finish starts the domain over instead of resuming from a checkpoint.
+  """
   _logger.info('Ranking')
   dudocs = domain.get_multi_user(domain_id=domain_id, fields={'_id': 1, 'uid': 1, keyword: 1}) \
                  .sort(keyword, -1)
@@ -1,7 +1,6 @@
 import asyncio
-import collections
-import functools
 import logging
+import time
 
 from vj4 import db
 from vj4 import constant
@@ -11,10 +10,16 @@ from vj4.model import record
 from vj4.model.adaptor import problem
 from vj4.util import argmethod
 from vj4.util import domainjob
+from vj4.util import options
+
+options.define('record_bulk_size', default=1000,
+               help='Max number of writes of a bulk in job.record.run.')
 
 
 _logger = logging.getLogger(__name__)
 
+_PROBLEMS_PER_BATCH = 100
+
 
 @argmethod.wrap
 async def user_in_problem(uid: int, domain_id: str, pid: document.convert_doc_id):
@@ -52,63 +57,160 @@ async def user_in_problem(uid: int, domain_id: str, pid: document.convert_doc_id
       await asyncio.gather(*post_coros)
 
 
+class _BulkWriter(object):
+  """Unordered bulk of updates of a collection, executed whenever it reaches the bulk size."""
+
+  def __init__(self, coll):
+    self.coll = coll
+    self.bulk = coll.initialize_unordered_bulk_op()
+    self.size = 0
+
+  async def update_one(self, query, update, upsert=False):
+    op = self.bulk.find(query)
+    if upsert:
+      op = op.upsert()
+    op.update_one(update)
+    self.size += 1
+    if self.size >= options.record_bulk_size:
+      await self.flush()
+
+  async def flush(self):
+    if self.size:
+      await self.bulk.execute()
+      self.bulk = self.coll.initialize_unordered_bulk_op()
+      self.size = 0
+
+
+async def _fold_problems(domain_id, pids, status_writer, problem_writer):
+  """Fold the submission records of the problems into their statuses and numbers.
+
+  The records are read in a single pass in (pid, uid, _id) order, so only the status being
+  folded is held in memory besides the pending bulk writes. Returns the number of records.
+  """
+  # TODO(twd2): ignore no effect statuses like system error, ...
+  rdocs = record.get_multi(domain_id=domain_id, pid={'$in': pids},
+                           type=constant.record.TYPE_SUBMISSION,
+                           fields={'_id': 1, 'pid': 1, 'uid': 1, 'status': 1}) \
+                .sort([('pid', 1), ('uid', 1), ('_id', 1)])
+  pid, uid, psdoc, pdoc_update = None, None, None, None
+  num_records = 0
+  async for rdoc in rdocs:
+    if psdoc and (rdoc['pid'] != pid or rdoc['uid'] != uid):
+      await status_writer.update_one({'domain_id': domain_id, 'doc_type': document.TYPE_PROBLEM,
+                                      'doc_id': pid, 'uid': uid},
+                                     {'$set': psdoc}, upsert=True)
+      psdoc = None
+    if pdoc_update and rdoc['pid'] != pid:
+      await problem_writer.update_one({'domain_id': domain_id, 'doc_type': document.TYPE_PROBLEM,
+                                       'doc_id': pid},
+                                      {'$set': pdoc_update})
+      pdoc_update = None
+    pid, uid = rdoc['pid'], rdoc['uid']
+    if not pdoc_update:
+      pdoc_update = {'num_submit': 0, 'num_accept': 0}
+    if not psdoc:
+      psdoc = {'num_submit': 0, 'status': 0, 'rid': ''}
+    pdoc_update['num_submit'] += 1
+    psdoc['num_submit'] += 1
+    if psdoc['status'] != constant.record.STATUS_ACCEPTED:
+      psdoc['status'] = rdoc['status']
+      psdoc['rid'] = rdoc['_id']
+      if rdoc['status'] == constant.record.STATUS_ACCEPTED:
+        pdoc_update['num_accept'] += 1
+    num_records += 1
+  if psdoc:
+    await status_writer.update_one({'domain_id': domain_id, 'doc_type': document.TYPE_PROBLEM,
+                                    'doc_id': pid, 'uid': uid},
+                                   {'$set': psdoc}, upsert=True)
+  if pdoc_update:
+    await problem_writer.update_one({'domain_id': domain_id, 'doc_type': document.TYPE_PROBLEM,
+                                     'doc_id': pid},
+                                    {'$set': pdoc_update})
+  return num_records
+
+
 @domainjob.wrap
-async def run(domain_id: str):
-  _logger.info('Clearing previous statuses')
-  await db.coll('document.status').update_many(
-    {'domain_id': domain_id, 'doc_type': document.TYPE_PROBLEM},
-    {'$unset': {'journal': '', 'rev': '', 'status': '', 'rid': '',
-                'num_submit': '', 'num_accept': ''}})
-  pdocs = problem.get_multi(domain_id=domain_id, fields={'_id': 1, 'doc_id': 1}).sort('doc_id', 1)
-  dudoc_factory = functools.partial(dict, num_submit=0, num_accept=0)
-  dudoc_updates = collections.defaultdict(dudoc_factory)
-  status_coll = db.coll('document.status')
+async def run(domain_id: str, checkpoint=None):
+  """Rebuild the problem statuses and the numbers of submissions and accepts of a domain.
+
+  The problems are done in batches of _PROBLEMS_PER_BATCH, each with one pass over their
+  submission records, and the job resumes after the last batch done. The users' numbers are
+  then summed up from the statuses.
+  """
+  query = {}
+  if checkpoint:
+    await checkpoint.set_total(await problem.get_multi(domain_id=domain_id).count())
+    if checkpoint.value is not None:
+      # doc_id may be of mixed types, which $gt does not compare, so resume by _id.
+      query['_id'] = {'$gt': checkpoint.value}
+  if not query:
+    _logger.info('Clearing previous statuses and numbers')
+    await asyncio.gather(
+      db.coll('document.status').update_many(
+        {'domain_id': domain_id, 'doc_type': document.TYPE_PROBLEM},
+        {'$unset': {'journal': '', 'rev': '', 'status': '', 'rid': '',
+                    'num_submit': '', 'num_accept': ''}}),
+      db.coll('document').update_many(
+        {'domain_id': domain_id, 'doc_type': document.TYPE_PROBLEM},
+        {'$set': {'num_submit': 0, 'num_accept': 0}}))
+  pdocs = problem.get_multi(domain_id=domain_id, fields={'_id': 1, 'doc_id': 1},
+                            **query).sort('_id', 1)
+  status_writer = _BulkWriter(db.coll('document.status'))
+  problem_writer = _BulkWriter(db.coll('document'))
+  num_records = 0
+  begin = time.perf_counter()
+
+  async def run_batch(batch):
+    nonlocal num_records
+    num_records += await _fold_problems(domain_id, [pdoc['doc_id'] for pdoc in batch],
+                                        status_writer, problem_writer)
+    await asyncio.gather(status_writer.flush(), problem_writer.flush())
+    if checkpoint:
+      await checkpoint.save(batch[-1]['_id'], len(batch))
+    _logger.info('{0} records, {1:.0f} records/s'
+                 .format(num_records, num_records / (time.perf_counter() - begin)))
+
+  _logger.info('Reading records, counting numbers, updating statuses')
+  batch = []
   async for pdoc in pdocs:
-    _logger.info('Problem {0}'.format(pdoc['doc_id']))
-    # TODO(twd2): ignore no effect statuses like system error, ...
-    rdocs = record.get_multi(domain_id=domain_id, pid=pdoc['doc_id'],
-                             type=constant.record.TYPE_SUBMISSION,
-                             fields={'_id': 1, 'uid': 1,
-                                     'status': 1, 'score': 1}).sort('_id', 1)
-    _logger.info('Reading records, counting numbers, updating statuses')
-    factory = functools.partial(dict, num_submit=0, num_accept=0, status=0, rid='')
-    psdocs = collections.defaultdict(factory)
-    pdoc_update = {'num_submit': 0, 'num_accept': 0}
-    async for rdoc in rdocs:
-      accept = True if rdoc['status'] == constant.record.STATUS_ACCEPTED else False
-      pdoc_update['num_submit'] += 1
-      psdocs[rdoc['uid']]['num_submit'] += 1
-      dudoc_updates[rdoc['uid']]['num_submit'] += 1
-      if psdocs[rdoc['uid']]['status'] != constant.record.STATUS_ACCEPTED:
-        psdocs[rdoc['uid']]['status'] = rdoc['status']
-        psdocs[rdoc['uid']]['rid'] = rdoc['_id']
-        if accept:
-          pdoc_update['num_accept'] += 1
-          dudoc_updates[rdoc['uid']]['num_accept'] += 1
-    status_bulk = status_coll.initialize_unordered_bulk_op()
-    execute = False
-    for uid, psdoc in psdocs.items():
-      execute = True
-      (status_bulk.find({'domain_id': domain_id, 'doc_type': document.TYPE_PROBLEM,
-                         'doc_id': pdoc['doc_id'], 'uid': uid})
-       .upsert().update_one({'$set': {**psdoc}}))
-    if execute:
-      _logger.info('Committing')
-      await status_bulk.execute()
-    _logger.info('Updating problem')
-    await document.set(domain_id, document.TYPE_PROBLEM, pdoc['doc_id'], **pdoc_update)
+    batch.append(pdoc)
+    if len(batch) >= _PROBLEMS_PER_BATCH:
+      await run_batch(batch)
+      batch = []
+  if batch:
+    await run_batch(batch)
+  seconds = time.perf_counter() - begin
+  _logger.info('{0} records in {1:.3f}s, {2:.0f} records/s'
+               .format(num_records, seconds, num_records / seconds if seconds else 0))
   # users' num_submit, num_accept
-  execute = False
-  user_coll = db.coll('domain.user')
-  user_bulk = user_coll.initialize_unordered_bulk_op()
+  pipeline = [
+    {
+      '$match': {'domain_id': domain_id,
+                 'doc_type': document.TYPE_PROBLEM,
+                 'num_submit': {'$gt': 0}}
+    },
+    {
+      '$group': {
+        '_id': '$uid',
+        'num_submit': {'$sum': '$num_submit'},
+        'num_accept': {
+          '$sum': {
+            '$cond': [{'$eq': ['$status', constant.record.STATUS_ACCEPTED]}, 1, 0]
+          }
+        }
+      }
+    }
+  ]
   _logger.info('Updating users')
-  for uid, dudoc_update in dudoc_updates.items():
-    execute = True
-    (user_bulk.find({'domain_id': domain_id, 'uid': uid})
-     .upsert().update_one({'$set': dudoc_update}))
-  if execute:
-    _logger.info('Committing')
-    await user_bulk.execute()
+  user_coll = db.coll('domain.user')
+  await user_coll.update_many({'domain_id': domain_id},
+                              {'$set': {'num_submit': 0, 'num_accept': 0}})
+  user_writer = _BulkWriter(user_coll)
+  async for adoc in await db.coll('document.status').aggregate(pipeline):
+    await user_writer.update_one({'domain_id': domain_id, 'uid': adoc['_id']},
+                                 {'$set': {'num_submit': adoc['num_submit'],
+                                           'num_accept': adoc['num_accept']}}, upsert=True)
+  await user_writer.flush()
 
 
 if __name__ == '__main__':
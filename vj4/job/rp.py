@@ -42,11 +42,129 @@ def get_rp_expect(pdoc):
   return get_rp_func(new_pdoc)(new_pdoc['num_accept'])
 
 
+def get_rp(num_accept, order):
+  """Get the rp of the order-th accepter of a problem which has num_accept accepters."""
+  return get_rp_func({'num_accept': num_accept})(order)
+
+
+def _get_num_rescaled(num_accept):
+  """Get the number of the earlier accepters whose rp changes when the num_accept-th accepter is
+  appended, i.e. the leading ones which were above RP_PROBLEM_MIN, as modulus_user decreases."""
+  if not 2 <= num_accept <= RP_PROBLEM_MAX_USER + 1:
+    return 0
+  rp_func = get_rp_func({'num_accept': num_accept - 1})
+  low, high = 0, num_accept - 1
+  while low < high:
+    mid = (low + high + 1) // 2
+    if rp_func(mid) > RP_PROBLEM_MIN:
+      low = mid
+    else:
+      high = mid - 1
+  return low
+
+
+def _get_applied_rp(psdoc, num_accept):
+  """Get the rp of a status which is included in the user's rp, when the users' rp of the problem
+  reflects num_accept accepters: the persisted rp, rescaled by modulus_problem if accept appended
+  accepters after it was persisted."""
+  rp = psdoc.get('rp', 0.0)
+  if not rp or num_accept is None or psdoc.get('rp_num', num_accept) == num_accept:
+    return rp
+  if num_accept > RP_PROBLEM_MAX_USER:
+    return RP_PROBLEM_MIN
+  return max(rp * modulus_problem(num_accept) / modulus_problem(psdoc['rp_num']), RP_PROBLEM_MIN)
+
+
+@argmethod.wrap
+async def accept(domain_id: str, pid: document.convert_doc_id, uid: int):
+  """Give rp to a new accepter of a problem.
+
+  When appended as the last accepter, the earlier accepters are only rescaled by modulus_problem,
+  so their delta is added to their users' rp in closed form, without reading or writing their
+  statuses, which are persisted later by update_problem or compact (rp_dirty). Otherwise, e.g.
+  judged out of order, or after a rejudge (rp_rescan), the problem is rescanned by update_problem.
+
+  Returns:
+    Whether the statuses of the other accepters are left to be persisted.
+  """
+  pdoc = await problem.get(domain_id, pid)
+  psdoc = await problem.get_status(domain_id, pdoc['doc_id'], uid)
+  num_accept = pdoc['num_accept']
+  order = await problem.get_multi_status(domain_id=domain_id,
+                                         doc_id=pdoc['doc_id'],
+                                         status=constant.record.STATUS_ACCEPTED,
+                                         rid={'$lte': psdoc['rid']}).count()
+  num_rescaled = _get_num_rescaled(num_accept)
+  claimed = False
+  if order == num_accept:
+    update = {'$set': {'rp_num': num_accept}}
+    if num_rescaled:
+      update['$set']['rp_dirty'] = True
+    # Moves the users' rp of the problem from num_accept - 1 to num_accept accepters, which fails
+    # if it does not reflect the others, e.g. when another accept or a rejudge came in between.
+    result = await db.coll('document').update_one(
+        {'_id': pdoc['_id'],
+         'rp_num': num_accept - 1 if num_accept > 1 else {'$in': [0, None]},
+         'rp_rescan': {'$ne': True}},
+        update)
+    claimed = result.matched_count > 0
+  if not claimed:
+    await update_problem(domain_id, pdoc['doc_id'])
+    return False
+  dudoc_incs = {}
+  if num_rescaled:
+    psdocs = problem.get_multi_status(domain_id=domain_id,
+                                      doc_id=pdoc['doc_id'],
+                                      status=constant.record.STATUS_ACCEPTED,
+                                      fields={'uid': 1}).sort('rid', 1).limit(num_rescaled)
+    order = 0
+    async for earlier_psdoc in psdocs:
+      order += 1
+      dudoc_incs[earlier_psdoc['uid']] = get_rp(num_accept, order) - get_rp(num_accept - 1, order)
+  rp = get_rp(num_accept, num_accept)
+  dudoc_incs[uid] = rp - psdoc.get('rp', 0.0)
+  await db.coll('document.status').update_one({'_id': psdoc['_id']},
+                                              {'$set': {'rp': rp, 'rp_num': num_accept}})
+  await _inc_users(domain_id, dudoc_incs)
+  return bool(num_rescaled)
+
+
+async def _inc_users(domain_id, dudoc_incs):
+  user_coll = db.coll('domain.user')
+  user_bulk = user_coll.initialize_unordered_bulk_op()
+  execute = False
+  _logger.info('Updating users')
+  for uid, delta_rp in dudoc_incs.items():
+    if abs(delta_rp) > RP_MIN_DELTA:
+      execute = True
+      user_bulk.find({'domain_id': domain_id, 'uid': uid}).upsert() \
+               .update_one({'$inc': {'rp': delta_rp}})
+  if execute:
+    _logger.info('Committing')
+    await user_bulk.execute()
+
+
+@argmethod.wrap
+async def mark_dirty(domain_id: str, pid: document.convert_doc_id):
+  """Mark the accepters of a problem as changed other than by accept, e.g. rejudged, so that the
+  rp is recalculated by update_problem or compact."""
+  await db.coll('document').update_one({'domain_id': domain_id,
+                                        'doc_type': document.TYPE_PROBLEM,
+                                        'doc_id': pid},
+                                       {'$set': {'rp_dirty': True, 'rp_rescan': True}})
+
+
 @argmethod.wrap
 async def update_problem(domain_id: str, pid: document.convert_doc_id):
   dudoc_incs = {}
   pdoc = await problem.get(domain_id, pid)
   _logger.info('Domain {0} Problem {1}'.format(domain_id, pdoc['doc_id']))
+  # The users' rp of the problem reflects rp_num accepters, absent if never set by this module.
+  num_applied = pdoc.get('rp_num')
+  # Unset before reading the statuses, so that a concurrent rejudge marks the problem again.
+  await db.coll('document').update_one({'_id': pdoc['_id']},
+                                       {'$set': {'rp_num': pdoc['num_accept']},
+                                        '$unset': {'rp_dirty': '', 'rp_rescan': ''}})
   status_coll = db.coll('document.status')
   status_bulk = status_coll.initialize_unordered_bulk_op()
   # Accepteds adjustment
@@ -54,15 +172,19 @@ async def update_problem(domain_id: str, pid: document.convert_doc_id):
                                     doc_id=pdoc['doc_id'],
                                     status=constant.record.STATUS_ACCEPTED).sort('rid', 1)
   order = 0
+  execute = False
   rp_func = get_rp_func(pdoc)
   async for psdoc in psdocs:
     order += 1
     rp = rp_func(order)
-    delta_rp = rp - psdoc.get('rp', 0.0)
-    status_bulk.find({'_id': psdoc['_id']}).update_one({'$set': {'rp': rp}})
     # (pid, uid) is unique.
     assert psdoc['uid'] not in dudoc_incs
-    dudoc_incs[psdoc['uid']] = {'rp': delta_rp}
+    dudoc_incs[psdoc['uid']] = rp - _get_applied_rp(psdoc, num_applied)
+    # Only the accepters whose rp changed are written, e.g. not the ones at RP_PROBLEM_MIN.
+    if 'rp_num' not in psdoc or abs(rp - psdoc.get('rp', 0.0)) > RP_MIN_DELTA:
+      execute = True
+      status_bulk.find({'_id': psdoc['_id']}).update_one({'$set': {'rp': rp,
+                                                                   'rp_num': pdoc['num_accept']}})
   if order != pdoc['num_accept']:
     _logger.warning('{0} != {1}'.format(order, pdoc['num_accept']))
     _logger.warning('Problem {0} num_accept may be inconsistent.'.format(pdoc['doc_id']))
@@ -72,38 +194,40 @@ async def update_problem(domain_id: str, pid: document.convert_doc_id):
                                     doc_id=pdoc['doc_id'],
                                     status={'$gt': constant.record.STATUS_ACCEPTED},
                                     rp={'$gt': 0.0})
-  execute = False
   async for psdoc in psdocs:
     rp = 0.0
-    delta_rp = rp - psdoc['rp']
     execute = True
-    status_bulk.find({'_id': psdoc['_id']}).update_one({'$set': {'rp': rp}})
+    status_bulk.find({'_id': psdoc['_id']}).update_one({'$set': {'rp': rp,
+                                                                 'rp_num': pdoc['num_accept']}})
     # (pid, uid) is unique.
     assert psdoc['uid'] not in dudoc_incs
-    dudoc_incs[psdoc['uid']] = {'rp': delta_rp}
-  if order > 0 or execute:
+    dudoc_incs[psdoc['uid']] = rp - _get_applied_rp(psdoc, num_applied)
+  if execute:
     _logger.info('Committing')
     await status_bulk.execute()
   # users' rp
-  user_coll = db.coll('domain.user')
-  user_bulk = user_coll.initialize_unordered_bulk_op()
-  execute = False
-  _logger.info('Updating users')
-  for uid, dudoc_inc in dudoc_incs.items():
-    if abs(dudoc_inc['rp']) > RP_MIN_DELTA:
-      execute = True
-      user_bulk.find({'domain_id': domain_id, 'uid': uid}).upsert().update_one({'$inc': dudoc_inc})
-  if execute:
-    _logger.info('Committing')
-    await user_bulk.execute()
+  await _inc_users(domain_id, dudoc_incs)
+
 
 @domainjob.wrap
-async def recalc(domain_id: str):
-  user_coll = db.coll('domain.user')
-  await user_coll.update_many({'domain_id': domain_id}, {'$set': {'rp': 0.0}})
+async def compact(domain_id: str):
+  """Persist the rp of the problems marked rp_dirty by accept or mark_dirty."""
+  pdocs = problem.get_multi(domain_id=domain_id, rp_dirty=True, fields={'doc_id': 1})
+  async for pdoc in pdocs:
+    await update_problem(domain_id, pdoc['doc_id'])
+
+
+@domainjob.wrap
+async def recalc(domain_id: str, checkpoint=None):
+  query = {}
+  if checkpoint:
+    await checkpoint.set_total(await problem.get_multi(domain_id=domain_id).count())
+    if checkpoint.value is not None:
+      # doc_id may be of mixed types, which $gt does not compare, so resume by _id.
+      query['_id'] = {'$gt': checkpoint.value}
   pdocs = problem.get_multi(domain_id=domain_id,
-                            fields={'_id': 1, 'doc_id': 1, 'num_accept': 1}).sort('doc_id', 1)
-  dudoc_updates = {}
+                            fields={'_id': 1, 'doc_id': 1, 'num_accept': 1},
+                            **query).sort('_id', 1)
   status_coll = db.coll('document.status')
   async for pdoc in pdocs:
     _logger.info('Problem {0}'.format(pdoc['doc_id']))
@@ -116,25 +240,52 @@ async def recalc(domain_id: str):
     async for psdoc in psdocs:
       order += 1
       rp = rp_func(order)
-      status_bulk.find({'_id': psdoc['_id']}).update_one({'$set': {'rp': rp}})
-      if psdoc['uid'] not in dudoc_updates:
-        dudoc_updates[psdoc['uid']] = {'rp': rp}
-      else:
-        dudoc_updates[psdoc['uid']]['rp'] += rp
+      status_bulk.find({'_id': psdoc['_id']}).update_one({'$set': {'rp': rp,
+                                                                   'rp_num': pdoc['num_accept']}})
     if order != pdoc['num_accept']:
       _logger.warning('{0} != {1}'.format(order, pdoc['num_accept']))
       _logger.warning('Problem {0} num_accept may be inconsistent.'.format(pdoc['doc_id']))
+    # Was Accepted but Now Not Accepteds adjustment
+    psdocs = problem.get_multi_status(domain_id=domain_id,
+                                      doc_id=pdoc['doc_id'],
+                                      status={'$gt': constant.record.STATUS_ACCEPTED},
+                                      rp={'$gt': 0.0},
+                                      fields={'_id': 1})
+    async for psdoc in psdocs:
+      order += 1
+      status_bulk.find({'_id': psdoc['_id']}).update_one({'$set': {'rp': 0.0}})
     if order > 0:
       _logger.info('Committing')
       await status_bulk.execute()
-  # users' rp
+    await db.coll('document').update_one({'_id': pdoc['_id']},
+                                         {'$set': {'rp_num': pdoc['num_accept']},
+                                          '$unset': {'rp_dirty': '', 'rp_rescan': ''}})
+    if checkpoint:
+      await checkpoint.save(pdoc['_id'])
+  # users' rp, summed up from the statuses so that it does not depend on the problems done
+  # before resuming.
+  pipeline = [
+    {
+      '$match': {'domain_id': domain_id,
+                 'doc_type': document.TYPE_PROBLEM,
+                 'rp': {'$gt': 0.0}}
+    },
+    {
+      '$group': {
+        '_id': '$uid',
+        'rp': {'$sum': '$rp'}
+      }
+    }
+  ]
+  user_coll = db.coll('domain.user')
   user_bulk = user_coll.initialize_unordered_bulk_op()
   execute = False
   _logger.info('Updating users')
-  for uid, dudoc_update in dudoc_updates.items():
+  async for adoc in await status_coll.aggregate(pipeline):
     execute = True
-    user_bulk.find({'domain_id': domain_id, 'uid': uid}) \
-             .upsert().update_one({'$set': dudoc_update})
+    user_bulk.find({'domain_id': domain_id, 'uid': adoc['_id']}) \
+             .upsert().update_one({'$set': {'rp': adoc['rp']}})
+  await user_coll.update_many({'domain_id': domain_id}, {'$set': {'rp': 0.0}})
   if execute:
     _logger.info('Committing')
     await user_bulk.execute()
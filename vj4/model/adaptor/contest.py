@@ -1,7 +1,9 @@
 import asyncio
 import collections
+import csv
 import datetime
 import functools
+import io
 import itertools
 
 from bson import objectid
@@ -11,13 +13,25 @@ from vj4 import constant
 from vj4 import error
 from vj4.model import builtin
 from vj4.model import document
+from vj4.model import record
 from vj4.model import user
 from vj4.model import domain
 from vj4.model.adaptor import problem
+from vj4.service import bus
+from vj4.service import event
 from vj4.util import argmethod
 from vj4.util import misc
+from vj4.util import options
 from vj4.util import rank
 from vj4.util import validator
+from vj4.util import zipstream
+
+options.define('scoreboard_coalesce_delay', default=1.0,
+               help='Seconds to coalesce contest status changes before rebuilding scoreboards.')
+options.define('scoreboard_max_age', default=60.0,
+               help='Maximum seconds to keep a materialized scoreboard.')
+options.define('scoreboard_max_entries', default=16,
+               help='Maximum number of materialized scoreboards per process.')
 
 
 journal_key_func = lambda j: j['rid']
@@ -32,9 +46,23 @@ Rule = collections.namedtuple('Rule', ['show_record_func',
 
 def _oi_stat(tdoc, journal):
   detail = list(dict((j['pid'], j) for j in journal if j['pid'] in tdoc['pids']).values())
+  return _oi_sum(detail)
+
+
+def _oi_sum(detail):
   return {'score': sum(d['score'] for d in detail), 'detail': detail}
 
 
+def _oi_detail_inc(tdoc, ddoc, j):
+  return j
+
+
+def _acm_time(tdoc, jdoc, naccept):
+  real = jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['begin_at']
+  penalty = datetime.timedelta(minutes=20) * naccept
+  return (real + penalty).total_seconds()
+
+
 def _acm_stat(tdoc, journal):
   naccept = collections.defaultdict(int)
   effective = {}
@@ -44,47 +72,71 @@ def _acm_stat(tdoc, journal):
       if not j['accept']:
         naccept[j['pid']] += 1
 
-  def time(jdoc):
-    real = jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['begin_at']
-    penalty = datetime.timedelta(minutes=20) * naccept[jdoc['pid']]
-    return (real + penalty).total_seconds()
+  detail = [{**j, 'naccept': naccept[j['pid']], 'time': _acm_time(tdoc, j, naccept[j['pid']])}
+            for j in effective.values()]
+  return _acm_sum(detail)
+
 
-  detail = [{**j, 'naccept': naccept[j['pid']], 'time': time(j)} for j in effective.values()]
+def _acm_sum(detail):
   return {'accept': sum(int(d['accept']) for d in detail),
           'time': sum(d['time'] for d in detail if d['accept']),
           'detail': detail}
 
 
+def _acm_detail_inc(tdoc, ddoc, j):
+  if ddoc and ddoc['accept']:
+    return ddoc
+  naccept = ddoc['naccept'] if ddoc else 0
+  if not j['accept']:
+    naccept += 1
+  return {**j, 'naccept': naccept, 'time': _acm_time(tdoc, j, naccept)}
+
+
+def _assignment_time(tdoc, jdoc):
+  real = jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['begin_at']
+  return real.total_seconds()
+
+
+def _assignment_penalty_score(tdoc, jdoc):
+  score = jdoc['score']
+  exceed_seconds = (jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['penalty_since']).total_seconds()
+  if exceed_seconds < 0:
+    return score
+  coefficient = 1
+  for p_time, p_coefficient in sorted(tdoc['penalty_rules'].items(), key=lambda x: int(x[0])):
+    if int(p_time) <= exceed_seconds:
+      coefficient = p_coefficient
+    else:
+      break
+  return score * coefficient
+
+
 def _assignment_stat(tdoc, journal):
   effective = {}
   for j in journal:
     if j['pid'] in tdoc['pids'] and not (j['pid'] in effective and effective[j['pid']]['accept']):
       effective[j['pid']] = j
 
-  def time(jdoc):
-    real = jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['begin_at']
-    return real.total_seconds()
-
-  def penalty_score(jdoc):
-    score = jdoc['score']
-    exceed_seconds = (jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['penalty_since']).total_seconds()
-    if exceed_seconds < 0:
-      return score
-    coefficient = 1
-    for p_time, p_coefficient in sorted(tdoc['penalty_rules'].items(), key=lambda x: int(x[0])):
-      if int(p_time) <= exceed_seconds:
-        coefficient = p_coefficient
-      else:
-        break
-    return score * coefficient
+  detail = [{**j, 'penalty_score': _assignment_penalty_score(tdoc, j),
+             'time': _assignment_time(tdoc, j)}
+            for j in effective.values()]
+  return _assignment_sum(detail)
 
-  detail = [{**j, 'penalty_score': penalty_score(j), 'time': time(j)} for j in effective.values()]
+
+def _assignment_sum(detail):
   return {'score': sum(d['score'] for d in detail),
           'penalty_score': sum(d['penalty_score'] for d in detail),
           'time': sum(d['time'] for d in detail),
           'detail': detail}
 
 
+def _assignment_detail_inc(tdoc, ddoc, j):
+  if ddoc and ddoc['accept']:
+    return ddoc
+  return {**j, 'penalty_score': _assignment_penalty_score(tdoc, j),
+          'time': _assignment_time(tdoc, j)}
+
+
 def _oi_equ_func(a, b):
   return a.get('score', 0) == b.get('score', 0)
 
@@ -102,7 +154,7 @@ def _oi_scoreboard(is_export, _, tdoc, ranked_tsdocs, udict, dudict, pdict):
     else:
       columns.append({'type': 'problem_detail',
                       'value': '#{0}'.format(index + 1), 'raw': pdict[pid]})
-  rows = [columns]
+  yield columns
   for rank, tsdoc in ranked_tsdocs:
     if 'detail' in tsdoc:
       tsddict = {item['pid']: item for item in tsdoc['detail']}
@@ -119,8 +171,7 @@ def _oi_scoreboard(is_export, _, tdoc, ranked_tsdocs, udict, dudict, pdict):
       row.append({'type': 'record',
                   'value': tsddict.get(pid, {}).get('score', '-'),
                   'raw': tsddict.get(pid, {}).get('rid', None)})
-    rows.append(row)
-  return rows
+    yield row
 
 
 def _acm_scoreboard(is_export, _, tdoc, ranked_tsdocs, udict, dudict, pdict):
@@ -143,7 +194,7 @@ def _acm_scoreboard(is_export, _, tdoc, ranked_tsdocs, udict, dudict, pdict):
     else:
       columns.append({'type': 'problem_detail',
                       'value': '#{0}'.format(index + 1), 'raw': pdict[pid]})
-  rows = [columns]
+  yield columns
   for rank, tsdoc in ranked_tsdocs:
     if 'detail' in tsdoc:
       tsddict = {item['pid']: item for item in tsdoc['detail']}
@@ -178,8 +229,7 @@ def _acm_scoreboard(is_export, _, tdoc, ranked_tsdocs, udict, dudict, pdict):
       else:
         row.append({'type': 'record',
                     'value': '{0}\n{1}'.format(col_accepted, col_time_str), 'raw': rdoc})
-    rows.append(row)
-  return rows
+    yield row
 
 
 def _assignment_scoreboard(is_export, _, tdoc, ranked_tsdocs, udict, dudict, pdict):
@@ -205,7 +255,7 @@ def _assignment_scoreboard(is_export, _, tdoc, ranked_tsdocs, udict, dudict, pdi
     else:
       columns.append({'type': 'problem_detail',
                       'value': '#{0}'.format(index + 1), 'raw': pdict[pid]})
-  rows = [columns]
+  yield columns
   for rank, tsdoc in ranked_tsdocs:
     if 'detail' in tsdoc:
       tsddict = {item['pid']: item for item in tsdoc['detail']}
@@ -238,8 +288,7 @@ def _assignment_scoreboard(is_export, _, tdoc, ranked_tsdocs, udict, dudict, pdi
         row.append({'type': 'record',
                     'value': '{0} / {1}\n{2}'.format(col_score, col_original_score, col_time_str),
                     'raw': rdoc})
-    rows.append(row)
-  return rows
+    yield row
 
 
 RULES = {
@@ -264,6 +313,110 @@ RULES = {
 }
 
 
+# Fields of the contest document which the stats depend on.
+STAT_TDOC_KEYS = ['rule', 'pids', 'begin_at', 'penalty_since', 'penalty_rules']
+
+# Incremental stat functions: (detail_inc_func, sum_func).
+#
+# detail_inc_func(tdoc, ddoc, jdoc) returns the new detail of a problem after a journal entry
+# newer than all the entries of the problem, given its previous detail ddoc (None if absent).
+# sum_func(detail) returns the stats from the details of all problems. Rules without incremental
+# stat functions always replay the whole journal.
+STAT_INC_FUNCS = {
+  constant.contest.RULE_OI: (_oi_detail_inc, _oi_sum),
+  constant.contest.RULE_ACM: (_acm_detail_inc, _acm_sum),
+  constant.contest.RULE_ASSIGNMENT: (_assignment_detail_inc, _assignment_sum),
+}
+
+# Materialized scoreboards of this process: (domain_id, doc_type, tid) -> future of Scoreboard.
+_scoreboards = collections.OrderedDict()
+
+
+class Scoreboard(object):
+  """Ranked status of a contest, shared by all the requests of a process.
+
+  The documents must not be modified. Rows returned by get_rows() are built once per language
+  and export mode.
+  """
+
+  def __init__(self, tdoc, ranked_tsdocs, udict, dudict, pdict):
+    self.tdoc = tdoc
+    self.ranked_tsdocs = ranked_tsdocs
+    self.udict = udict
+    self.dudict = dudict
+    self.pdict = pdict
+    self.expire_at = asyncio.get_event_loop().time() + options.scoreboard_max_age
+    self._rows = {}
+
+  def iter_rows(self, is_export, translate):
+    """Generates the columns and then the rows one by one, without keeping them."""
+    return RULES[self.tdoc['rule']].scoreboard_func(is_export, translate, self.tdoc,
+                                                    self.ranked_tsdocs, self.udict,
+                                                    self.dudict, self.pdict)
+
+  def get_rows(self, is_export, lang, translate):
+    key = (is_export, lang)
+    if key not in self._rows:
+      self._rows[key] = list(self.iter_rows(is_export, translate))
+    return self._rows[key]
+
+
+async def _build_scoreboard(domain_id, doc_type, tid):
+  tdoc, tsdocs = await get_and_list_status(domain_id, doc_type, tid)
+  uids = [tsdoc['uid'] for tsdoc in tsdocs]
+  udict, dudict, pdict = await asyncio.gather(user.get_dict(uids),
+                                              domain.get_dict_user_by_uid(domain_id, uids),
+                                              problem.get_dict(domain_id, tdoc['pids']))
+  ranked_tsdocs = list(RULES[tdoc['rule']].rank_func(tsdocs))
+  return Scoreboard(tdoc, ranked_tsdocs, udict, dudict, pdict)
+
+
+async def materialize_scoreboard(domain_id: str, doc_type: int, tid: objectid.ObjectId):
+  """Get the materialized scoreboard of a contest.
+
+  Concurrent callers in the same process share one build. The scoreboard is rebuilt after a
+  contest_scoreboard_change bus event, or when it is older than options.scoreboard_max_age.
+  """
+  if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
+    raise error.InvalidArgumentError('doc_type')
+  key = (domain_id, doc_type, tid)
+  future = _scoreboards.get(key)
+  if future and future.done() \
+      and (future.exception() or future.result().expire_at <= asyncio.get_event_loop().time()):
+    future = None
+  if not future:
+    future = asyncio.ensure_future(_build_scoreboard(domain_id, doc_type, tid))
+    _scoreboards[key] = future
+    if len(_scoreboards) > options.scoreboard_max_entries:
+      _scoreboards.popitem(False)
+  else:
+    _scoreboards.move_to_end(key)
+  return await asyncio.shield(future)
+
+
+def _publish_scoreboard_change(domain_id, doc_type, tid):
+  bus.publish_throttle('contest_scoreboard_change',
+                       {'domain_id': domain_id, 'doc_type': doc_type, 'tid': tid},
+                       ('contest_scoreboard_change', domain_id, doc_type, tid),
+                       options.scoreboard_coalesce_delay)
+
+
+async def _on_scoreboard_change(e):
+  key = (e['value']['domain_id'], e['value']['doc_type'], e['value']['tid'])
+  if key in _scoreboards:
+    del _scoreboards[key]
+  await event.publish('contest_scoreboard_update', key)
+
+
+def init():
+  bus.subscribe(_on_scoreboard_change, ['contest_scoreboard_change'])
+
+
+def uninit():
+  bus.unsubscribe(_on_scoreboard_change)
+  _scoreboards.clear()
+
+
 @argmethod.wrap
 async def add(domain_id: str, doc_type: int,
               title: str, content: str, owner_uid: int, rule: int,
@@ -331,7 +484,12 @@ async def edit(domain_id: str, doc_type: int, tid: objectid.ObjectId, **kwargs):
       raise error.ValidationError('penalty_since', 'begin_at')
     if 'end_at' in kwargs and kwargs['penalty_since'] > kwargs['end_at']:
       raise error.ValidationError('penalty_since', 'end_at')
-  return await document.set(domain_id, doc_type, tid, **kwargs)
+  tdoc = await document.set(domain_id, doc_type, tid, **kwargs)
+  if any(key in kwargs for key in STAT_TDOC_KEYS):
+    # The journal will be replayed on the next update.
+    await document.unset_multi_status(domain_id, doc_type, tid, 'stat_journal_size')
+  _publish_scoreboard_change(domain_id, doc_type, tid)
+  return tdoc
 
 
 def get_multi(domain_id: str, doc_type: int, fields=None, **kwargs):
@@ -358,6 +516,7 @@ async def attend(domain_id: str, doc_type: int, tid: objectid.ObjectId, uid: int
       raise error.ContestAlreadyAttendedError(domain_id, tid, uid) from None
     elif doc_type == document.TYPE_HOMEWORK:
       raise error.HomeworkAlreadyAttendedError(domain_id, tid, uid) from None
+  _publish_scoreboard_change(domain_id, doc_type, tid)
   return await document.inc(domain_id, doc_type, tid, 'attend', 1)
 
 
@@ -410,6 +569,36 @@ def _get_status_journal(tsdoc):
                                                     key=journal_key_func)]
 
 
+def _get_status_stats(tdoc, tsdoc):
+  """Replays the whole journal. Returns the fields to set."""
+  journal = _get_status_journal(tsdoc)
+  stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
+  return {**stats, 'journal': journal, 'stat_journal_size': len(journal)}
+
+
+def _apply_status_journal(tdoc, tsdoc, jdoc):
+  """Applies the last journal entry jdoc to the stats of the previous entries.
+
+  The entry is applied to the detail of its problem only, without replaying the journal.
+  Returns the fields to set, or None if the whole journal must be replayed, e.g. on rejudge,
+  when the entry is older than the detail of its problem, or when the stats are stale.
+  """
+  if tdoc['rule'] not in STAT_INC_FUNCS:
+    return None
+  if tsdoc.get('stat_journal_size', 0) != len(tsdoc['journal']) - 1 \
+      or tsdoc['journal'][-1] != jdoc:
+    return None
+  if jdoc['pid'] not in tdoc['pids']:
+    return {'stat_journal_size': len(tsdoc['journal'])}
+  detail_inc_func, sum_func = STAT_INC_FUNCS[tdoc['rule']]
+  detail = collections.OrderedDict((ddoc['pid'], ddoc) for ddoc in tsdoc.get('detail', []))
+  ddoc = detail.get(jdoc['pid'])
+  if ddoc and jdoc['rid'] <= ddoc['rid']:
+    return None
+  detail[jdoc['pid']] = detail_inc_func(tdoc, ddoc, jdoc)
+  return {**sum_func(list(detail.values())), 'stat_journal_size': len(tsdoc['journal'])}
+
+
 @argmethod.wrap
 async def update_status(domain_id: str, doc_type: int, tid: objectid.ObjectId, uid: int,
                         rid: objectid.ObjectId, pid: document.convert_doc_id,
@@ -418,9 +607,9 @@ async def update_status(domain_id: str, doc_type: int, tid: objectid.ObjectId, u
   if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
     raise error.InvalidArgumentError('doc_type')
   tdoc = await document.get(domain_id, doc_type, tid)
+  jdoc = {'rid': rid, 'pid': pid, 'accept': accept, 'score': score}
   tsdoc = await document.rev_push_status(
-    domain_id, tdoc['doc_type'], tdoc['doc_id'], uid,
-    'journal', {'rid': rid, 'pid': pid, 'accept': accept, 'score': score})
+    domain_id, tdoc['doc_type'], tdoc['doc_id'], uid, 'journal', jdoc)
   if 'attend' not in tsdoc or not tsdoc['attend']:
     if tdoc['doc_type'] == document.TYPE_CONTEST:
       raise error.ContestNotAttendedError(domain_id, tid, uid)
@@ -429,10 +618,12 @@ async def update_status(domain_id: str, doc_type: int, tid: objectid.ObjectId, u
     else:
       raise error.InvalidArgumentError('doc_type')
 
-  journal = _get_status_journal(tsdoc)
-  stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
+  stats = _apply_status_journal(tdoc, tsdoc, jdoc)
+  if stats is None:
+    stats = _get_status_stats(tdoc, tsdoc)
   tsdoc = await document.rev_set_status(domain_id, tdoc['doc_type'], tid, uid, tsdoc['rev'],
-                                        journal=journal, **stats)
+                                        **stats)
+  _publish_scoreboard_change(domain_id, doc_type, tid)
   return tsdoc
 
 
@@ -447,10 +638,10 @@ async def recalc_status(domain_id: str, doc_type: int, tid: objectid.ObjectId):
     async for tsdoc in tsdocs:
       if 'journal' not in tsdoc or not tsdoc['journal']:
         continue
-      journal = _get_status_journal(tsdoc)
-      stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
+      stats = _get_status_stats(tdoc, tsdoc)
       await document.rev_set_status(domain_id, doc_type, tid, tsdoc['uid'], tsdoc['rev'],
-                                    return_doc=False, journal=journal, **stats)
+                                    return_doc=False, **stats)
+  _publish_scoreboard_change(domain_id, doc_type, tid)
 
 
 def _parse_pids(pids_str):
@@ -535,24 +726,91 @@ class ContestVisibilityMixin(object):
     return False
 
 
+def _export_scoreboard_as_csv(rows):
+  output = io.StringIO()
+  # \r\n for notepad compatibility
+  writer = csv.writer(output, lineterminator='\r\n')
+  yield '\uFEFF'
+  for row in rows:
+    writer.writerow([column['value'] for column in row])
+    yield output.getvalue()
+    output.seek(0)
+    output.truncate()
+
+
+def _export_scoreboard_as_tsv(rows):
+  yield '\uFEFF'
+  for row in rows:
+    yield '\t'.join(' '.join(str(column['value']).split()) for column in row) + '\r\n'
+
+
 class ContestCommonOperationMixin(object):
+  SCOREBOARD_EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values',
+    'html': 'text/html',
+  }
+
   async def get_scoreboard(self, doc_type: int, tid: objectid.ObjectId, is_export: bool=False):
-    if doc_type not in [document.TYPE_CONTEST, document.TYPE_HOMEWORK]:
-      raise error.InvalidArgumentError('doc_type')
-    tdoc, tsdocs = await get_and_list_status(self.domain_id, doc_type, tid)
+    """Returns tdoc, rows and udict. Rows are a generator when is_export.
+
+    Rows for pages are shared with other requests and must not be modified.
+    """
+    scoreboard = await materialize_scoreboard(self.domain_id, doc_type, tid)
+    tdoc = scoreboard.tdoc
     if not self.can_show_scoreboard(tdoc):
       if doc_type == document.TYPE_CONTEST:
         raise error.ContestScoreboardHiddenError(self.domain_id, tid)
       elif doc_type == document.TYPE_HOMEWORK:
         raise error.HomeworkScoreboardHiddenError(self.domain_id, tid)
-    udict, dudict, pdict = await asyncio.gather(
-        user.get_dict([tsdoc['uid'] for tsdoc in tsdocs]),
-        domain.get_dict_user_by_uid(self.domain_id, [tsdoc['uid'] for tsdoc in tsdocs]),
-        problem.get_dict(self.domain_id, tdoc['pids']))
-    ranked_tsdocs = RULES[tdoc['rule']].rank_func(tsdocs)
-    rows = RULES[tdoc['rule']].scoreboard_func(is_export, self.translate, tdoc,
-                                                       ranked_tsdocs, udict, dudict, pdict)
-    return tdoc, rows, udict
+    if is_export:
+      rows = scoreboard.iter_rows(is_export, self.translate)
+    else:
+      rows = scoreboard.get_rows(is_export, self.view_lang, self.translate)
+    return tdoc, rows, scoreboard.udict
+
+  async def export_scoreboard(self, doc_type: int, tid: objectid.ObjectId, ext: str):
+    """Streams the exported scoreboard as an attachment, row by row."""
+    if ext not in self.SCOREBOARD_EXPORT_CONTENT_TYPES:
+      raise error.ValidationError('ext')
+    tdoc, rows, _ = await self.get_scoreboard(doc_type, tid, True)
+    if ext == 'csv':
+      chunks = _export_scoreboard_as_csv(rows)
+    elif ext == 'tsv':
+      chunks = _export_scoreboard_as_tsv(rows)
+    else:
+      chunks = self.generate_html('contest_scoreboard_download_html.html',
+                                  columns=next(rows), rows=rows)
+    await self.text_stream(chunks, self.SCOREBOARD_EXPORT_CONTENT_TYPES[ext],
+                           '{}.{}'.format(tdoc['title'], ext))
+
+  async def export_code(self, doc_type: int, tid: objectid.ObjectId):
+    """Streams the code of the effective records of all attendees as a zip archive.
+
+    Fetching the next record from the cursor overlaps with compressing the previous one.
+    """
+    tdoc, tsdocs = await get_and_list_status(self.domain_id, doc_type, tid,
+                                             fields={'uid': 1, 'detail': 1})
+    rnames = {}
+    for tsdoc in tsdocs:
+      for pdetail in tsdoc.get('detail', []):
+        rnames[pdetail['rid']] = 'U{}_P{}_R{}'.format(tsdoc['uid'], pdetail['pid'], pdetail['rid'])
+    zip_writer = zipstream.ZipStreamWriter(
+        await self.binary_stream('application/zip', file_name='{}.zip'.format(tdoc['title'])))
+    write_future = None
+    try:
+      async for rdoc in record.get_multi(get_hidden=True, _id={'$in': list(rnames.keys())},
+                                         fields={'_id': 1, 'lang': 1, 'code': 1}):
+        if write_future:
+          await write_future
+        write_future = asyncio.ensure_future(
+            zip_writer.write_data(rnames[rdoc['_id']] + '.' + rdoc['lang'], rdoc['code']))
+      if write_future:
+        await write_future
+    finally:
+      if write_future:
+        write_future.cancel()
+    await zip_writer.close()
 
   async def verify_problems(self, pids):
     pdocs = await problem.get_multi(domain_id=self.domain_id, doc_id={'$in': pids},
@@ -574,5 +832,45 @@ class ContestMixin(ContestStatusMixin, ContestVisibilityMixin, ContestCommonOper
   pass
 
 
+class ContestScoreboardConnectionMixin(ContestMixin):
+  """Pushes the changed rows of a scoreboard to an open scoreboard page.
+
+  Rows are identified by uid. Each message carries the rendered rows which changed and the new
+  order of all the uids, or reload if the columns changed.
+  """
+
+  async def open_scoreboard(self, doc_type, tid):
+    self.scoreboard_key = (self.domain_id, doc_type, tid)
+    self.tdoc, self.rows, _ = await self.get_scoreboard(doc_type, tid)
+    event.subscribe(self.on_scoreboard_update, ['contest_scoreboard_update'])
+
+  async def on_scoreboard_update(self, e):
+    if e['value'] != self.scoreboard_key:
+      return
+    try:
+      self.tdoc, rows, _ = await self.get_scoreboard(*self.scoreboard_key[1:])
+    except error.UserFacingError:
+      self.close()
+      return
+    if rows[0] != self.rows[0]:
+      self.rows = rows
+      self.send(reload=True)
+      return
+    old_rows = dict((row[1]['raw']['_id'], row) for row in self.rows[1:])
+    changed_rows = [row for row in rows[1:] if old_rows.get(row[1]['raw']['_id']) != row]
+    order = [row[1]['raw']['_id'] for row in rows[1:]]
+    if not changed_rows and order == [row[1]['raw']['_id'] for row in self.rows[1:]]:
+      return
+    self.rows = rows
+    self.send(rows=[{'uid': row[1]['raw']['_id'],
+                     'html': self.render_html('contest_scoreboard_tr.html', tdoc=self.tdoc,
+                                              columns=rows[0], row=row)}
+                    for row in changed_rows],
+              order=order)
+
+  def close_scoreboard(self):
+    event.unsubscribe(self.on_scoreboard_update)
+
+
 if __name__ == '__main__':
   argmethod.invoke_by_args()
@@ -17,6 +17,8 @@ from vj4.util import argmethod
 from vj4.util import validator
 
 
+DATA_CURSOR_EPOCH = datetime.datetime.utcfromtimestamp(0)
+
 SETTING_DIFFICULTY_ALGORITHM = 0
 SETTING_DIFFICULTY_ADMIN = 1
 SETTING_DIFFICULTY_AVERAGE = 2
@@ -39,9 +41,13 @@ async def add(domain_id: str, title: str, content: str, owner_uid: int,
               category: list=[], tag: list=[], hidden: bool=False, ac_msg=''):
   validator.check_title(title)
   validator.check_content(content)
+  kwargs = {}
+  if data and type(data) is not dict:
+    # A copy only has data when its source does, see copy.
+    kwargs['data_updated_at'] = datetime.datetime.utcnow()
   pid = await document.add(domain_id, content, owner_uid, document.TYPE_PROBLEM,
                            pid, title=title, data=data, category=category, tag=tag,
-                           hidden=hidden, num_submit=0, num_accept=0, ac_msg=ac_msg)
+                           hidden=hidden, num_submit=0, num_accept=0, ac_msg=ac_msg, **kwargs)
   await domain.inc_user(domain_id, owner_uid, num_problems=1)
   return pid
 
@@ -60,6 +66,9 @@ async def copy(pdoc, dest_domain_id: str, owner_uid: int,
                   pid=pid, hidden=hidden, category=pdoc['category'],
                   data=data, tag=pdoc.get('tag', []),
                   ac_msg=pdoc.get('ac_msg', ''))
+  if pdoc.get('data_updated_at'):
+    await document.set(dest_domain_id, document.TYPE_PROBLEM, pid,
+                       data_updated_at=datetime.datetime.utcnow())
   await document.inc(src_domain_id, document.TYPE_PROBLEM, src_pid, 'num_be_copied', 1)
   return pid
 
@@ -294,9 +303,16 @@ async def get_data(pdoc):
 
 @argmethod.wrap
 async def set_data(domain_id: str, pid: document.convert_doc_id, data: objectid.ObjectId):
-  pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, data=data)
+  now = datetime.datetime.utcnow()
+  pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, data=data, data_updated_at=now)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
+  # Copies of the problem link to its data.
+  coll = db.coll('document')
+  await coll.update_many({'doc_type': document.TYPE_PROBLEM,
+                          'data.domain': domain_id,
+                          'data.pid': pid},
+                         {'$set': {'data_updated_at': now}})
   await bus.publish('problem_data_change', {'domain_id': domain_id, 'pid': pid})
   return pdoc
 
@@ -309,23 +325,42 @@ async def set_hidden(domain_id: str, pid: document.convert_doc_id, hidden: bool)
   return pdoc
 
 
+def _format_data_cursor(data_updated_at, doc_oid):
+  millis = (data_updated_at - DATA_CURSOR_EPOCH) // datetime.timedelta(milliseconds=1)
+  return '{0}_{1}'.format(millis, doc_oid)
+
+
+def _parse_data_cursor(cursor):
+  try:
+    millis, doc_oid = cursor.split('_')
+    return DATA_CURSOR_EPOCH + datetime.timedelta(milliseconds=int(millis)), objectid.ObjectId(doc_oid)
+  except (ValueError, objectid.InvalidId):
+    raise error.ValidationError('cursor') from None
+
+
 @argmethod.wrap
-async def get_data_list(last: int):
-  last_datetime = datetime.datetime.utcfromtimestamp(last)
-  # TODO(twd2): performance improve, more elegant
+async def get_data_list(last: int=0, cursor: str=''):
+  """Get the problems whose data changed after a cursor, or after unix time last.
+
+  Returns a list of (domain_id, pid) ordered by change time, and the cursor to resume from.
+  """
+  query = {'doc_type': document.TYPE_PROBLEM}
+  if cursor:
+    data_updated_at, doc_oid = _parse_data_cursor(cursor)
+    query['$or'] = [{'data_updated_at': {'$gt': data_updated_at}},
+                    {'data_updated_at': data_updated_at, '_id': {'$gt': doc_oid}}]
+  else:
+    data_updated_at = datetime.datetime.utcfromtimestamp(last)
+    doc_oid = objectid.ObjectId(b'\0' * 12)
+    query['data_updated_at'] = {'$gt': data_updated_at}
   coll = db.coll('document')
-  pdocs = coll.find({'doc_type': document.TYPE_PROBLEM})
+  pdocs = coll.find(query, projection={'domain_id': 1, 'doc_id': 1, 'data_updated_at': 1}) \
+              .sort([('data_updated_at', 1), ('_id', 1)])
   pids = []  # with domain_id
   async for pdoc in pdocs:
-    data = await get_data(pdoc)
-    if not data:
-      continue
-    date = data['uploadDate']
-    if not date:
-      continue
-    if last_datetime < date:
-      pids.append((pdoc['domain_id'], pdoc['doc_id']))
-  return list(set(pids))
+    pids.append((pdoc['domain_id'], pdoc['doc_id']))
+    data_updated_at, doc_oid = pdoc['data_updated_at'], pdoc['_id']
+  return pids, _format_data_cursor(data_updated_at, doc_oid)
 
 
 @argmethod.wrap
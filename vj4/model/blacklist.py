@@ -1,6 +1,8 @@
 import datetime
 from vj4 import db
+from vj4.service import smallcache
 from vj4.util import argmethod
+from vj4.util import options
 
 
 @argmethod.wrap
@@ -10,6 +12,7 @@ async def add(ip: str):
   await coll.find_one_and_update({'_id': ip},
                                  {'$set': {'expire_at': expire_at}},
                                  upsert=True)
+  await smallcache.unset_global(smallcache.get_key(smallcache.PREFIX_BLACKLIST, ip))
 
 
 @argmethod.wrap
@@ -18,10 +21,17 @@ async def get(ip: str):
   return await coll.find_one({'_id': ip})
 
 
+@smallcache.cached(smallcache.PREFIX_BLACKLIST, lambda: options.smallcache_doc_ttl)
+async def get_cached(ip):
+  """Get a read-only blacklist entry, cached in this process for smallcache_doc_ttl seconds."""
+  return await get(ip)
+
+
 @argmethod.wrap
 async def delete(ip: str):
   coll = db.coll('blacklist')
   await coll.delete_one({'_id': ip})
+  await smallcache.unset_global(smallcache.get_key(smallcache.PREFIX_BLACKLIST, ip))
 
 
 @argmethod.wrap
@@ -247,6 +247,14 @@ async def set_status(domain_id, doc_type, doc_id, uid, **kwargs):
   return doc
 
 
+async def unset_multi_status(domain_id, doc_type, doc_id, *keys):
+  coll = db.coll('document.status')
+  return await coll.update_many({'domain_id': domain_id,
+                                 'doc_type': doc_type,
+                                 'doc_id': doc_id},
+                                {'$unset': dict((key, '') for key in keys)})
+
+
 @argmethod.wrap
 async def set_if_not_status(domain_id: str, doc_type: int, doc_id: convert_doc_id,
                             uid: int, key: str, value: int, if_not: int, **kwargs):
@@ -373,6 +381,11 @@ async def ensure_indexes():
                            ('hidden', 1),
                            ('tag', 1),
                            ('doc_id', 1)], sparse=True)
+  await coll.create_index([('doc_type', 1),
+                           ('data_updated_at', 1),
+                           ('_id', 1)], sparse=True)
+  await coll.create_index([('data.domain', 1),
+                           ('data.pid', 1)], sparse=True)
   # for problem solution
   await coll.create_index([('domain_id', 1),
                            ('doc_type', 1),
@@ -8,9 +8,14 @@ from vj4 import db
 from vj4 import error
 from vj4.model import builtin
 from vj4.model import system
+from vj4.service import smallcache
 from vj4.util import argmethod
+from vj4.util import options
 from vj4.util import validator
 
+# domain_id -> (roles_rev, compiled role permission masks), see get_all_roles.
+_roles_cache = {}
+
 PROJECTION_PUBLIC = {
   '_id': 1,
   'name': 1,
@@ -37,6 +42,7 @@ async def add(domain_id: str, owner_uid: int,
     domain_id = result.inserted_id
   except errors.DuplicateKeyError:
     raise error.DomainAlreadyExistError(domain_id) from None
+  _roles_cache.pop(domain_id, None)
   # grant root role to owner by default
   await add_user_role(domain_id, owner_uid, builtin.ROLE_ROOT)
   await coll.update_one({'_id': domain_id},
@@ -58,6 +64,7 @@ async def add_continue(domain_id: str, ensure_owner_uid: int=None):
   coll = db.coll('domain')
   await coll.update_one({'_id': domain_id},
                         {'$unset': {'pending': ''}})
+  await _unset_cache(domain_id)
 
 
 @argmethod.wrap
@@ -72,6 +79,16 @@ async def get(domain_id: str, fields=None):
   return ddoc
 
 
+@smallcache.cached(smallcache.PREFIX_DOMAIN, lambda: options.smallcache_doc_ttl)
+async def get_cached(domain_id):
+  """Get a read-only domain, cached in this process for smallcache_doc_ttl seconds."""
+  return await get(domain_id)
+
+
+async def _unset_cache(domain_id):
+  await smallcache.unset_global(smallcache.get_key(smallcache.PREFIX_DOMAIN, domain_id))
+
+
 def get_multi(*, fields=None, **kwargs):
   coll = db.coll('domain')
   return coll.find(kwargs, fields)
@@ -98,17 +115,21 @@ async def edit(domain_id: str, **kwargs):
   if 'name' in kwargs:
     validator.check_name(kwargs['name'])
   # TODO(twd2): check kwargs
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$set': {**kwargs}},
                                         return_document=ReturnDocument.AFTER)
+  await _unset_cache(domain_id)
+  return ddoc
 
 
 async def unset(domain_id, fields):
   # TODO(twd2): check fields
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$unset': dict((f, '') for f in set(fields))},
                                         return_document=ReturnDocument.AFTER)
+  await _unset_cache(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -148,9 +169,12 @@ async def set_roles(domain_id: str, roles):
     if domain['_id'] == domain_id:
       raise error.BuiltinDomainError(domain_id)
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
-                                        update={'$set': update},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
+                                        update={'$set': update, '$inc': {'roles_rev': 1}},
                                         return_document=ReturnDocument.AFTER)
+  _roles_cache.pop(domain_id, None)
+  await _unset_cache(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -171,10 +195,14 @@ async def delete_roles(domain_id: str, roles):
   await user_coll.update_many({'domain_id': domain_id, 'role': {'$in': list(roles)}},
                               {'$unset': {'role': ''}})
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$unset': dict(('roles.{0}'.format(role), '')
-                                                               for role in roles)},
+                                                               for role in roles),
+                                                '$inc': {'roles_rev': 1}},
                                         return_document=ReturnDocument.AFTER)
+  _roles_cache.pop(domain_id, None)
+  await _unset_cache(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -183,9 +211,11 @@ async def transfer(domain_id: str, old_owner_uid: int, new_owner_uid: int):
     if domain['_id'] == domain_id:
       raise error.BuiltinDomainError(domain_id)
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id, 'owner_uid': old_owner_uid},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id, 'owner_uid': old_owner_uid},
                                         update={'$set': {'owner_uid': new_owner_uid}},
                                         return_document=ReturnDocument.AFTER)
+  await _unset_cache(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -302,9 +332,21 @@ async def get_dict_user_by_domain_id(uid, *, fields=None):
 
 
 def get_all_roles(ddoc):
+  """Get the permission masks of all roles of a domain, including the built-in roles.
+
+  The table is compiled once per revision of the domain roles and must not be modified.
+  """
+  rev = ddoc.get('roles_rev', 0)
+  entry = _roles_cache.get(ddoc['_id'])
+  if entry and entry[0] == rev:
+    return entry[1]
   builtin_roles = {role: rd.default_permission for role, rd in builtin.BUILTIN_ROLE_DESCRIPTORS.items()}
   domain_roles = ddoc['roles']
-  return {**builtin_roles, **domain_roles}
+  roles = smallcache.freeze({**builtin_roles, **domain_roles})
+  if len(_roles_cache) >= options.smallcache_max_entries:
+    _roles_cache.clear()
+  _roles_cache[ddoc['_id']] = (rev, roles)
+  return roles
 
 
 def get_join_settings(ddoc, now):
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import mimetypes
 
@@ -42,12 +43,54 @@ async def add_file_object(content_type, file_object):
   return grid_in._id
 
 
+async def add_stream(content_type, read_chunk, max_length=None):
+  """Add a file from the chunks returned by read_chunk() until it returns empty bytes.
+
+  The file is linked instead if another file with the same content exists.
+  Returns a tuple of the file id and the length.
+  """
+  grid_in = await add(content_type)
+  length = 0
+  try:
+    chunk = await read_chunk()
+    while chunk:
+      length += len(chunk)
+      if max_length is not None and length > max_length:
+        raise error.FileTooLongError(max_length)
+      _, chunk = await asyncio.gather(grid_in.write(chunk), read_chunk())
+    await grid_in.close()
+  except:
+    await grid_in.abort()
+    raise
+  file_id = await link_by_md5(grid_in.md5, grid_in._id)
+  if file_id:
+    await unlink(grid_in._id)
+  else:
+    file_id = grid_in._id
+  return file_id, length
+
+
 async def get(file_id):
   """Get a file. Returns MotorGridOut."""
   fs = db.fs('fs')
   return await fs.get(file_id)
 
 
+def get_chunk_reader(grid_out):
+  """Returns a coroutine function reading the next chunk of a file, or empty bytes at the end."""
+  remaining = grid_out.length
+
+  async def read_chunk():
+    nonlocal remaining
+    if remaining <= 0:
+      return b''
+    chunk = (await grid_out.readchunk())[:remaining]
+    remaining -= len(chunk)
+    return chunk
+
+  return read_chunk
+
+
 async def get_by_secret(secret):
   """Get a file by secret. Returns MotorGridOut."""
   file_id = await get_file_id(str(secret))
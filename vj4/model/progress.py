@@ -0,0 +1,110 @@
+"""Progress of the domain jobs, see vj4.util.domainjob."""
+import datetime
+
+from pymongo import ReturnDocument
+
+from vj4 import db
+from vj4.util import argmethod
+
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+@argmethod.wrap
+async def begin(job: str, domain_id: str):
+  """Begin or resume a job on a domain.
+
+  Returns:
+    The progress document, with the checkpoint and the number done so far if resuming.
+  """
+  coll = db.coll('job_progress')
+  now = datetime.datetime.utcnow()
+  doc = await coll.find_one_and_update(filter={'job': job, 'domain_id': domain_id},
+                                       update={'$set': {'status': STATUS_RUNNING,
+                                                        'begin_at': now,
+                                                        'update_at': now},
+                                               '$setOnInsert': {'done': 0}},
+                                       upsert=True,
+                                       return_document=ReturnDocument.AFTER)
+  return await coll.find_one_and_update(filter={'_id': doc['_id']},
+                                        update={'$set': {'begin_done': doc['done']}},
+                                        return_document=ReturnDocument.AFTER)
+
+
+async def set_total(job: str, domain_id: str, total: int):
+  coll = db.coll('job_progress')
+  await coll.update_one({'job': job, 'domain_id': domain_id}, {'$set': {'total': total}})
+
+
+async def save(job: str, domain_id: str, checkpoint, done: int):
+  """Save the checkpoint to resume from, after done units of work."""
+  coll = db.coll('job_progress')
+  await coll.update_one({'job': job, 'domain_id': domain_id},
+                        {'$set': {'checkpoint': checkpoint, 'done': done,
+                                  'update_at': datetime.datetime.utcnow()}})
+
+
+@argmethod.wrap
+async def end(job: str, domain_id: str, status: str=STATUS_DONE):
+  coll = db.coll('job_progress')
+  await coll.update_one({'job': job, 'domain_id': domain_id},
+                        {'$set': {'status': status, 'update_at': datetime.datetime.utcnow()}})
+
+
+@argmethod.wrap
+async def get(job: str, domain_id: str):
+  coll = db.coll('job_progress')
+  return await coll.find_one({'job': job, 'domain_id': domain_id})
+
+
+def get_multi(*, fields=None, **kwargs):
+  coll = db.coll('job_progress')
+  return coll.find(kwargs, fields)
+
+
+@argmethod.wrap
+async def is_finished(job: str):
+  """Whether no domain of the last run of the job is left to do."""
+  coll = db.coll('job_progress')
+  return not await coll.find_one({'job': job, 'status': {'$ne': STATUS_DONE}})
+
+
+@argmethod.wrap
+async def reset(job: str):
+  """Forget the last run of the job, so that the next run starts over."""
+  coll = db.coll('job_progress')
+  await coll.delete_many({'job': job})
+
+
+def get_eta(doc, now=None):
+  """Get the estimated seconds left of a running job, or None if unknown."""
+  if doc['status'] != STATUS_RUNNING or not doc.get('total'):
+    return None
+  done = doc['done'] - doc.get('begin_done', 0)
+  if done <= 0:
+    return None
+  now = now or datetime.datetime.utcnow()
+  seconds = (now - doc['begin_at']).total_seconds()
+  return max(doc['total'] - doc['done'], 0) * seconds / done
+
+
+@argmethod.wrap
+async def get_status(job: str=None):
+  """Get the progress of the jobs, with the estimated seconds left."""
+  query = {'job': job} if job else {}
+  docs = await get_multi(**query).sort([('job', 1), ('domain_id', 1)]).to_list()
+  for doc in docs:
+    doc['eta'] = get_eta(doc)
+  return docs
+
+
+@argmethod.wrap
+async def ensure_indexes():
+  coll = db.coll('job_progress')
+  await coll.create_index([('job', 1),
+                           ('domain_id', 1)], unique=True)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
@@ -15,6 +15,42 @@ from vj4.util import validator
 
 PROJECTION_PUBLIC = {'code': 0}
 PROJECTION_ALL = None
+# Fields of a record carried by record_change events. Subscribers needing the code, cases or texts
+# fetch the record when the rev of the event is newer than what they have.
+CHANGE_FIELDS = ['_id', 'rev', 'hidden', 'status', 'score', 'time_ms', 'memory_kb', 'progress',
+                 'domain_id', 'pid', 'uid', 'lang', 'ttype', 'tid', 'type', 'rejudged']
+
+# Judge queues of the records with their weights, in the order of priority. Normal submissions keep
+# the original judge queue.
+JUDGE_QUEUE_CONTEST = 'judge-contest'
+JUDGE_QUEUE_SUBMISSION = 'judge'
+JUDGE_QUEUE_PRETEST = 'judge-pretest'
+JUDGE_QUEUE_REJUDGE = 'judge-rejudge'
+JUDGE_QUEUE_WEIGHTS = [(JUDGE_QUEUE_CONTEST, 8),
+                       (JUDGE_QUEUE_SUBMISSION, 4),
+                       (JUDGE_QUEUE_PRETEST, 2),
+                       (JUDGE_QUEUE_REJUDGE, 1)]
+
+
+def get_judge_queue(rdoc):
+  if rdoc.get('rejudged'):
+    return JUDGE_QUEUE_REJUDGE
+  if rdoc['type'] == constant.record.TYPE_PRETEST:
+    return JUDGE_QUEUE_PRETEST
+  if rdoc.get('tid'):
+    return JUDGE_QUEUE_CONTEST
+  return JUDGE_QUEUE_SUBMISSION
+
+
+async def get_judge_queue_stats():
+  return await queue.get_stats([key for key, _ in JUDGE_QUEUE_WEIGHTS])
+
+
+def publish_change(rdoc):
+  """Publish a record_change event with the change fields of the record."""
+  bus.publish_throttle('record_change',
+                       {key: rdoc[key] for key in CHANGE_FIELDS if key in rdoc},
+                       rdoc['_id'])
 
 
 @argmethod.wrap
@@ -23,7 +59,8 @@ async def add(domain_id: str, pid: document.convert_doc_id, type: int, uid: int,
               ttype=None, tid: objectid.ObjectId=None, hidden=False):
   validator.check_lang(lang)
   coll = db.coll('record')
-  doc = {'hidden': hidden,
+  doc = {'rev': 0,
+         'hidden': hidden,
          'status': constant.record.STATUS_WAITING,
          'score': 0,
          'time_ms': 0,
@@ -38,8 +75,8 @@ async def add(domain_id: str, pid: document.convert_doc_id, type: int, uid: int,
          'data_id': data_id,
          'type': type}
   rid = (await coll.insert_one(doc)).inserted_id
-  bus.publish_throttle('record_change', doc, rid)
-  post_coros = [queue.publish('judge', rid=rid)]
+  publish_change(doc)
+  post_coros = [queue.publish(get_judge_queue(doc), rid=rid)]
   if type == constant.record.TYPE_SUBMISSION:
     post_coros.extend([problem.inc_status(domain_id, pid, uid, 'num_submit', 1),
                        problem.inc(domain_id, pid, 'num_submit', 1),
@@ -68,11 +105,12 @@ async def rejudge(record_id: objectid.ObjectId, enqueue: bool=True):
                                                         'score': 0,
                                                         'time_ms': 0,
                                                         'memory_kb': 0,
-                                                        'rejudged': True}},
+                                                        'rejudged': True},
+                                               '$inc': {'rev': 1}},
                                        return_document=ReturnDocument.AFTER)
-  bus.publish_throttle('record_change', doc, doc['_id'])
+  publish_change(doc)
   if enqueue:
-    await queue.publish('judge', rid=doc['_id'])
+    await queue.publish(get_judge_queue(doc), rid=doc['_id'])
 
 
 @argmethod.wrap
@@ -143,7 +181,8 @@ async def begin_judge(record_id: objectid.ObjectId,
                                                         'compiler_texts': [],
                                                         'judge_texts': [],
                                                         'cases': [],
-                                                        'progress': 0.0}},
+                                                        'progress': 0.0},
+                                               '$inc': {'rev': 1}},
                                        return_document=ReturnDocument.AFTER)
   return doc
 
@@ -153,7 +192,7 @@ async def next_judge(record_id, judge_uid, judge_token, **kwargs):
   doc = await coll.find_one_and_update(filter={'_id': record_id,
                                                'judge_uid': judge_uid,
                                                'judge_token': judge_token},
-                                       update=kwargs,
+                                       update={**kwargs, '$inc': {'rev': 1}},
                                        return_document=ReturnDocument.AFTER)
   return doc
 
@@ -170,7 +209,8 @@ async def end_judge(record_id: objectid.ObjectId, judge_uid: int, judge_token: s
                                                         'time_ms': time_ms,
                                                         'memory_kb': memory_kb},
                                                '$unset': {'judge_token': '',
-                                                          'progress': ''}},
+                                                          'progress': ''},
+                                               '$inc': {'rev': 1}},
                                        return_document=ReturnDocument.AFTER)
   return doc
 
@@ -1,11 +1,14 @@
-import itertools
+import datetime
 from bson import objectid
 from pymongo import ReturnDocument
-import datetime
 
-from vj4.util import argmethod
-from vj4.db import mdb
+from vj4 import db
+from vj4 import error
 from vj4.model import builtin
+from vj4.model import domain
+from vj4.service import smallcache
+from vj4.util import argmethod
+from vj4.util import options
 
 
 def file_rename(course_id, type, student, data, file_extension):
@@ -42,5 +45,150 @@ def file_rename(course_id, type, student, data, file_extension):
   return None
 
 
+@argmethod.wrap
+async def add(report_id: int, course: int, title: str, content: str,
+              begin_at: lambda i: datetime.datetime.utcfromtimestamp(int(i)),
+              end_at: lambda i: datetime.datetime.utcfromtimestamp(int(i)),
+              year: int=None):
+  """Add a report. Returns the report id."""
+  if begin_at >= end_at:
+    raise error.ValidationError('begin_at', 'end_at')
+  if year is None:
+    year = datetime.datetime.utcnow().year
+  coll = db.coll('report')
+  doc = {'_id': objectid.ObjectId(),
+         'report_id': report_id,
+         'title': title,
+         'content': content,
+         'year': year,
+         'course': course,
+         'begin_at': begin_at,
+         'end_at': end_at}
+  await coll.insert_one(doc)
+  return doc['_id']
+
+
+@argmethod.wrap
+async def get(rid: objectid.ObjectId):
+  coll = db.coll('report')
+  doc = await coll.find_one({'_id': rid})
+  if not doc:
+    raise error.ReportNotFoundError(rid)
+  return doc
+
+
+def get_multi(*, fields=None, **kwargs):
+  coll = db.coll('report')
+  return coll.find(kwargs, projection=fields).sort('report_id')
+
+
+async def edit(rid: objectid.ObjectId, **kwargs):
+  if 'begin_at' in kwargs and 'end_at' in kwargs:
+    if kwargs['begin_at'] >= kwargs['end_at']:
+      raise error.ValidationError('begin_at', 'end_at')
+  coll = db.coll('report')
+  doc = await coll.find_one_and_update(filter={'_id': rid},
+                                       update={'$set': kwargs},
+                                       return_document=ReturnDocument.AFTER)
+  if not doc:
+    raise error.ReportNotFoundError(rid)
+  return doc
+
+
+@argmethod.wrap
+async def get_status(rid: objectid.ObjectId, uid: int, fields=None):
+  """Get the submission of a user to a report."""
+  coll = db.coll('ureport')
+  return await coll.find_one({'report_id': rid, 'user_id': uid}, projection=fields)
+
+
+def get_multi_status(*, fields=None, **kwargs):
+  coll = db.coll('ureport')
+  return coll.find(kwargs, projection=fields)
+
+
+async def set_status(rid: objectid.ObjectId, uid: int, **kwargs):
+  """Set fields of the submission of a user to a report, creating it if necessary.
+
+  Returns the submission document before the update, or None if it was created.
+  """
+  set_on_insert = {key: None for key in ['report_data', 'code_data'] if key not in kwargs}
+  update = {'$set': kwargs}
+  if set_on_insert:
+    update['$setOnInsert'] = set_on_insert
+  coll = db.coll('ureport')
+  doc = await coll.find_one_and_update(filter={'report_id': rid, 'user_id': uid},
+                                       update=update,
+                                       upsert=True,
+                                       return_document=ReturnDocument.BEFORE)
+  if not doc:
+    await smallcache.unset_global(smallcache.PREFIX_REPORT_ROSTER + str(rid))
+  return doc
+
+
+@argmethod.wrap
+async def get_roster(rid: objectid.ObjectId):
+  """Get the distinct uid, year, group and class of the users submitted to a report.
+
+  The result is cached for smallcache_doc_ttl seconds, since the year, group and class of the
+  users may change, and must not be modified.
+  """
+  key = smallcache.PREFIX_REPORT_ROSTER + str(rid)
+  roster = smallcache.get_direct(key)
+  if roster is None:
+    pipeline = [
+      {
+        '$match': {'report_id': rid}
+      },
+      {
+        '$lookup': {'from': 'user', 'localField': 'user_id', 'foreignField': '_id', 'as': 'user'}
+      },
+      {
+        '$unwind': '$user'
+      },
+      {
+        '$group': {
+          '_id': None,
+          'uid': {'$addToSet': '$user_id'},
+          'year': {'$addToSet': '$user.year'},
+          'group': {'$addToSet': '$user.group'},
+          '_class': {'$addToSet': '$user._class'}
+        }
+      },
+    ]
+    roster = {'uid': [], 'year': [], 'group': [], '_class': []}
+    async for doc in db.coll('ureport').aggregate(pipeline):
+      roster = {field: doc[field] for field in roster}
+    smallcache.set_local_direct(key, roster, options.smallcache_doc_ttl)
+  return roster
+
+
+@argmethod.wrap
+async def get_usage(uid: int):
+  dudoc = await domain.get_user(builtin.DOMAIN_ID_SYSTEM, uid)
+  if not dudoc:
+    return 0
+  return dudoc.get('usage_report', 0)
+
+
+@argmethod.wrap
+async def inc_usage(uid: int, usage: int, quota: int):
+  return await domain.inc_user_usage(builtin.DOMAIN_ID_SYSTEM, uid, 'usage_report', usage, quota)
+
+
+@argmethod.wrap
+async def dec_usage(uid: int, usage: int):
+  return await domain.inc_user(builtin.DOMAIN_ID_SYSTEM, uid, usage_report=-usage)
+
+
+@argmethod.wrap
+async def ensure_indexes():
+  coll = db.coll('report')
+  await coll.create_index('report_id')
+  status_coll = db.coll('ureport')
+  await status_coll.create_index([('report_id', 1),
+                                  ('user_id', 1)], unique=True)
 
 
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
@@ -7,7 +7,9 @@ from bson import objectid
 from vj4 import db
 from vj4 import error
 from vj4.model import builtin
+from vj4.service import smallcache
 from vj4.util import argmethod
+from vj4.util import options
 from vj4.util import pwhash
 from vj4.util import validator
 
@@ -68,6 +70,16 @@ async def get_by_uid(uid: int, fields=PROJECTION_VIEW):
   return await coll.find_one({'_id': uid}, fields)
 
 
+@smallcache.cached(smallcache.PREFIX_USER, lambda: options.smallcache_doc_ttl)
+async def get_by_uid_cached(uid):
+  """Get a read-only user by uid, cached in this process for smallcache_doc_ttl seconds."""
+  return await get_by_uid(uid)
+
+
+async def _unset_cache(uid):
+  await smallcache.unset_global(smallcache.get_key(smallcache.PREFIX_USER, uid))
+
+
 @argmethod.wrap
 async def get_by_uname(uname: str, fields=PROJECTION_VIEW):
   """Get a user by uname."""
@@ -139,6 +151,7 @@ async def set_password(uid: int, password: str):
                                        update={'$set': {'salt': salt,
                                                         'hash': pwhash.hash_vj4(password, salt)}},
                                        return_document=ReturnDocument.AFTER)
+  await _unset_cache(uid)
   return doc
 
 
@@ -164,12 +177,14 @@ async def change_password(uid: int, current_password: str, password: str):
                                        update={'$set': {'salt': salt,
                                                         'hash': pwhash.hash_vj4(password, salt)}},
                                        return_document=ReturnDocument.AFTER)
+  await _unset_cache(uid)
   return doc
 
 
 async def set_by_uid(uid, **kwargs):
   coll = db.coll('user')
   doc = await coll.find_one_and_update(filter={'_id': uid}, update={'$set': kwargs}, return_document=ReturnDocument.AFTER)
+  await _unset_cache(uid)
   return doc
 
 
@@ -11,6 +11,7 @@ import urllib.parse
 from aiohttp import web
 from coloredlogs import syslog
 from vj4 import app
+from vj4 import template
 from vj4.util import options
 
 
@@ -56,6 +57,8 @@ def main():
   else:
     _logger.error('Invalid listening scheme %s', url.scheme)
     return 1
+  if options.template_precompile:
+    template.precompile()
   for i in range(1, options.prefork):
     pid = os.fork()
     if not pid:
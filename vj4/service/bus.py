@@ -1,15 +1,27 @@
 import asyncio
+import collections
 import logging
 import pprint
+import time
 
 import bson
 
 from vj4 import mq
 from vj4.util import argmethod
+from vj4.util import options
+from vj4.util import subscription
+
+options.define('bus_flush_interval', default=.016,
+               help='Seconds to collect throttled bus events into one message.')
+options.define('bus_max_batch_size', default=256,
+               help='Maximum number of events in one bus message.')
 
 _logger = logging.getLogger(__name__)
-_subscribers = dict()
-_throttles = dict()
+_subscribers = subscription.SubscriberIndex()
+_batches = dict()  # delay -> OrderedDict of throttle_id -> (key, value)
+_flush_handles = dict()  # delay -> timer handle to flush the batch
+_stats = collections.Counter()
+_stats_since = time.time()
 
 
 async def init():
@@ -23,16 +35,24 @@ async def _consume():
   queue = await channel.queue_declare(exclusive=True, auto_delete=True)
   queue_name = queue['queue']
   await channel.queue_bind(queue_name, 'bus', '')
+  await channel.basic_consume(_on_message, queue_name)
+  return channel
 
-  async def on_message(channel, body, envelope, properties):
-    e = bson.BSON.decode(body)
-    coroutines = [subscriber(e)
-                  for subscriber, key_set in _subscribers.items()
-                  if e['key'] in key_set]
-    await asyncio.gather(*coroutines)
 
-  await channel.basic_consume(on_message, queue_name)
-  return channel
+def _decode(body):
+  """Decode a bus message into its list of events, which is a batch or a single event."""
+  doc = bson.BSON.decode(body)
+  return doc['batch'] if 'batch' in doc else [doc]
+
+
+async def _on_message(channel, body, envelope, properties):
+  events = _decode(body)
+  _stats['received_messages'] += 1
+  _stats['received_events'] += len(events)
+  coroutines = [subscriber(e)
+                for e in events
+                for subscriber in _subscribers.match(e['key'], e['value'])]
+  await asyncio.gather(*coroutines)
 
 
 async def _work(channel):
@@ -50,24 +70,76 @@ async def _work(channel):
 async def publish(key: str, value: str):
   channel = await mq.channel('bus')
   await channel.basic_publish(bson.BSON.encode({'key': key, 'value': value}), 'bus', '')
+  _stats['published_messages'] += 1
+  _stats['published_events'] += 1
 
 
-def publish_throttle(key, value, throttle_id, delay=.016):
-  loop = asyncio.get_event_loop()
-  if throttle_id not in _throttles:
-    loop.call_later(delay, lambda: loop.create_task(publish(key, _throttles.pop(throttle_id))))
-  _throttles[throttle_id] = value
+async def publish_batch(events):
+  """Publish a list of events in one bus message.
+
+  Args:
+    events: list of dict with key and value.
+  """
+  channel = await mq.channel('bus')
+  await channel.basic_publish(bson.BSON.encode({'batch': events}), 'bus', '')
+  _stats['published_messages'] += 1
+  _stats['published_events'] += len(events)
+  _stats['max_batch_size'] = max(_stats['max_batch_size'], len(events))
 
 
-def subscribe(callback, keys):
+def publish_throttle(key, value, throttle_id, delay=None):
+  """Publish an event after a delay, together with other throttled events of the same delay.
+
+  Events of the same throttle id in a delay are coalesced, only the last value is published.
+  """
+  if delay is None:
+    delay = options.bus_flush_interval
+  batch = _batches.get(delay)
+  if batch is None:
+    batch = _batches[delay] = collections.OrderedDict()
+    _flush_handles[delay] = asyncio.get_event_loop().call_later(delay, _flush, delay)
+  elif throttle_id in batch:
+    _stats['coalesced_events'] += 1
+  batch[throttle_id] = (key, value)
+  if len(batch) >= options.bus_max_batch_size:
+    _flush(delay)
+
+
+def _flush(delay):
+  _flush_handles.pop(delay).cancel()
+  batch = _batches.pop(delay)
+  loop = asyncio.get_event_loop()
+  if len(batch) == 1:
+    (key, value), = batch.values()
+    loop.create_task(publish(key, value))
+  else:
+    loop.create_task(publish_batch([{'key': key, 'value': value}
+                                    for key, value in batch.values()]))
+
+
+def get_stats():
+  """Get the counters of bus messages and events of this process, and the rates per second."""
+  stats = {key: _stats[key] for key in ['published_messages', 'published_events',
+                                        'received_messages', 'received_events',
+                                        'coalesced_events', 'max_batch_size']}
+  seconds = max(time.time() - _stats_since, 1e-3)
+  stats['published_events_per_second'] = _stats['published_events'] / seconds
+  stats['published_messages_per_second'] = _stats['published_messages'] / seconds
+  stats['average_batch_size'] = (_stats['published_events'] / _stats['published_messages']
+                                 if _stats['published_messages'] else 0.0)
+  return stats
+
+
+def subscribe(callback, keys, filter=None):
   """Subscibe a set of bus keys for a callback.
 
   Args:
     callback: coroutine function for bus callback.
     keys: list, set or tuple of object for event keys.
+    filter: optional dict of field to value which the event value must match.
   """
   assert type(keys) in (set, list, tuple)
-  _subscribers[callback] = keys
+  _subscribers.add(callback, keys, filter)
 
 
 def unsubscribe(callback):
@@ -76,8 +148,7 @@ def unsubscribe(callback):
   Args:
     callback: coroutine function for bus callback.
   """
-  if callback in _subscribers:
-    del _subscribers[callback]
+  _subscribers.remove(callback)
 
 
 @argmethod.wrap
@@ -89,7 +160,10 @@ async def tail():
   await channel.queue_bind(queue_name, 'bus', '')
 
   async def on_message(channel, body, envelope, properties):
-    pprint.pprint(bson.BSON.decode(body))
+    events = _decode(body)
+    for e in events:
+      pprint.pprint(e)
+    print('# {0} event(s), {1} bytes'.format(len(events), len(body)))
 
   await channel.basic_consume(on_message, queue_name)
   await channel.close_event.wait()
@@ -6,26 +6,31 @@ which broadcasts events to all processes connected to the database.
 import asyncio
 
 from vj4.util import argmethod
+from vj4.util import subscription
 
-_subscribers = {}
+_subscribers = subscription.SubscriberIndex()
 
 
 async def publish(key, value):
   coroutines = [subscriber({'key': key, 'value': value})
-                for subscriber, key_set in _subscribers.items()
-                if key in key_set]
+                for subscriber in _subscribers.match(key, value)]
   await asyncio.gather(*coroutines)
 
 
-def subscribe(callback, keys):
+async def publish_batch(events):
+  await asyncio.gather(*[publish(e['key'], e['value']) for e in events])
+
+
+def subscribe(callback, keys, filter=None):
   """Subscibe a set of event keys for a callback.
 
   Args:
     callback: coroutine function for event callback.
     keys: list, set or tuple of object for event keys.
+    filter: optional dict of field to value which the event value must match.
   """
   assert type(keys) in (set, list, tuple)
-  _subscribers[callback] = keys
+  _subscribers.add(callback, keys, filter)
 
 
 def unsubscribe(callback):
@@ -34,8 +39,7 @@ def unsubscribe(callback):
   Args:
     callback: coroutine function for event callback.
   """
-  if callback in _subscribers:
-    del _subscribers[callback]
+  _subscribers.remove(callback)
 
 
 def subscribes(keys):
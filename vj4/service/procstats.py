@@ -0,0 +1,66 @@
+"""Stats of the server processes, shared over the bus.
+
+Each process publishes the stats of the registered providers every procstats_interval seconds and
+keeps the latest stats published by every process, so that any process can show them all.
+"""
+import asyncio
+import collections
+import logging
+import os
+import socket
+import time
+
+from vj4.service import bus
+from vj4.util import options
+
+options.define('procstats_interval', default=5,
+               help='Seconds between publishing the stats of this process.')
+
+_logger = logging.getLogger(__name__)
+_providers = collections.OrderedDict()  # name -> function returning the stats
+_processes = dict()  # process id -> (received at, dict of name -> stats)
+_process_id = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+
+def init():
+  register('bus', bus.get_stats)
+  bus.subscribe(_on_stats, ['procstats'])
+  asyncio.get_event_loop().create_task(_publish_forever())
+
+
+def register(name, func):
+  """Register a function returning the stats of this process, which must be BSON encodable."""
+  _providers[name] = func
+
+
+def get_local():
+  return {name: func() for name, func in _providers.items()}
+
+
+async def _publish_forever():
+  while True:
+    try:
+      await bus.publish('procstats', {'process': _process_id, 'stats': get_local()})
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      _logger.warning('Failed to publish process stats: %s', repr(e))
+    await asyncio.sleep(options.procstats_interval)
+
+
+async def _on_stats(e):
+  _processes[e['value']['process']] = (time.time(), e['value']['stats'])
+
+
+def get(name):
+  """Get the stats of name of the live processes.
+
+  Returns:
+    A list of (process id, stats), sorted by the process id.
+  """
+  expire_at = time.time() - 3 * options.procstats_interval
+  for process, (received_at, _) in list(_processes.items()):
+    if received_at < expire_at:
+      del _processes[process]
+  return [(process, stats[name])
+          for process, (_, stats) in sorted(_processes.items()) if name in stats]
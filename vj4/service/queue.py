@@ -1,3 +1,10 @@
+import asyncio
+import collections
+import functools
+import logging
+import time
+
+import aioamqp
 import bson
 
 from vj4 import mq
@@ -5,6 +12,8 @@ from vj4.util import options
 
 options.define('queue_prefetch', default=1, help='Queue prefetch count.')
 
+_logger = logging.getLogger(__name__)
+
 
 async def publish(key, **kwargs):
   channel = await mq.channel('queue')
@@ -19,3 +28,210 @@ async def consume(key, on_message):
   await channel.basic_consume((lambda channel, body, envelope, properties:
                                on_message(envelope.delivery_tag, **bson.BSON.decode(body))), key)
   return channel
+
+
+async def get_stats(keys):
+  """Get the number of ready messages of queues.
+
+  Returns:
+    A list of dict with key and message_count.
+  """
+  channel = await mq.channel('queue')
+  results = await asyncio.gather(*[channel.queue_declare(key) for key in keys])
+  return [{'key': key, 'message_count': result['message_count']}
+          for key, result in zip(keys, results)]
+
+
+class WeightedConsumer(object):
+  """Consumer of several queues which dispatches messages by smooth weighted round robin.
+
+  The queues are consumed on one channel whose global prefetch is the window, that is prefetch
+  plus one message of lookahead per queue, so the unacknowledged messages held by the consumer
+  are bounded no matter how many queues there are. The deliveries are buffered per queue, and at
+  most prefetch of them are dispatched to on_message at a time, picking the queue by weight, so
+  that a busy queue of a high weight does not starve the queues of a lower weight.
+
+  The prefetch starts at max_prefetch. A dispatched message times out when it makes no progress
+  (see touch) for timeout seconds, in which case the prefetch is halved and on_timeout is called
+  with its delivery tag to return it with basic_client_nack. Each ack grows the prefetch back by one.
+  When the window shrinks, the buffered messages beyond it are returned to their queues, those of
+  the lowest weight first.
+  """
+
+  def __init__(self, channel, weights, on_message, *, max_prefetch=None, timeout=None,
+               on_timeout=None):
+    self.channel = channel
+    self.weights = weights
+    self.on_message = on_message
+    self.max_prefetch = max_prefetch or options.queue_prefetch
+    self.prefetch = self.max_prefetch
+    self.timeout = timeout
+    self.on_timeout = on_timeout
+    self.inflight = {}  # delivery_tag -> {'key', 'fetched_at', 'updated_at', 'timeout_handle'}
+    self.num_timeouts = 0
+    self._buffers = {key: collections.deque() for key, _ in weights}
+    self._credits = {key: 0 for key, _ in weights}
+    self._qos_window = None
+    self._qos_task = None
+
+  @property
+  def close_event(self):
+    return self.channel.close_event
+
+  @property
+  def window(self):
+    return self.prefetch + len(self.weights)
+
+  def start(self):
+    self._qos_task = asyncio.get_event_loop().create_task(self._start())
+
+  def set_max_prefetch(self, max_prefetch):
+    self.max_prefetch = max_prefetch
+    self._set_prefetch(max_prefetch)
+
+  def touch(self, delivery_tag):
+    """Marks progress on a dispatched message, which postpones its timeout."""
+    entry = self.inflight.get(delivery_tag)
+    if entry:
+      entry['updated_at'] = time.time()
+
+  async def basic_client_ack(self, delivery_tag):
+    self._pop(delivery_tag)
+    if self.prefetch < self.max_prefetch:
+      self._set_prefetch(self.prefetch + 1)
+    else:
+      self._dispatch()
+    await self.channel.basic_client_ack(delivery_tag)
+
+  async def basic_client_nack(self, delivery_tag):
+    """Returns the message to its queue."""
+    self._pop(delivery_tag)
+    self._dispatch()
+    await self.channel.basic_client_nack(delivery_tag, requeue=True)
+
+  async def close(self):
+    for entry in self.inflight.values():
+      if entry['timeout_handle']:
+        entry['timeout_handle'].cancel()
+    await self.channel.close()
+
+  def _set_prefetch(self, prefetch):
+    self.prefetch = prefetch
+    self._dispatch()
+    if not self._qos_task or self._qos_task.done():
+      self._qos_task = asyncio.get_event_loop().create_task(self._qos())
+
+  async def _start(self):
+    await self._qos()
+    try:
+      for key, _ in self.weights:
+        await self.channel.basic_consume(functools.partial(self._on_delivery, key),
+                                         queue_name=key)
+    except aioamqp.AioamqpException as e:
+      _logger.warning('Failed to consume %s: %s', [key for key, _ in self.weights], repr(e))
+      return
+    # The prefetch may have changed while consuming.
+    await self._qos()
+
+  async def _qos(self):
+    """Sets the global prefetch of the channel to the window until they match."""
+    try:
+      while self._qos_window != self.window:
+        window = self._qos_window = self.window
+        await self.channel.basic_qos(prefetch_count=window, connection_global=True)
+        await self._requeue_surplus()
+    except aioamqp.AioamqpException as e:
+      _logger.warning('Failed to set the prefetch of %s: %s',
+                      [key for key, _ in self.weights], repr(e))
+
+  async def _requeue_surplus(self):
+    """Returns the buffered messages beyond the window, those of the lowest weight first."""
+    surplus = len(self.inflight) + sum(map(len, self._buffers.values())) - self._qos_window
+    for key, _ in reversed(self.weights):
+      while surplus > 0 and self._buffers[key]:
+        delivery_tag, _ = self._buffers[key].pop()
+        await self.channel.basic_client_nack(delivery_tag, requeue=True)
+        surplus -= 1
+
+  async def _on_delivery(self, key, channel, body, envelope, properties):
+    self._buffers[key].append((envelope.delivery_tag, body))
+    self._dispatch()
+
+  def _pick(self):
+    """Picks the queue of the next message by smooth weighted round robin, or None if empty."""
+    total = 0
+    picked = None
+    for key, weight in self.weights:
+      if not self._buffers[key]:
+        # An empty queue does not save up credits for later.
+        self._credits[key] = 0
+        continue
+      total += weight
+      self._credits[key] += weight
+      if not picked or self._credits[key] > self._credits[picked]:
+        picked = key
+    if picked:
+      self._credits[picked] -= total
+    return picked
+
+  def _dispatch(self):
+    while len(self.inflight) < self.prefetch:
+      key = self._pick()
+      if not key:
+        break
+      delivery_tag, body = self._buffers[key].popleft()
+      now = time.time()
+      self.inflight[delivery_tag] = {'key': key, 'fetched_at': now, 'updated_at': now,
+                                     'timeout_handle': self._call_timeout(delivery_tag,
+                                                                          self.timeout)}
+      asyncio.get_event_loop().create_task(
+          self._deliver(delivery_tag, bson.BSON.decode(body)))
+
+  async def _deliver(self, delivery_tag, message):
+    try:
+      await self.on_message(delivery_tag, **message)
+    except Exception as e:
+      _logger.exception('Failed to handle message %s: %s', delivery_tag, repr(e))
+
+  def _call_timeout(self, delivery_tag, delay):
+    if not self.timeout:
+      return None
+    return asyncio.get_event_loop().call_later(delay, self._on_timeout, delivery_tag)
+
+  def _on_timeout(self, delivery_tag):
+    entry = self.inflight.get(delivery_tag)
+    if not entry:
+      return
+    remaining = entry['updated_at'] + self.timeout - time.time()
+    if remaining > 0:
+      entry['timeout_handle'] = self._call_timeout(delivery_tag, remaining)
+      return
+    entry['timeout_handle'] = None
+    self.num_timeouts += 1
+    self._set_prefetch(max(self.prefetch // 2, 1))
+    if self.on_timeout:
+      asyncio.get_event_loop().create_task(self.on_timeout(delivery_tag))
+
+  def _pop(self, delivery_tag):
+    entry = self.inflight.pop(delivery_tag, None)
+    if entry and entry['timeout_handle']:
+      entry['timeout_handle'].cancel()
+
+
+async def consume_weighted(weights, on_message, **kwargs):
+  """Consume several queues with weighted fairness.
+
+  Args:
+    weights: list of (key, weight), in the order of priority.
+    on_message: coroutine function called with the delivery tag and the message.
+    **kwargs: max_prefetch, timeout and on_timeout of the WeightedConsumer.
+
+  Returns:
+    The WeightedConsumer, which must be used to acknowledge the messages.
+  """
+  channel = await mq.channel()
+  for key, _ in weights:
+    await channel.queue_declare(key)
+  consumer = WeightedConsumer(channel, weights, on_message, **kwargs)
+  consumer.start()
+  return consumer
@@ -1,20 +1,97 @@
 import collections
 import copy
+import functools
+import sys
+import time
 
 from vj4.service import bus
 from vj4.util import options
 
 PREFIX_DISCUSSION_NODES = 'discussion-nodes-'
+PREFIX_REPORT_ROSTER = 'report-roster-'
+PREFIX_DOMAIN = 'domain-'
+PREFIX_USER = 'user-'
+PREFIX_BLACKLIST = 'blacklist-'
 
-options.define('smallcache_max_entries', default=64,
+options.define('smallcache_max_entries', default=1024,
                help='Maximum number of entries in smallcache.')
+options.define('smallcache_max_bytes', default=32 * 2 ** 20,
+               help='Maximum estimated size of the values in smallcache, in bytes.')
+options.define('smallcache_doc_ttl', default=60,
+               help='Seconds to cache the domain, user and blacklist documents of requests.')
 
-_cache = collections.OrderedDict()
+_MISSING = object()
+
+
+class FrozenDict(dict):
+  """A read-only dict. Copies of it are normal dicts."""
+
+  def _readonly(self, *args, **kwargs):
+    raise TypeError('smallcache values are read-only')
+
+  __setitem__ = __delitem__ = __ior__ = _readonly
+  clear = pop = popitem = setdefault = update = _readonly
+
+  def __copy__(self):
+    return dict(self)
+
+  def __deepcopy__(self, memo):
+    return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+
+def freeze(value):
+  """Returns a read-only copy of the value: dicts become FrozenDict and lists become tuples."""
+  if isinstance(value, dict):
+    return FrozenDict((key, freeze(item)) for key, item in value.items())
+  if isinstance(value, (list, tuple)):
+    return tuple(freeze(item) for item in value)
+  if isinstance(value, set):
+    return frozenset(value)
+  return value
+
+
+def _sizeof(value):
+  size = sys.getsizeof(value)
+  if isinstance(value, dict):
+    size += sum(_sizeof(key) + _sizeof(item) for key, item in value.items())
+  elif isinstance(value, (list, tuple, set, frozenset)):
+    size += sum(_sizeof(item) for item in value)
+  return size
+
+
+class _Cache(collections.OrderedDict):
+  """Entries of key -> (value, expire_at, size) in LRU order, tracking the total size."""
+
+  def __init__(self):
+    super(_Cache, self).__init__()
+    self.size = 0
+
+  def __setitem__(self, key, entry):
+    if key in self:
+      del self[key]
+    super(_Cache, self).__setitem__(key, entry)
+    self.size += entry[2]
+
+  def __delitem__(self, key):
+    self.size -= self[key][2]
+    super(_Cache, self).__delitem__(key)
+
+  def clear(self):
+    super(_Cache, self).clear()
+    self.size = 0
+
+
+_cache = _Cache()
+_stats = collections.Counter()
+_generation = 0
 
 
 async def _on_unset(e):
+  global _generation
+  _generation += 1
   if e['value'] in _cache:
     del _cache[e['value']]
+    _stats['unsets'] += 1
 
 
 def init():
@@ -22,32 +99,82 @@ def init():
 
 
 def get_direct(key, default=None):
+  """Get a value from the local cache. The value must not be modified."""
   if key not in _cache:
+    _stats['misses'] += 1
+    return default
+  value, expire_at, _ = _cache[key]
+  if expire_at is not None and expire_at <= time.time():
+    del _cache[key]
+    _stats['misses'] += 1
+    _stats['expirations'] += 1
     return default
   _cache.move_to_end(key)
-  return _cache[key]
+  _stats['hits'] += 1
+  return value
 
 
-def get(key, default=None):
-  return copy.deepcopy(get_direct(key, default))
+get = get_direct
 
 
-def set_local_direct(key, value):
-  if key in _cache:
-    del _cache[key]
-  _cache[key] = value
-  if len(_cache) > options.smallcache_max_entries:
-    _cache.popitem(False)
+def set_local_direct(key, value, ttl=None):
+  """Set a value in the local cache, which expires after ttl seconds if given.
+
+  The value is stored as is and must not be modified afterwards.
+  """
+  _cache[key] = (value, time.time() + ttl if ttl is not None else None, _sizeof(value))
+  while _cache and (len(_cache) > options.smallcache_max_entries
+                    or _cache.size > options.smallcache_max_bytes):
+    del _cache[next(iter(_cache))]
+    _stats['evictions'] += 1
 
 
-def set_local(key, value):
-  set_local_direct(key, copy.deepcopy(value))
+def set_local(key, value, ttl=None):
+  """Set a read-only copy of the value in the local cache, see set_local_direct."""
+  set_local_direct(key, freeze(value), ttl)
 
 
 async def unset_global(key):
   await bus.publish('smallcache-unset', key)
 
 
+def get_key(prefix, *args):
+  return prefix + '-'.join(str(arg) for arg in args)
+
+
+def cached(prefix, ttl=None):
+  """Decorator caching the result of a coroutine function in the local cache.
+
+  The key is get_key(prefix, *args), which is what to unset_global when the data changes. The
+  result is frozen, None is cached as well. Exceptions are not cached.
+
+  Args:
+    prefix: key prefix.
+    ttl: seconds to keep the result, or a function returning it, e.g. to read an option.
+  """
+  def decorator(coro):
+    @functools.wraps(coro)
+    async def wrapped(*args):
+      key = get_key(prefix, *args)
+      value = get_direct(key, _MISSING)
+      if value is _MISSING:
+        generation = _generation
+        value = freeze(await coro(*args))
+        # Do not cache a value which may be unset while it was being loaded.
+        if generation == _generation:
+          set_local_direct(key, value, ttl() if callable(ttl) else ttl)
+      return value
+
+    return wrapped
+
+  return decorator
+
+
+def get_stats():
+  """Get the counters of the local cache."""
+  return {**_stats, 'entries': len(_cache), 'bytes': _cache.size}
+
+
 def uninit():
   bus.unsubscribe(_on_unset)
   _cache.clear()
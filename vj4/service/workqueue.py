@@ -0,0 +1,84 @@
+import asyncio
+import collections
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class WorkQueue(object):
+  """Queue of background work run by a pool of workers in this process.
+
+  Work added with a key is debounced: while work of the same key is waiting, adding it again
+  only counts as coalesced. The work should therefore read the latest state when it runs.
+  """
+
+  def __init__(self, name, num_workers):
+    self.name = name
+    self.num_workers = num_workers
+    self._queue = asyncio.Queue()
+    self._scheduled = set()  # keys of the work which is delayed or waiting
+    self._ready_at = collections.deque()  # times the waiting work became ready, oldest first
+    self._workers = []
+    self._stats = collections.Counter()
+
+  def add(self, func, *args, key=None, delay=0):
+    """Add work, which is func(*args) after delay seconds.
+
+    Args:
+      func: coroutine function.
+      key: debounce key, or None to always run the work.
+      delay: seconds to wait before queueing the work, during which the work of the same key is
+          coalesced.
+    """
+    if key is not None:
+      if key in self._scheduled:
+        self._stats['coalesced'] += 1
+        return
+      self._scheduled.add(key)
+    self._stats['added'] += 1
+    if not self._workers:
+      self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.num_workers)]
+    item = (key, func, args)
+    if delay:
+      asyncio.get_event_loop().call_later(delay, self._put, item)
+    else:
+      self._put(item)
+
+  def _put(self, item):
+    self._ready_at.append(time.time())
+    self._queue.put_nowait(item)
+
+  async def _work(self):
+    while True:
+      key, func, args = await self._queue.get()
+      self._ready_at.popleft()
+      self._scheduled.discard(key)
+      try:
+        await func(*args)
+        self._stats['processed'] += 1
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        self._stats['failed'] += 1
+        _logger.exception('Work %s of %s failed: %s', func.__name__, self.name, repr(e))
+
+  def get_stats(self):
+    """Get the stats of the queue.
+
+    Returns:
+      A dict of name, backlog (work delayed or waiting for a worker), lag (the seconds the oldest
+      work waiting for a worker has waited) and the counters added, coalesced, processed and
+      failed.
+    """
+    lag = time.time() - self._ready_at[0] if self._ready_at else 0.0
+    return {'name': self.name,
+            'backlog': self._stats['added'] - self._stats['processed'] - self._stats['failed'],
+            'lag': lag,
+            'added': self._stats['added'], 'coalesced': self._stats['coalesced'],
+            'processed': self._stats['processed'], 'failed': self._stats['failed']}
+
+  def close(self):
+    for worker in self._workers:
+      worker.cancel()
+    self._workers = []
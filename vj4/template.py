@@ -1,3 +1,5 @@
+import logging
+import time
 from os import path
 
 import jinja2
@@ -12,6 +14,22 @@ from vj4.util import json
 from vj4.util import misc
 from vj4.util import options
 
+options.define('template_bytecode_cache', default=True,
+               help='Cache compiled templates on disk, shared by the prefork workers.')
+options.define('template_cache_dir', default='',
+               help='Directory of the template bytecode cache, a per-user temporary directory '
+                    'if empty.')
+options.define('template_precompile', default=False,
+               help='Compile all templates at startup.')
+options.define('template_slow_render_ms', default=100,
+               help='Log renders of a template which take longer than this.')
+
+_logger = logging.getLogger(__name__)
+
+# template name -> [number of renders, total seconds, max seconds]
+_render_stats = {}
+_environment = None
+
 
 class Undefined(jinja2.runtime.Undefined):
   def __getitem__(self, _):
@@ -23,14 +41,18 @@ class Undefined(jinja2.runtime.Undefined):
 
 class Environment(jinja2.Environment):
   def __init__(self):
+    if options.template_bytecode_cache:
+      bytecode_cache = jinja2.FileSystemBytecodeCache(options.template_cache_dir or None)
+    else:
+      bytecode_cache = None
     super(Environment, self).__init__(
         loader=jinja2.FileSystemLoader(path.join(path.dirname(__file__), 'ui/templates')),
         extensions=[jinja2.ext.with_],
         auto_reload=options.debug,
+        bytecode_cache=bytecode_cache,
         autoescape=True,
         trim_blocks=True,
         undefined=Undefined)
-    globals()[self.__class__.__name__] = lambda: self  # singleton
 
     self.globals['vj4'] = vj4
     self.globals['static_url'] = lambda s: options.cdn_prefix + staticmanifest.get(s)
@@ -45,3 +67,70 @@ class Environment(jinja2.Environment):
     self.filters['base64_encode'] = misc.base64_encode
 
     self.filters['help'] = help
+
+
+def get_environment():
+  """Get the Environment of this process, which keeps the compiled templates in memory.
+
+  It is created on first use, so that an Environment created before forking is shared by the
+  workers, and the bytecode cache is only used for templates not compiled yet.
+  """
+  global _environment
+  if not _environment:
+    _environment = Environment()
+  return _environment
+
+
+def precompile():
+  """Compile all templates, so that they are loaded before forking and the bytecode cache is
+  filled for the other workers."""
+  env = get_environment()
+  for name in env.list_templates(extensions=['html']):
+    try:
+      env.get_template(name)
+    except jinja2.TemplateError:
+      _logger.exception('Failed to compile template %s', name)
+
+
+def record_render(name, seconds):
+  stats = _render_stats.get(name)
+  if not stats:
+    stats = _render_stats[name] = [0, 0.0, 0.0]
+  stats[0] += 1
+  stats[1] += seconds
+  stats[2] = max(stats[2], seconds)
+  if seconds * 1000 > options.template_slow_render_ms:
+    _logger.warning('Slow render of %s: %.1fms, slowest templates: %s', name, seconds * 1000,
+                    ', '.join('{0} {1:.1f}ms'.format(s['name'], s['mean'] * 1000)
+                              for s in get_render_stats(5)))
+
+
+def record_generate(name, chunks, seconds=0.0):
+  """Yield the chunks of a streamed render, and record the time spent rendering them.
+
+  The time spent by the consumer between the chunks, e.g. writing them out, is not counted.
+  """
+  try:
+    while True:
+      begin = time.perf_counter()
+      try:
+        chunk = next(chunks)
+      except StopIteration:
+        return
+      finally:
+        seconds += time.perf_counter() - begin
+      yield chunk
+  finally:
+    record_render(name, seconds)
+
+
+def get_render_stats(count=None):
+  """Get the render time of templates in this process, slowest on average first.
+
+  Returns:
+    A list of dict with name, count, mean and max, in seconds.
+  """
+  stats = [{'name': name, 'count': num, 'mean': total / num, 'max': max_seconds}
+           for name, (num, total, max_seconds) in _render_stats.items()]
+  stats.sort(key=lambda s: -s['mean'])
+  return stats[:count]
@@ -37,6 +37,8 @@ class BusTestCase(DatabaseTestCase):
     super(BusTestCase, self).setUp()
     self.old_publish = bus.publish
     bus.publish = event.publish
+    self.old_publish_batch = bus.publish_batch
+    bus.publish_batch = event.publish_batch
     self.old_subscribe = bus.subscribe
     bus.subscribe = event.subscribe
     self.old_unsubscribe = bus.unsubscribe
@@ -44,6 +46,7 @@ class BusTestCase(DatabaseTestCase):
 
   def tearDown(self):
     bus.publish = self.old_publish
+    bus.publish_batch = self.old_publish_batch
     bus.subscribe = self.old_subscribe
     bus.unsubscribe = self.old_unsubscribe
     super(BusTestCase, self).tearDown()
@@ -59,10 +62,13 @@ class QueueTestCase(DatabaseTestCase):
     queue.publish = QueueTestCase.noop
     self.old_consume = queue.consume
     queue.consume = QueueTestCase.noop
+    self.old_consume_weighted = queue.consume_weighted
+    queue.consume_weighted = QueueTestCase.noop
 
   def tearDown(self):
     queue.publish = self.old_publish
     queue.consume = self.old_consume
+    queue.consume_weighted = self.old_consume_weighted
     super(QueueTestCase, self).tearDown()
 
 
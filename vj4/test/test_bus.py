@@ -0,0 +1,69 @@
+import asyncio
+import unittest
+
+import bson
+
+from vj4.service import bus
+from vj4.test import base
+from vj4.util import options
+
+
+class Test(unittest.TestCase):
+  def setUp(self):
+    self.published = []
+    self.received = []
+    self.old_publish = bus.publish
+    bus.publish = self.publish
+    self.old_publish_batch = bus.publish_batch
+    bus.publish_batch = self.publish_batch
+    self.old_max_batch_size = options.bus_max_batch_size
+    bus.subscribe(self.on_event, ['foo'])
+
+  def tearDown(self):
+    bus.unsubscribe(self.on_event)
+    options.bus_max_batch_size = self.old_max_batch_size
+    bus.publish = self.old_publish
+    bus.publish_batch = self.old_publish_batch
+
+  async def publish(self, key, value):
+    self.published.append({'key': key, 'value': value})
+
+  async def publish_batch(self, events):
+    self.published.append(events)
+
+  async def on_event(self, e):
+    self.received.append(e['value'])
+
+  @base.wrap_coro
+  async def test_publish_throttle(self):
+    bus.publish_throttle('foo', 1, 'a', 0.01)
+    bus.publish_throttle('foo', 2, 'b', 0.01)
+    bus.publish_throttle('foo', 3, 'a', 0.01)
+    await asyncio.sleep(0.02)
+    self.assertEqual(self.published, [[{'key': 'foo', 'value': 3}, {'key': 'foo', 'value': 2}]])
+    bus.publish_throttle('foo', 4, 'a', 0.01)
+    await asyncio.sleep(0.02)
+    self.assertEqual(self.published[1:], [{'key': 'foo', 'value': 4}])
+
+  @base.wrap_coro
+  async def test_max_batch_size(self):
+    options.bus_max_batch_size = 2
+    for i in range(3):
+      bus.publish_throttle('foo', i, i, 0.01)
+    await asyncio.sleep(0)
+    self.assertEqual(self.published, [[{'key': 'foo', 'value': 0}, {'key': 'foo', 'value': 1}]])
+    await asyncio.sleep(0.02)
+    self.assertEqual(self.published[1:], [{'key': 'foo', 'value': 2}])
+
+  @base.wrap_coro
+  async def test_on_message(self):
+    await bus._on_message(None, bson.BSON.encode({'key': 'foo', 'value': 1}), None, None)
+    await bus._on_message(None, bson.BSON.encode({'batch': [{'key': 'foo', 'value': 2},
+                                                            {'key': 'bar', 'value': 3},
+                                                            {'key': 'foo', 'value': 4}]}),
+                          None, None)
+    self.assertEqual(self.received, [1, 2, 4])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,7 @@
+import asyncio
 import datetime
 import functools
+import random
 import unittest
 
 from bson import objectid
@@ -9,6 +11,7 @@ from vj4 import error
 from vj4.model import document
 from vj4.model.adaptor import contest
 from vj4.test import base
+from vj4.util import options
 
 
 def _rule_test_stat(tdoc, journal):
@@ -227,6 +230,63 @@ class AssignmentRuleTest(unittest.TestCase):
     self.assertEqual(stats['detail'], [])
 
 
+class IncrementalStatTest(unittest.TestCase):
+  def replay(self, tdoc, journal):
+    tsdoc = {'journal': []}
+    for jdoc in journal:
+      tsdoc['journal'].append(jdoc)
+      stats = contest._apply_status_journal(tdoc, tsdoc, jdoc)
+      if stats is None:
+        stats = contest._get_status_stats(tdoc, tsdoc)
+      tsdoc.update(stats)
+    return tsdoc
+
+  def assertStatsEqual(self, tdoc, journal):
+    tsdoc = self.replay(tdoc, journal)
+    stats = contest.RULES[tdoc['rule']].stat_func(tdoc, contest._get_status_journal(tsdoc))
+    for key, value in stats.items():
+      if key == 'detail':
+        self.assertCountEqual(tsdoc['detail'], value)
+      else:
+        self.assertAlmostEqual(tsdoc[key], value)
+
+  def random_journal(self, size):
+    rids = sorted(objectid.ObjectId.from_datetime(NOW + datetime.timedelta(seconds=i))
+                  for i in range(size))
+    journal = []
+    for rid in rids:
+      journal.append({'rid': rid, 'pid': random.choice([777, 778, 779, 780]),
+                      'accept': random.random() < 0.3, 'score': random.randint(0, 100)})
+    # judged out of order
+    for i in range(0, size - 1, 7):
+      journal[i], journal[i + 1] = journal[i + 1], journal[i]
+    # rejudged
+    for i in range(0, size, 11):
+      journal.append({**journal[i], 'accept': not journal[i]['accept']})
+    return journal
+
+  def test_in_order(self):
+    for rule in [constant.contest.RULE_OI, constant.contest.RULE_ACM]:
+      tdoc = {**TDOC, 'rule': rule}
+      self.assertStatsEqual(tdoc, [SUBMIT_777_NAC, SUBMIT_778_AC, SUBMIT_777_NAC_LATE])
+    tdoc = {**ASSDOC, 'rule': constant.contest.RULE_ASSIGNMENT}
+    self.assertStatsEqual(tdoc, [SUBMIT_777_NAC, SUBMIT_777_AC_LATE, SUBMIT_777_NAC_LATE])
+
+  def test_random(self):
+    random.seed(0)
+    for rule in [constant.contest.RULE_OI, constant.contest.RULE_ACM]:
+      self.assertStatsEqual({**TDOC, 'rule': rule}, self.random_journal(200))
+    self.assertStatsEqual({**ASSDOC, 'rule': constant.contest.RULE_ASSIGNMENT},
+                          self.random_journal(200))
+
+  def test_stale(self):
+    tdoc = {**TDOC, 'rule': constant.contest.RULE_ACM}
+    tsdoc = self.replay(tdoc, [SUBMIT_777_NAC])
+    tsdoc['journal'].append(SUBMIT_778_AC)
+    tsdoc['journal'].append(SUBMIT_777_NAC_LATE)
+    self.assertIsNone(contest._apply_status_journal(tdoc, tsdoc, SUBMIT_777_NAC_LATE))
+
+
 class OuterTest(base.DatabaseTestCase):
   @base.wrap_coro
   async def test_add_get(self):
@@ -352,5 +412,57 @@ class InnerTest(base.DatabaseTestCase):
     del tsdoc_old['rev']
     self.assertEqual(tsdoc, tsdoc_old)
 
+
+class ScoreboardExportTest(unittest.TestCase):
+  ROWS = [[{'type': 'rank', 'value': 'Rank'}, {'type': 'user', 'value': 'User'}],
+          [{'type': 'string', 'value': 1}, {'type': 'user', 'value': 'a,b "c"'}],
+          [{'type': 'string', 'value': 2}, {'type': 'user', 'value': 'd\te\nf'}]]
+
+  def test_csv(self):
+    self.assertEqual(''.join(contest._export_scoreboard_as_csv(iter(self.ROWS))),
+                     '\uFEFFRank,User\r\n1,"a,b ""c"""\r\n2,"d\te\nf"\r\n')
+
+  def test_tsv(self):
+    self.assertEqual(''.join(contest._export_scoreboard_as_tsv(iter(self.ROWS))),
+                     '\uFEFFRank\tUser\r\n1\ta,b "c"\r\n2\td e f\r\n')
+
+
+class ScoreboardTest(base.BusTestCase):
+  def setUp(self):
+    super(ScoreboardTest, self).setUp()
+    self.old_coalesce_delay = options.scoreboard_coalesce_delay
+    options.scoreboard_coalesce_delay = 0
+    contest.init()
+    self.tid = base.wait(contest.add(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, TITLE, CONTENT, OWNER_UID,
+                                     constant.contest.RULE_ACM, NOW,
+                                     NOW + datetime.timedelta(seconds=22), [777, 778]))
+
+  def tearDown(self):
+    contest.uninit()
+    options.scoreboard_coalesce_delay = self.old_coalesce_delay
+    super(ScoreboardTest, self).tearDown()
+
+  @base.wrap_coro
+  async def test_materialize(self):
+    scoreboard, scoreboard_shared = await asyncio.gather(
+        contest.materialize_scoreboard(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid),
+        contest.materialize_scoreboard(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid))
+    self.assertIs(scoreboard, scoreboard_shared)
+    self.assertEqual(scoreboard.ranked_tsdocs, [])
+    await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, ATTEND_UID)
+    self.assertIs(await contest.materialize_scoreboard(DOMAIN_ID_DUMMY, document.TYPE_CONTEST,
+                                                       self.tid), scoreboard)
+    await asyncio.sleep(0.1)
+    scoreboard = await contest.materialize_scoreboard(DOMAIN_ID_DUMMY, document.TYPE_CONTEST,
+                                                      self.tid)
+    self.assertEqual(len(scoreboard.ranked_tsdocs), 1)
+    self.assertEqual(scoreboard.ranked_tsdocs[0][0], 1)
+    self.assertEqual(scoreboard.ranked_tsdocs[0][1]['uid'], ATTEND_UID)
+
+  @base.wrap_coro
+  async def test_invalid_doc_type(self):
+    with self.assertRaises(error.InvalidArgumentError):
+      await contest.materialize_scoreboard(DOMAIN_ID_DUMMY, document.TYPE_PROBLEM, self.tid)
+
 if __name__ == '__main__':
   unittest.main()
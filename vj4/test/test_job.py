@@ -1,11 +1,14 @@
 import unittest
 
 from vj4 import constant
+from vj4 import db
 from vj4 import job
 from vj4.model import domain
+from vj4.model import progress
 from vj4.model import record
 from vj4.model.adaptor import problem
 from vj4.test import base
+from vj4.util import options
 
 DOMAIN_ID = 'system'
 OWNER_UID = 20
@@ -120,6 +123,31 @@ class RecordTest(RecordTestCase):
     self.assertEqual(dudoc['num_submit'], 2)
     self.assertEqual(dudoc['num_accept'], 0)
 
+  @base.wrap_coro
+  async def test_run_small_bulk(self):
+    await self.init_record()
+    old_bulk_size = options.record_bulk_size
+    options.record_bulk_size = 1
+    try:
+      await job.record.run(DOMAIN_ID)
+    finally:
+      options.record_bulk_size = old_bulk_size
+    pdoc = await problem.get(DOMAIN_ID, self.pid1, UID)
+    self.assertEqual(pdoc['num_submit'], 4)
+    self.assertEqual(pdoc['num_accept'], 1)
+    self.assertEqual(pdoc['psdoc']['num_submit'], 3)
+    self.assertEqual(pdoc['psdoc']['rid'], self.rid_p1_ac)
+    pdoc = await problem.get(DOMAIN_ID, self.pid2, UID2)
+    self.assertEqual(pdoc['num_submit'], 5)
+    self.assertEqual(pdoc['num_accept'], 1)
+    self.assertEqual(pdoc['psdoc']['status'], constant.record.STATUS_WRONG_ANSWER)
+    dudoc = await domain.get_user(DOMAIN_ID, UID)
+    self.assertEqual(dudoc['num_submit'], 7)
+    self.assertEqual(dudoc['num_accept'], 2)
+    dudoc = await domain.get_user(DOMAIN_ID, UID2)
+    self.assertEqual(dudoc['num_submit'], 2)
+    self.assertEqual(dudoc['num_accept'], 0)
+
 
 class RpTest(RecordTestCase):
   @base.wrap_coro
@@ -244,7 +272,148 @@ class RankTest(RecordTestCase):
     self.assertGreaterEqual(dudoc1['level'], dudoc2['level'])
 
 
+class RpAcceptTest(RecordTestCase):
+  async def add_accept(self, pid, uid):
+    rid = await record.add(DOMAIN_ID, pid, constant.record.TYPE_SUBMISSION,
+                           uid, 'cc', 'int main(){}')
+    await record.begin_judge(rid, JUDGE_UID, JUDGE_TOKEN, constant.record.STATUS_JUDGING)
+    await record.end_judge(rid, JUDGE_UID, JUDGE_TOKEN, constant.record.STATUS_ACCEPTED,
+                           100, 1000, 1024)
+    return rid
+
+  async def accept(self, pid, uid, rid):
+    self.assertTrue(await problem.update_status(DOMAIN_ID, pid, uid, rid,
+                                                constant.record.STATUS_ACCEPTED))
+    await problem.inc(DOMAIN_ID, pid, 'num_accept', 1)
+    return await job.rp.accept(DOMAIN_ID, pid, uid)
+
+  async def get_user_rps(self, uids):
+    return [(await domain.get_user(DOMAIN_ID, uid)).get('rp', 0.0) for uid in uids]
+
+  @base.wrap_coro
+  async def test_accept(self):
+    await self.init_record()
+    await job.record.run(DOMAIN_ID)
+    await job.rp.recalc(DOMAIN_ID)
+    rp_u1, = await self.get_user_rps([UID])
+    # user 2 submitted a record, AC
+    rid_p1u2_ac = await self.add_accept(self.pid1, UID2)
+    self.assertTrue(await self.accept(self.pid1, UID2, rid_p1u2_ac))
+    pdoc = await problem.get(DOMAIN_ID, self.pid1, UID2)
+    self.assertTrue(pdoc['rp_dirty'])
+    self.assertEqual(pdoc['psdoc']['rp'], job.rp.get_rp(2, 2))
+    dudoc = await domain.get_user(DOMAIN_ID, UID2)
+    self.assertEqual(dudoc['rp'], job.rp.get_rp(2, 2))
+    # The rp of user 1 is rescaled, but the status is persisted later.
+    pdoc = await problem.get(DOMAIN_ID, self.pid1, UID)
+    self.assertEqual(pdoc['psdoc']['rp'], job.rp.get_rp(1, 1))
+    dudoc = await domain.get_user(DOMAIN_ID, UID)
+    self.assertTrue(abs(dudoc['rp'] - rp_u1 - job.rp.get_rp(2, 1) + job.rp.get_rp(1, 1)) < EPS)
+    rp_users = await self.get_user_rps([UID, UID2])
+    await job.rp.compact(DOMAIN_ID)
+    pdoc = await problem.get(DOMAIN_ID, self.pid1, UID)
+    self.assertNotIn('rp_dirty', pdoc)
+    self.assertEqual(pdoc['psdoc']['rp'], job.rp.get_rp(2, 1))
+    self.assertEqual(await self.get_user_rps([UID, UID2]), rp_users)
+    # Same as the full recalculation.
+    await job.rp.recalc(DOMAIN_ID)
+    for rp, rp_recalc in zip(rp_users, await self.get_user_rps([UID, UID2])):
+      self.assertTrue(abs(rp - rp_recalc) < EPS)
+
+  @base.wrap_coro
+  async def test_accept_only(self):
+    await self.init_record()
+    await job.record.run(DOMAIN_ID)
+    await job.rp.recalc(DOMAIN_ID)
+    uids = [UID, UID2] + list(range(30, 36))
+    rid_p1u2_ac = await self.add_accept(self.pid1, UID2)
+    for uid in uids[2:6]:
+      self.assertTrue(await self.accept(self.pid1, uid, await self.add_accept(self.pid1, uid)))
+    # Judged out of order, which rescans the problem.
+    self.assertFalse(await self.accept(self.pid1, UID2, rid_p1u2_ac))
+    for uid in uids[6:]:
+      self.assertTrue(await self.accept(self.pid1, uid, await self.add_accept(self.pid1, uid)))
+    for uid in uids[2:]:
+      self.assertTrue(await self.accept(self.pid2, uid, await self.add_accept(self.pid2, uid)))
+    rp_users = await self.get_user_rps(uids)
+    await job.rp.recalc(DOMAIN_ID)
+    for rp, rp_recalc in zip(rp_users, await self.get_user_rps(uids)):
+      self.assertTrue(abs(rp - rp_recalc) < EPS)
+
+
+class DomainJobTest(RecordTestCase):
+  @base.wrap_coro
+  async def test_resume(self):
+    await self.init_record()
+    await job.record.run(DOMAIN_ID)
+    # a problem whose doc_id is of another type
+    await problem.add(DOMAIN_ID, 'a*b', 'calc a*b', OWNER_UID, 'mul')
+    await job.rp.recalc(DOMAIN_ID)
+    rp_u1 = (await domain.get_user(DOMAIN_ID, UID))['rp']
+    # interrupted after the first problem
+    pdoc = await problem.get(DOMAIN_ID, self.pid1)
+    await progress.begin('vj4.job.rp.recalc', DOMAIN_ID)
+    await progress.save('vj4.job.rp.recalc', DOMAIN_ID, pdoc['_id'], 1)
+    await db.coll('domain.user').update_many({}, {'$set': {'rp': 0.0}})
+    await job.rp.recalc.run_all()
+    doc = await progress.get('vj4.job.rp.recalc', DOMAIN_ID)
+    self.assertEqual(doc['status'], progress.STATUS_DONE)
+    self.assertEqual(doc['done'], 3)
+    self.assertEqual(doc['total'], 3)
+    self.assertEqual((await domain.get_user(DOMAIN_ID, UID))['rp'], rp_u1)
+    # starts over after finishing
+    await job.rp.recalc.run_all()
+    doc = await progress.get('vj4.job.rp.recalc', DOMAIN_ID)
+    self.assertEqual(doc['done'], 3)
+
+
+  @base.wrap_coro
+  async def test_resume_record(self):
+    await self.init_record()
+    await job.record.run(DOMAIN_ID)
+    # interrupted after the first problem
+    pdoc = await problem.get(DOMAIN_ID, self.pid1)
+    await progress.begin('vj4.job.record.run', DOMAIN_ID)
+    await progress.save('vj4.job.record.run', DOMAIN_ID, pdoc['_id'], 1)
+    await db.coll('document.status').update_many({'doc_id': self.pid2},
+                                                 {'$unset': {'num_submit': '', 'status': ''}})
+    await db.coll('domain.user').update_many({}, {'$set': {'num_submit': 0, 'num_accept': 0}})
+    await job.record.run.run_all()
+    doc = await progress.get('vj4.job.record.run', DOMAIN_ID)
+    self.assertEqual(doc['status'], progress.STATUS_DONE)
+    self.assertEqual(doc['done'], 2)
+    pdoc = await problem.get(DOMAIN_ID, self.pid2, UID)
+    self.assertEqual(pdoc['psdoc']['num_submit'], 4)
+    self.assertEqual(pdoc['psdoc']['status'], constant.record.STATUS_ACCEPTED)
+    dudoc = await domain.get_user(DOMAIN_ID, UID)
+    self.assertEqual(dudoc['num_submit'], 7)
+    self.assertEqual(dudoc['num_accept'], 2)
+
+  @base.wrap_coro
+  async def test_resume_num(self):
+    await progress.begin('vj4.job.num.num', DOMAIN_ID)
+    await progress.save('vj4.job.num.num', DOMAIN_ID, 4, 4)
+    await job.num.num.run_all()
+    doc = await progress.get('vj4.job.num.num', DOMAIN_ID)
+    self.assertEqual(doc['status'], progress.STATUS_DONE)
+    self.assertEqual(doc['done'], 5)
+    self.assertEqual(doc['total'], 5)
+
+
 class DifficultyTest(unittest.TestCase):
   def test_integrate(self):
+    self.assertEqual(job.difficulty._integrate(0), 0.0)
+    # Median of the log-normal distribution is 1.
+    self.assertAlmostEqual(job.difficulty._integrate(20), 0.5)
+    last = 0.0
     for x in range(1000):
-      self.assertEqual(job.difficulty._integrate(x), job.difficulty._integrate_direct(x))
+      s = job.difficulty._integrate(x)
+      self.assertTrue(last <= s <= 1.0)
+      self.assertTrue(abs(s - job.difficulty._integrate_direct(x)) < 0.05)
+      last = s
+
+  def test_difficulty_algorithm(self):
+    self.assertIsNone(job.difficulty.difficulty_algorithm(0, 0))
+    self.assertEqual(job.difficulty.difficulty_algorithm(1, 1), 9)
+    self.assertEqual(job.difficulty.difficulty_algorithm(1000, 0), 10)
+    self.assertEqual(job.difficulty.difficulty_algorithm(1000, 1000), 1)
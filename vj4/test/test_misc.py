@@ -1,6 +1,8 @@
+import sys
 import unittest
 
 from vj4.util import misc
+from vj4.util import options
 
 
 class Test(unittest.TestCase):
@@ -11,6 +13,27 @@ class Test(unittest.TestCase):
     self.assertListEqual(misc.dedupe(['b','a','b','c','b']),['b','a','c'])
     self.assertListEqual(misc.dedupe([0]),[0])
 
+  def test_markdown(self):
+    stats = misc.get_markdown_stats()
+    markup = misc.markdown('**vijos**')
+    self.assertEqual(markup, '<p><strong>vijos</strong></p>\n')
+    self.assertIs(misc.markdown('**vijos**'), markup)
+    self.assertNotEqual(misc.markdown('*vijos*'), markup)
+    new_stats = misc.get_markdown_stats()
+    self.assertEqual(new_stats['hits'] - stats.get('hits', 0), 1)
+    self.assertEqual(new_stats['misses'] - stats.get('misses', 0), 2)
+
+  def test_markdown_max_bytes(self):
+    old_max_bytes = options.markdown_cache_max_bytes
+    options.markdown_cache_max_bytes = 3 * sys.getsizeof(misc.markdown('a' * 1000))
+    try:
+      for c in 'bcde':
+        misc.markdown(c * 1000)
+      self.assertLessEqual(misc.get_markdown_stats()['bytes'], options.markdown_cache_max_bytes)
+      self.assertEqual(len(misc._markdown_cache), 3)
+    finally:
+      options.markdown_cache_max_bytes = old_max_bytes
+
 
 if __name__ == '__main__':
   unittest.main()
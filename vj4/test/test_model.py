@@ -7,6 +7,7 @@ from bson import objectid
 from gridfs import errors as gridfs_errors
 from pymongo import errors as pymongo_errors
 
+from vj4 import constant
 from vj4 import db
 from vj4 import error
 from vj4.model import builtin
@@ -14,6 +15,8 @@ from vj4.model import document
 from vj4.model import domain
 from vj4.model import fs
 from vj4.model import opcount
+from vj4.model import record
+from vj4.model import report
 from vj4.model import system
 from vj4.model import user
 from vj4.test import base
@@ -46,7 +49,7 @@ class SystemTest(base.DatabaseTestCase):
     self.assertEqual(await system.inc_user_counter(), 3)
 
 
-class UserTest(base.DatabaseTestCase):
+class UserTest(base.SmallcacheTestCase):
   @base.wrap_coro
   async def test_add_user(self):
     with self.assertRaises(error.UserAlreadyExistError):
@@ -127,7 +130,7 @@ class DocumentTest(base.DatabaseTestCase):
       await document.capped_inc_status(DOMAIN_ID, DOC_TYPE, doc_id, OWNER_UID, STATUS_KEY, 1)
 
 
-class DomainTest(base.DatabaseTestCase):
+class DomainTest(base.SmallcacheTestCase):
   @base.wrap_coro
   async def test_add_get_transfer(self):
     inserted_id = await domain.add(DOMAIN_ID, OWNER_UID, ROLES, name=DOMAIN_NAME)
@@ -147,6 +150,20 @@ class DomainTest(base.DatabaseTestCase):
     with self.assertRaises(error.DomainNotFoundError):
       await domain.get('null')
 
+  @base.wrap_coro
+  async def test_get_cached(self):
+    await domain.add(DOMAIN_ID, OWNER_UID, ROLES, name=DOMAIN_NAME)
+    ddoc = await domain.get_cached(DOMAIN_ID)
+    self.assertEqual(ddoc['name'], DOMAIN_NAME)
+    await db.coll('domain').update_one({'_id': DOMAIN_ID}, {'$set': {'name': 'changed'}})
+    ddoc = await domain.get_cached(DOMAIN_ID)
+    self.assertEqual(ddoc['name'], DOMAIN_NAME)
+    await domain.edit(DOMAIN_ID, name='Edited')
+    ddoc = await domain.get_cached(DOMAIN_ID)
+    self.assertEqual(ddoc['name'], 'Edited')
+    with self.assertRaises(error.DomainNotFoundError):
+      await domain.get_cached('null')
+
   @base.wrap_coro
   async def test_add_continue_1(self):
     # test pending inserting dudoc
@@ -326,6 +343,19 @@ class DomainTest(base.DatabaseTestCase):
     self.assertTrue(FOO_ROLE not in ddoc['roles'])
     self.assertEqual(ddoc['roles'][BAR_ROLE], 666)
 
+  @base.wrap_coro
+  async def test_get_all_roles(self):
+    await domain.add(DOMAIN_ID, OWNER_UID, ROLES, name=DOMAIN_NAME)
+    roles = domain.get_all_roles(await domain.get(DOMAIN_ID))
+    self.assertEqual(roles[FOO_ROLE], 777)
+    self.assertEqual(roles[builtin.ROLE_ROOT], builtin.PERM_ALL)
+    self.assertIs(domain.get_all_roles(await domain.get(DOMAIN_ID)), roles)
+    ddoc = await domain.set_roles(DOMAIN_ID, {FOO_ROLE: 666})
+    self.assertEqual(domain.get_all_roles(ddoc)[FOO_ROLE], 666)
+    ddoc = await domain.delete_roles(DOMAIN_ID, [FOO_ROLE])
+    self.assertNotIn(FOO_ROLE, domain.get_all_roles(ddoc))
+    self.assertEqual(domain.get_all_roles(await domain.get_cached(DOMAIN_ID))[BAR_ROLE], 777)
+
 
 class FsTest(base.DatabaseTestCase):
   CONTENT = b'dummy_content'
@@ -365,6 +395,25 @@ class FsTest(base.DatabaseTestCase):
       await fs.get_by_secret(secret)
     self.assertEqual(bool(await fs.get_file_id(secret)), False)
 
+  @base.wrap_coro
+  async def test_add_stream(self):
+    def reader():
+      chunks = [self.CONTENT[:5], self.CONTENT[5:], b'']
+      async def read_chunk():
+        return chunks.pop(0)
+      return read_chunk
+
+    fid, length = await fs.add_stream('application/octet-stream', reader())
+    self.assertEqual(length, len(self.CONTENT))
+    fid2, _ = await fs.add_stream('application/octet-stream', reader())
+    self.assertEqual(fid, fid2)
+    grid_out = await fs.get(fid)
+    read_chunk = fs.get_chunk_reader(grid_out)
+    self.assertEqual(await read_chunk(), self.CONTENT)
+    self.assertEqual(await read_chunk(), b'')
+    with self.assertRaises(error.FileTooLongError):
+      await fs.add_stream('application/octet-stream', reader(), len(self.CONTENT) - 1)
+
 
 class OpcountTest(base.DatabaseTestCase):
   def setUp(self):
@@ -390,5 +439,61 @@ class OpcountTest(base.DatabaseTestCase):
     await opcount.inc(OP2, IDENT, 1, 2)
 
 
+class ReportTest(base.SmallcacheTestCase):
+  @base.wrap_coro
+  async def test_add_get_edit(self):
+    begin_at = datetime.datetime(2020, 9, 1)
+    end_at = datetime.datetime(2020, 9, 8)
+    rid = await report.add(1, 3, 'title', CONTENT, begin_at, end_at)
+    rdoc = await report.get(rid)
+    self.assertEqual(rdoc['report_id'], 1)
+    self.assertEqual(rdoc['content'], CONTENT)
+    rdoc = await report.edit(rid, content=CONTENT2)
+    self.assertEqual(rdoc['content'], CONTENT2)
+    with self.assertRaises(error.ReportNotFoundError):
+      await report.get(objectid.ObjectId())
+
+  @base.wrap_coro
+  async def test_set_status(self):
+    rid = objectid.ObjectId()
+    self.assertIsNone(await report.set_status(rid, UID, report_data='a.pdf'))
+    ureport = await report.get_status(rid, UID)
+    self.assertEqual(ureport['report_data'], 'a.pdf')
+    self.assertIsNone(ureport['code_data'])
+    ureport = await report.set_status(rid, UID, code_data='a.zip')
+    self.assertEqual(ureport['report_data'], 'a.pdf')
+    self.assertIsNone(ureport['code_data'])
+    ureport = await report.get_status(rid, UID)
+    self.assertEqual(ureport['code_data'], 'a.zip')
+
+  @base.wrap_coro
+  async def test_get_roster(self):
+    rid = objectid.ObjectId()
+    await user.add(UID, UNAME, '1', 2020, 'name', '123456', 'twd2@vijos.org', group='g')
+    await user.add(UID + 1, UNAME + '1', '2', 2020, 'name', '123456', 'twd3@vijos.org', group='g')
+    await report.set_status(rid, UID, report_data='a.pdf')
+    roster = await report.get_roster(rid)
+    self.assertCountEqual(roster['uid'], [UID])
+    await report.set_status(rid, UID + 1, report_data='b.pdf')
+    roster = await report.get_roster(rid)
+    self.assertCountEqual(roster['uid'], [UID, UID + 1])
+    self.assertCountEqual(roster['year'], [2020])
+    self.assertCountEqual(roster['group'], ['g'])
+    self.assertCountEqual(roster['_class'], ['1', '2'])
+
+
+
+class RecordTest(unittest.TestCase):
+  def test_get_judge_queue(self):
+    rdoc = {'type': constant.record.TYPE_SUBMISSION}
+    self.assertEqual(record.get_judge_queue(rdoc), record.JUDGE_QUEUE_SUBMISSION)
+    rdoc['tid'] = objectid.ObjectId()
+    self.assertEqual(record.get_judge_queue(rdoc), record.JUDGE_QUEUE_CONTEST)
+    rdoc['rejudged'] = True
+    self.assertEqual(record.get_judge_queue(rdoc), record.JUDGE_QUEUE_REJUDGE)
+    rdoc = {'type': constant.record.TYPE_PRETEST}
+    self.assertEqual(record.get_judge_queue(rdoc), record.JUDGE_QUEUE_PRETEST)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -1,10 +1,13 @@
 import unittest
 
+from bson import objectid
+
 from vj4 import error
 from vj4.model.adaptor import problem
 from vj4.test import base
 
 DOMAIN_ID = 'dummy_domain'
+DOMAIN_ID2 = 'dummy_domain2'
 TITLE = 'dummy_title'
 CONTENT = 'dummy_content'
 UID = 22
@@ -45,6 +48,41 @@ class ProblemTest(base.DatabaseTestCase):
     self.assertTrue(psdoc['star'])
 
 
+class ProblemDataListTest(base.BusTestCase):
+  @base.wrap_coro
+  async def test_get_data_list(self):
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
+    pids, cursor = await problem.get_data_list()
+    self.assertEqual(pids, [])
+    await problem.set_data(DOMAIN_ID, PID, objectid.ObjectId())
+    pids, cursor = await problem.get_data_list(0, cursor)
+    self.assertEqual(pids, [(DOMAIN_ID, PID)])
+    pids, next_cursor = await problem.get_data_list(0, cursor)
+    self.assertEqual(pids, [])
+    self.assertEqual(next_cursor, cursor)
+    await problem.copy(await problem.get(DOMAIN_ID, PID), DOMAIN_ID2, UID, PID)
+    pids, cursor = await problem.get_data_list(0, cursor)
+    self.assertEqual(pids, [(DOMAIN_ID2, PID)])
+    await problem.set_data(DOMAIN_ID, PID, objectid.ObjectId())
+    pids, cursor = await problem.get_data_list(0, cursor)
+    self.assertCountEqual(pids, [(DOMAIN_ID, PID), (DOMAIN_ID2, PID)])
+
+  @base.wrap_coro
+  async def test_copy_without_data(self):
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
+    await problem.copy(await problem.get(DOMAIN_ID, PID), DOMAIN_ID2, UID, PID)
+    pids, cursor = await problem.get_data_list()
+    self.assertEqual(pids, [])
+    await problem.set_data(DOMAIN_ID, PID, objectid.ObjectId())
+    pids, cursor = await problem.get_data_list(0, cursor)
+    self.assertCountEqual(pids, [(DOMAIN_ID, PID), (DOMAIN_ID2, PID)])
+
+  @base.wrap_coro
+  async def test_invalid_cursor(self):
+    with self.assertRaises(error.ValidationError):
+      await problem.get_data_list(0, 'invalid')
+
+
 class ProblemSolutionTest(base.DatabaseTestCase):
   def setUp(self):
     super(ProblemSolutionTest, self).setUp()
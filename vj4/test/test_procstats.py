@@ -0,0 +1,31 @@
+import time
+import unittest
+
+from vj4.service import procstats
+from vj4.test import base
+
+
+class OfflineTest(unittest.TestCase):
+  def tearDown(self):
+    procstats._processes.clear()
+    procstats._providers.pop('test', None)
+
+  def test_get_local(self):
+    procstats.register('test', lambda: {'count': 1})
+    self.assertEqual(procstats.get_local()['test'], {'count': 1})
+
+  @base.wrap_coro
+  async def test_get(self):
+    await procstats._on_stats({'key': 'procstats',
+                               'value': {'process': 'b', 'stats': {'test': {'count': 2}}}})
+    await procstats._on_stats({'key': 'procstats',
+                               'value': {'process': 'a', 'stats': {'test': {'count': 1}}}})
+    await procstats._on_stats({'key': 'procstats',
+                               'value': {'process': 'c', 'stats': {}}})
+    self.assertEqual(procstats.get('test'), [('a', {'count': 1}), ('b', {'count': 2})])
+    procstats._processes['b'] = (time.time() - 3600, procstats._processes['b'][1])
+    self.assertEqual(procstats.get('test'), [('a', {'count': 1})])
+
+
+if __name__ == '__main__':
+  unittest.main()
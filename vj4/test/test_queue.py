@@ -0,0 +1,198 @@
+import asyncio
+import collections
+import unittest
+
+import bson
+
+from vj4.service import queue
+from vj4.test import base
+
+Envelope = collections.namedtuple('Envelope', 'delivery_tag')
+
+
+class FakeChannel(object):
+  """Channel which delivers like RabbitMQ, honoring per-consumer and global prefetch."""
+
+  def __init__(self):
+    self.close_event = asyncio.Event()
+    self.queues = collections.defaultdict(collections.deque)  # key -> bodies ready
+    self.consumers = collections.OrderedDict()  # consumer tag -> (key, callback, prefetch)
+    self.prefetch = 0
+    self.global_prefetch = 0
+    self.unacked = {}  # delivery tag -> (key, body, consumer tag)
+    self.nacked = []
+    self.num_qos = 0
+    self.num_tags = 0
+
+  async def basic_qos(self, *, prefetch_count, connection_global=False):
+    self.num_qos += 1
+    if connection_global:
+      self.global_prefetch = prefetch_count
+    else:
+      self.prefetch = prefetch_count
+    await self._pump()
+
+  async def basic_consume(self, callback, *, queue_name):
+    consumer_tag = 'ctag' + str(len(self.consumers))
+    self.consumers[consumer_tag] = (queue_name, callback, self.prefetch)
+    await self._pump()
+    return {'consumer_tag': consumer_tag}
+
+  async def basic_client_ack(self, delivery_tag):
+    del self.unacked[delivery_tag]
+    await self._pump()
+
+  async def basic_client_nack(self, delivery_tag, requeue):
+    key, body, _ = self.unacked.pop(delivery_tag)
+    self.nacked.append(delivery_tag)
+    self.queues[key].appendleft(body)
+    await self._pump()
+
+  async def publish(self, key, **kwargs):
+    self.queues[key].append(bson.BSON.encode(kwargs))
+    await self._pump()
+
+  def _can_deliver(self, consumer_tag, prefetch):
+    if self.global_prefetch and len(self.unacked) >= self.global_prefetch:
+      return False
+    return not prefetch or sum(1 for _, _, tag in self.unacked.values()
+                               if tag == consumer_tag) < prefetch
+
+  async def _pump(self):
+    delivered = True
+    while delivered:
+      delivered = False
+      for consumer_tag, (key, callback, prefetch) in list(self.consumers.items()):
+        if self.queues[key] and self._can_deliver(consumer_tag, prefetch):
+          self.num_tags += 1
+          body = self.queues[key].popleft()
+          self.unacked[self.num_tags] = (key, body, consumer_tag)
+          await callback(self, body, Envelope(self.num_tags), None)
+          delivered = True
+
+
+class FakeChannelTest(unittest.TestCase):
+  @base.wrap_coro
+  async def test_prefetch(self):
+    async def on_message(channel, body, envelope, properties):
+      pass
+
+    channel = FakeChannel()
+    await channel.basic_qos(prefetch_count=2)
+    for key in ['a', 'b']:
+      await channel.basic_consume(on_message, queue_name=key)
+      for i in range(5):
+        await channel.publish(key, value=i)
+    self.assertEqual(len(channel.unacked), 4)
+    await channel.basic_qos(prefetch_count=3, connection_global=True)
+    self.assertEqual(len(channel.unacked), 4)
+    await channel.basic_client_ack(1)
+    await channel.basic_client_ack(2)
+    self.assertEqual(len(channel.unacked), 3)
+
+
+class WeightedConsumerTest(unittest.TestCase):
+  def setUp(self):
+    self.channel = FakeChannel()
+    self.messages = []
+    self.timeouts = []
+
+  async def on_message(self, tag, *, value):
+    self.messages.append(value)
+
+  async def on_timeout(self, tag):
+    self.timeouts.append(tag)
+    await self.consumer.basic_client_nack(tag)
+
+  async def start(self, max_prefetch, timeout=None):
+    self.consumer = queue.WeightedConsumer(self.channel, [('a', 2), ('b', 1)], self.on_message,
+                                           max_prefetch=max_prefetch, timeout=timeout,
+                                           on_timeout=self.on_timeout)
+    self.consumer.start()
+    await asyncio.sleep(0)
+
+  @base.wrap_coro
+  async def test_window(self):
+    await self.start(3)
+    self.assertEqual(self.channel.global_prefetch, 5)
+    for i in range(10):
+      await self.channel.publish('a', value=i)
+      await self.channel.publish('b', value=i)
+    await asyncio.sleep(0)
+    # At most prefetch dispatched and one message per queue of lookahead, not prefetch per queue.
+    self.assertEqual(len(self.consumer.inflight), 3)
+    self.assertEqual(len(self.channel.unacked), 5)
+    consumer_tags = list(self.channel.consumers)
+    self.consumer.set_max_prefetch(5)
+    await asyncio.sleep(0)
+    self.assertEqual(self.channel.global_prefetch, 7)
+    self.assertEqual(list(self.channel.consumers), consumer_tags)
+    self.assertEqual(len(self.consumer.inflight), 5)
+    self.assertEqual(len(self.channel.unacked), 7)
+
+  @base.wrap_coro
+  async def test_weight(self):
+    await self.start(1)
+    for i in range(6):
+      await self.channel.publish('b', value='b' + str(i))
+    for i in range(3):
+      await self.channel.publish('a', value='a' + str(i))
+    await asyncio.sleep(0)
+    self.assertEqual(self.messages, ['b0'])
+    for _ in range(8):
+      tag, = self.consumer.inflight
+      await self.consumer.basic_client_ack(tag)
+      await asyncio.sleep(0)
+    self.assertEqual(self.messages, ['b0', 'b1', 'a0', 'b2', 'a1', 'a2', 'b3', 'b4', 'b5'])
+
+  @base.wrap_coro
+  async def test_nack(self):
+    await self.start(2)
+    for i in range(3):
+      await self.channel.publish('a', value=i)
+    await asyncio.sleep(0)
+    self.assertEqual(self.messages, [0, 1])
+    tags = list(self.consumer.inflight)
+    await self.consumer.basic_client_nack(tags[0])
+    await asyncio.sleep(0)
+    self.assertEqual(self.messages, [0, 1, 2])
+    self.assertEqual(self.channel.nacked, [tags[0]])
+    self.assertNotIn(tags[0], self.consumer.inflight)
+    self.assertEqual(len(self.consumer.inflight), 2)
+
+  @base.wrap_coro
+  async def test_timeout(self):
+    await self.start(4, timeout=0.05)
+    for i in range(10):
+      await self.channel.publish('b', value=i)
+    await asyncio.sleep(0)
+    tags = list(self.consumer.inflight)
+    self.assertEqual(len(self.channel.unacked), 6)
+    await asyncio.sleep(0.03)
+    for tag in tags[1:]:
+      self.consumer.touch(tag)
+    await asyncio.sleep(0.04)
+    self.assertEqual(self.timeouts, [tags[0]])
+    self.assertIn(tags[0], self.channel.nacked)
+    self.assertEqual(self.consumer.num_timeouts, 1)
+    self.assertEqual(self.consumer.prefetch, 2)
+    # The window shrank to 4, so the surplus buffered messages went back to the queue.
+    self.assertEqual(self.channel.global_prefetch, 4)
+    self.assertEqual(len(self.channel.unacked), 4)
+    self.assertEqual(len(self.consumer.inflight), 3)
+    # Each ack grows the prefetch back with one basic.qos, without consuming again.
+    consumer_tags = list(self.channel.consumers)
+    num_qos = self.channel.num_qos
+    await self.consumer.basic_client_ack(tags[1])
+    await asyncio.sleep(0)
+    self.assertEqual(self.consumer.prefetch, 3)
+    self.assertEqual(self.channel.global_prefetch, 5)
+    self.assertEqual(self.channel.num_qos - num_qos, 1)
+    self.assertEqual(list(self.channel.consumers), consumer_tags)
+    self.assertEqual(len(self.consumer.inflight), 3)
+    self.assertEqual(len(self.channel.unacked), 5)
+    self.assertEqual(self.timeouts, [tags[0]])
+
+
+if __name__ == '__main__':
+  unittest.main()
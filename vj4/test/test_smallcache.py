@@ -1,3 +1,4 @@
+import copy
 import unittest
 
 from vj4.service import smallcache
@@ -73,6 +74,73 @@ class OfflineTest(unittest.TestCase):
     self.assertEqual(smallcache.get(3), 1)
     self.assertEqual(smallcache.get(4), 4)
 
+  def test_ttl(self):
+    smallcache.set_local(0, 7, 60)
+    smallcache.set_local(1, 0, -1)
+    self.assertEqual(smallcache.get(0), 7)
+    self.assertIsNone(smallcache.get(1))
+    self.assertNotIn(1, smallcache._cache)
+
+  def test_frozen(self):
+    value = {'a': [1, {'b': 2}], 'c': {3}}
+    smallcache.set_local(0, value)
+    value['a'].append(4)
+    frozen = smallcache.get(0)
+    self.assertEqual(frozen, {'a': (1, {'b': 2}), 'c': frozenset([3])})
+    self.assertIs(smallcache.get(0), frozen)
+    with self.assertRaises(TypeError):
+      frozen['a'] = 5
+    with self.assertRaises(TypeError):
+      frozen['a'][1]['b'] = 5
+    thawed = copy.deepcopy(frozen)
+    self.assertIs(type(thawed), dict)
+    thawed['a'] = 5
+
+  def test_max_bytes(self):
+    old_max_bytes = options.smallcache_max_bytes
+    options.smallcache_max_bytes = 3 * smallcache._sizeof('x' * 1000)
+    try:
+      for i in range(4):
+        smallcache.set_local(i, 'x' * 1000)
+      self.assertIsNone(smallcache.get(0))
+      self.assertEqual(smallcache.get(3), 'x' * 1000)
+      self.assertLessEqual(smallcache._cache.size, options.smallcache_max_bytes)
+      smallcache.set_local(4, 'x' * 4000)
+      self.assertIsNone(smallcache.get(4))
+      self.assertEqual(smallcache._cache.size, 0)
+    finally:
+      options.smallcache_max_bytes = old_max_bytes
+
+  def test_stats(self):
+    stats = smallcache.get_stats()
+    smallcache.set_local(0, 7)
+    smallcache.set_local(1, 0, -1)
+    for i in range(2, 6):
+      smallcache.set_local(i, i)
+    smallcache.get(5)
+    smallcache.get(0)
+    new_stats = smallcache.get_stats()
+    self.assertEqual(new_stats['hits'] - stats.get('hits', 0), 1)
+    self.assertEqual(new_stats['misses'] - stats.get('misses', 0), 1)
+    self.assertEqual(new_stats['evictions'] - stats.get('evictions', 0), 2)
+    self.assertEqual(new_stats['entries'], 4)
+
+  @base.wrap_coro
+  async def test_cached(self):
+    calls = []
+
+    @smallcache.cached('test-', 60)
+    async def get_doc(a, b):
+      calls.append((a, b))
+      return None if a else {'a': a, 'b': [b]}
+
+    self.assertEqual(await get_doc(0, 1), {'a': 0, 'b': (1,)})
+    self.assertEqual(await get_doc(0, 1), {'a': 0, 'b': (1,)})
+    self.assertIsNone(await get_doc(1, 1))
+    self.assertIsNone(await get_doc(1, 1))
+    self.assertEqual(calls, [(0, 1), (1, 1)])
+    self.assertIn(smallcache.get_key('test-', 0, 1), smallcache._cache)
+
 
 class OnlineTest(base.SmallcacheTestCase):
   @base.wrap_coro
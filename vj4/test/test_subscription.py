@@ -0,0 +1,64 @@
+import unittest
+
+from bson import objectid
+
+from vj4.util import subscription
+
+RID = objectid.ObjectId()
+RID2 = objectid.ObjectId()
+
+
+def callback_a(e):
+  pass
+
+
+def callback_b(e):
+  pass
+
+
+def callback_c(e):
+  pass
+
+
+class Test(unittest.TestCase):
+  def setUp(self):
+    self.index = subscription.SubscriberIndex()
+
+  def test_key(self):
+    self.index.add(callback_a, ['record_change'])
+    self.index.add(callback_b, ['problem_data_change'])
+    self.assertEqual(self.index.match('record_change', {'_id': RID}), [callback_a])
+    self.assertEqual(self.index.match('smallcache-unset', 'key'), [])
+
+  def test_route(self):
+    self.index.add(callback_a, ['record_change'], {'_id': RID})
+    self.index.add(callback_b, ['record_change'], {'uid': 2, 'domain_id': 'system', 'pid': 1000})
+    self.index.add(callback_c, ['record_change'])
+    rdoc = {'_id': RID, 'uid': 2, 'domain_id': 'system', 'pid': 1000}
+    self.assertCountEqual(self.index.match('record_change', rdoc),
+                          [callback_a, callback_b, callback_c])
+    rdoc = {'_id': RID2, 'uid': 2, 'domain_id': 'system', 'pid': 1001}
+    self.assertEqual(self.index.match('record_change', rdoc), [callback_c])
+    self.assertEqual(self.index.match('record_change', 'not a dict'), [callback_c])
+
+  def test_resubscribe(self):
+    self.index.add(callback_a, ['record_change'], {'_id': RID})
+    self.index.add(callback_a, ['record_change'], {'_id': RID2})
+    self.assertEqual(self.index.match('record_change', {'_id': RID}), [])
+    self.assertEqual(self.index.match('record_change', {'_id': RID2}), [callback_a])
+    self.assertEqual(len(self.index), 1)
+
+  def test_remove(self):
+    self.index.add(callback_a, ['record_change'], {'_id': RID})
+    self.index.add(callback_b, ['record_change'])
+    self.index.remove(callback_a)
+    self.index.remove(callback_b)
+    self.index.remove(callback_c)
+    self.assertEqual(self.index.match('record_change', {'_id': RID}), [])
+    self.assertEqual(len(self.index), 0)
+    self.assertFalse(self.index._routed)
+    self.assertFalse(self.index._unfiltered)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+
+from vj4.service import workqueue
+from vj4.test import base
+
+
+class Test(unittest.TestCase):
+  def setUp(self):
+    self.queue = workqueue.WorkQueue('test', 2)
+    self.calls = []
+
+  def tearDown(self):
+    self.queue.close()
+
+  async def work(self, value):
+    self.calls.append(value)
+
+  async def sleep(self, seconds):
+    await asyncio.sleep(seconds)
+
+  async def fail(self):
+    raise ValueError()
+
+  @base.wrap_coro
+  async def test_add(self):
+    self.queue.add(self.work, 1)
+    self.queue.add(self.work, 1)
+    self.queue.add(self.fail)
+    await asyncio.sleep(0.01)
+    self.assertEqual(self.calls, [1, 1])
+    stats = self.queue.get_stats()
+    self.assertEqual(stats['processed'], 2)
+    self.assertEqual(stats['failed'], 1)
+    self.assertEqual(stats['backlog'], 0)
+
+  @base.wrap_coro
+  async def test_debounce(self):
+    for i in range(5):
+      self.queue.add(self.work, i, key='key', delay=0.01)
+    self.queue.add(self.work, 5, key='other', delay=0.01)
+    self.assertEqual(self.queue.get_stats()['backlog'], 2)
+    await asyncio.sleep(0.05)
+    self.assertCountEqual(self.calls, [0, 5])
+    self.queue.add(self.work, 6, key='key')
+    await asyncio.sleep(0.01)
+    self.assertCountEqual(self.calls, [0, 5, 6])
+    stats = self.queue.get_stats()
+    self.assertEqual(stats['coalesced'], 4)
+    self.assertEqual(stats['processed'], 3)
+
+  @base.wrap_coro
+  async def test_lag(self):
+    self.assertEqual(self.queue.get_stats()['lag'], 0.0)
+    for i in range(3):
+      self.queue.add(self.sleep, 0.05)
+    await asyncio.sleep(0.02)
+    self.assertGreaterEqual(self.queue.get_stats()['lag'], 0.01)
+    await asyncio.sleep(0.1)
+    self.assertEqual(self.queue.get_stats()['lag'], 0.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,52 @@
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+
+from vj4.util import zipstream
+
+wait = asyncio.get_event_loop().run_until_complete
+
+
+class BytesStream:
+  def __init__(self):
+    self.chunks = []
+
+  async def write(self, data):
+    self.chunks.append(data)
+
+
+class Test(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+
+  def test_write(self):
+    content = os.urandom(zipstream.CHUNK_SIZE * 3 + 7)
+    pathname = os.path.join(self.temp_dir.name, 'report.pdf')
+    with open(pathname, 'wb') as file:
+      file.write(content)
+    stream = BytesStream()
+
+    async def write():
+      zip_writer = zipstream.ZipStreamWriter(stream)
+      await zip_writer.write_file('报告.pdf', pathname)
+      await zip_writer.write_data('1000.cc', 'int main() {}\n' * 100)
+      await zip_writer.close()
+
+    wait(write())
+    self.assertGreater(len(stream.chunks), 3)
+    with zipfile.ZipFile(io.BytesIO(b''.join(stream.chunks))) as zip_file:
+      self.assertIsNone(zip_file.testzip())
+      self.assertEqual(zip_file.read('报告.pdf'), content)
+      self.assertEqual(zip_file.getinfo('报告.pdf').compress_type, zipfile.ZIP_STORED)
+      self.assertEqual(zip_file.read('1000.cc'), b'int main() {}\n' * 100)
+      self.assertEqual(zip_file.getinfo('1000.cc').compress_type, zipfile.ZIP_DEFLATED)
+
+
+if __name__ == '__main__':
+  unittest.main()
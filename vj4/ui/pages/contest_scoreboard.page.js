@@ -0,0 +1,48 @@
+import { NamedPage } from 'vj/misc/PageLoader';
+
+const page = new NamedPage(['contest_scoreboard', 'homework_scoreboard'], async () => {
+  const { default: SockJs } = await import('sockjs-client');
+  const { DiffDOM } = await import('diff-dom');
+
+  const sock = new SockJs(Context.socketUrl);
+  const dd = new DiffDOM();
+
+  let heartbeatClock;
+  sock.onopen = () => {
+    heartbeatClock = setInterval(() => {
+      sock.send(JSON.stringify({}));
+    }, 25000);
+  };
+  sock.onclose = () => clearInterval(heartbeatClock);
+
+  sock.onmessage = message => {
+    const msg = JSON.parse(message.data);
+    if (msg.reload) {
+      window.location.reload();
+      return;
+    }
+    const $tbody = $('.data-table tbody');
+    msg.rows.forEach(row => {
+      const $newTr = $(row.html);
+      const $oldTr = $tbody.children(`tr[data-uid="${row.uid}"]`);
+      if ($oldTr.length) {
+        $oldTr.trigger('vjContentRemove');
+        dd.apply($oldTr[0], dd.diff($oldTr[0], $newTr[0]));
+        $oldTr.trigger('vjContentNew');
+      } else {
+        $tbody.append($newTr);
+        $newTr.trigger('vjContentNew');
+      }
+    });
+    const trs = {};
+    $tbody.children('tr').each((index, tr) => {
+      trs[$(tr).attr('data-uid')] = tr;
+    });
+    $tbody.append(msg.order.filter(uid => trs[uid]).map(uid => trs[uid]));
+    Object.keys(trs)
+      .filter(uid => msg.order.indexOf(parseInt(uid, 10)) === -1)
+      .forEach(uid => $(trs[uid]).remove());
+  };
+});
+
+export default page;
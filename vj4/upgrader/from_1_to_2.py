@@ -0,0 +1,39 @@
+import logging
+
+from vj4 import db
+from vj4.model import document
+from vj4.model import system
+from vj4.model.adaptor import problem
+from vj4.util import argmethod
+
+
+_logger = logging.getLogger(__name__)
+
+
+@argmethod.wrap
+async def run():
+  lock = await system.acquire_upgrade_lock()
+  try:
+    await system.ensure_db_version(1)
+
+    # add `data_updated_at` attribute to problems with data
+    _logger.info('Updating data_updated_at...')
+    coll = db.coll('document')
+    pdocs = coll.find({'doc_type': document.TYPE_PROBLEM,
+                       'data': {'$ne': None},
+                       'data_updated_at': {'$exists': False}})
+    async for pdoc in pdocs:
+      data = await problem.get_data(pdoc)
+      if not data or not data['uploadDate']:
+        continue
+      await coll.update_one({'_id': pdoc['_id']},
+                            {'$set': {'data_updated_at': data['uploadDate']}})
+
+    _logger.info('Bumping database version...')
+    await system.set_db_version(2)
+  finally:
+    await system.release_upgrade_lock(lock)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
@@ -1,25 +1,91 @@
+import asyncio
+import inspect
 import logging
+import sys
 
 from vj4.model import builtin
 from vj4.model import domain
+from vj4.model import progress
 from vj4.util import argmethod
+from vj4.util import options
 
+options.define('domainjob_concurrency', default=4,
+               help='Number of domains a domain job runs on concurrently.')
 
 _logger = logging.getLogger(__name__)
 
 
+class Checkpoint(object):
+  """Checkpoint of a job on a domain, passed to the jobs which take a checkpoint argument.
+
+  The job saves the value to resume from after each unit of work, e.g. the doc_id of the last
+  problem done, and starts after the loaded value if it is not None.
+  """
+
+  def __init__(self, job, domain_id, doc):
+    self.job = job
+    self.domain_id = domain_id
+    self.value = doc.get('checkpoint')
+    self.done = doc['done']
+
+  async def set_total(self, total):
+    await progress.set_total(self.job, self.domain_id, total)
+
+  async def save(self, value, num_done=1):
+    self.value = value
+    self.done += num_done
+    await progress.save(self.job, self.domain_id, value, self.done)
+
+
+def _get_job_name(method):
+  module = method.__module__
+  spec = getattr(sys.modules[module], '__spec__', None)
+  if module == '__main__' and spec:
+    # Run with python -m.
+    module = spec.name
+  return module + '.' + method.__name__
+
+
 def wrap(method):
-  async def run():
-    _logger.info('Built in domains')
-    for ddoc in builtin.DOMAINS:
-      _logger.info('Domain: {0}'.format(ddoc['_id']))
-      await method(ddoc['_id'])
-    _logger.info('User domains')
-    ddocs = domain.get_multi(fields={'_id': 1})
-    async for ddoc in ddocs:
-      _logger.info('Domain: {0}'.format(ddoc['_id']))
-      await method(ddoc['_id'])
+  takes_checkpoint = 'checkpoint' in inspect.signature(method).parameters
+
+  async def run_domain(job, domain_id, semaphore):
+    async with semaphore:
+      doc = await progress.get(job, domain_id)
+      if doc and doc['status'] == progress.STATUS_DONE:
+        _logger.info('Domain: {0} (done)'.format(domain_id))
+        return True
+      _logger.info('Domain: {0}'.format(domain_id))
+      doc = await progress.begin(job, domain_id)
+      try:
+        if takes_checkpoint:
+          await method(domain_id, checkpoint=Checkpoint(job, domain_id, doc))
+        else:
+          await method(domain_id)
+      except Exception as e:
+        _logger.exception('Domain {0} failed: {1}'.format(domain_id, repr(e)))
+        await progress.end(job, domain_id, progress.STATUS_FAILED)
+        return False
+      await progress.end(job, domain_id)
+      return True
+
+  async def run(restart: int=0):
+    """Run on all domains concurrently, resuming the last run if it did not finish."""
+    job = _get_job_name(method)
+    if restart or await progress.is_finished(job):
+      await progress.reset(job)
+    domain_ids = [ddoc['_id'] for ddoc in builtin.DOMAINS]
+    async for ddoc in domain.get_multi(fields={'_id': 1}):
+      domain_ids.append(ddoc['_id'])
+    semaphore = asyncio.Semaphore(options.domainjob_concurrency)
+    results = await asyncio.gather(*[run_domain(job, domain_id, semaphore)
+                                     for domain_id in domain_ids])
+    num_failed = results.count(False)
+    if num_failed:
+      _logger.error('{0} of {1} domains failed, run again to resume'
+                    .format(num_failed, len(domain_ids)))
 
+  method.run_all = run
   if method.__module__ == '__main__':
     argmethod._methods[method.__name__] = method
     argmethod._methods[method.__name__ + '_all'] = run
@@ -1,13 +1,17 @@
 import base64
+import collections
 import hashlib
 import hoedown
 import jinja2
 import markupsafe
 import re
+import sys
 from urllib import parse
 
 from vj4.util import options
 
+options.define('markdown_cache_max_bytes', default=16 * 2 ** 20,
+               help='Maximum size of the rendered markdown cache, in bytes.')
 
 MARKDOWN_EXTENSIONS = (hoedown.EXT_TABLES |  # Parse PHP-Markdown style tables.
                        hoedown.EXT_FENCED_CODE |  # Parse fenced code blocks.
@@ -23,6 +27,11 @@ MARKDOWN_RENDER_FLAGS = (hoedown.HTML_ESCAPE |  # Escape all HTML.
 
 FS_RE = re.compile(r'\(vijos\:\/\/fs\/([0-9a-f]{40,})\)')
 
+# sha1 of markdown text -> rendered markup, in LRU order.
+_markdown_cache = collections.OrderedDict()
+_markdown_cache_size = 0
+_markdown_stats = collections.Counter()
+
 
 def nl2br(text):
   markup = jinja2.escape(text)
@@ -34,12 +43,39 @@ def fs_replace(m):
   return '(' + options.cdn_prefix.rstrip('/') + '/fs/' + m.group(1) + ')'
 
 
-def markdown(text):
+def _render_markdown(text):
   text = FS_RE.sub(fs_replace, text)
   return markupsafe.Markup(hoedown.html(
       text, extensions=MARKDOWN_EXTENSIONS, render_flags=MARKDOWN_RENDER_FLAGS))
 
 
+def markdown(text):
+  """Render markdown, memoized by the hash of the text."""
+  global _markdown_cache_size
+  key = hashlib.sha1(text.encode()).digest()
+  markup = _markdown_cache.get(key)
+  if markup is not None:
+    _markdown_cache.move_to_end(key)
+    _markdown_stats['hits'] += 1
+    return markup
+  _markdown_stats['misses'] += 1
+  markup = _render_markdown(text)
+  size = sys.getsizeof(markup)
+  if size <= options.markdown_cache_max_bytes:
+    _markdown_cache[key] = markup
+    _markdown_cache_size += size
+    while _markdown_cache_size > options.markdown_cache_max_bytes:
+      _, evicted = _markdown_cache.popitem(last=False)
+      _markdown_cache_size -= sys.getsizeof(evicted)
+      _markdown_stats['evictions'] += 1
+  return markup
+
+
+def get_markdown_stats():
+  """Get the counters of the rendered markdown cache."""
+  return {**_markdown_stats, 'entries': len(_markdown_cache), 'bytes': _markdown_cache_size}
+
+
 def gravatar_url(gravatar, size=200):
   # TODO: 'd' should be https://domain/img/avatar.png
   if gravatar:
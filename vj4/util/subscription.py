@@ -0,0 +1,80 @@
+"""Index of subscribers by event key and by a routing field of the event value.
+
+A subscriber may give a filter, a dict of field to value which the event value must match. It is
+indexed under the most selective field of the filter, so an event only visits the subscribers
+without a filter and those whose routing field equals the field of the event value.
+"""
+import collections
+
+# Fields to route on, most selective first.
+ROUTE_FIELDS = ('_id', 'rid', 'uid', 'pid', 'tid', 'domain_id')
+
+
+class SubscriberIndex(object):
+  def __init__(self):
+    self._subscriptions = {}  # callback -> (keys, filter, route)
+    self._unfiltered = collections.defaultdict(set)  # key -> callbacks
+    # key -> field -> value -> callbacks
+    self._routed = collections.defaultdict(lambda: collections.defaultdict(
+        lambda: collections.defaultdict(set)))
+
+  def __len__(self):
+    return len(self._subscriptions)
+
+  def add(self, callback, keys, filter=None):
+    """Subscribes the callback to a set of keys, replacing its previous subscription."""
+    self.remove(callback)
+    route = None
+    if filter:
+      route = next((field for field in ROUTE_FIELDS if field in filter), None)
+      if not route:
+        route = sorted(filter)[0]
+    self._subscriptions[callback] = (keys, filter, route)
+    for key in keys:
+      if route:
+        self._routed[key][route][filter[route]].add(callback)
+      else:
+        self._unfiltered[key].add(callback)
+
+  def remove(self, callback):
+    subscription = self._subscriptions.pop(callback, None)
+    if not subscription:
+      return
+    keys, filter, route = subscription
+    for key in keys:
+      if not route:
+        callbacks = self._unfiltered[key]
+        callbacks.discard(callback)
+        if not callbacks:
+          del self._unfiltered[key]
+        continue
+      fields = self._routed[key]
+      callbacks = fields[route][filter[route]]
+      callbacks.discard(callback)
+      if not callbacks:
+        del fields[route][filter[route]]
+        if not fields[route]:
+          del fields[route]
+          if not fields:
+            del self._routed[key]
+
+  def match(self, key, value):
+    """Returns the callbacks subscribed to the key whose filter matches the value."""
+    callbacks = list(self._unfiltered.get(key, ()))
+    fields = self._routed.get(key)
+    if not fields or not isinstance(value, dict):
+      return callbacks
+    for route, values in fields.items():
+      if route not in value:
+        continue
+      try:
+        candidates = values.get(value[route])
+      except TypeError:
+        continue
+      if not candidates:
+        continue
+      for callback in candidates:
+        filter = self._subscriptions[callback][1]
+        if all(value.get(field) == expected for field, expected in filter.items()):
+          callbacks.append(callback)
+    return callbacks
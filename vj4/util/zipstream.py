@@ -0,0 +1,119 @@
+"""Streaming zip archive writer.
+
+Entries are written to an asynchronous stream, e.g. aiohttp's StreamResponse, as soon as
+they are compressed, so that neither the whole archive nor a whole file is kept in memory.
+Reading and compression are done in the default executor to keep the event loop responsive.
+"""
+import asyncio
+import os
+import time
+import zipfile
+
+CHUNK_SIZE = 2 ** 16 # 64 KiB
+STORED_EXTENSIONS = frozenset(['.7z', '.docx', '.gz', '.jpg', '.png', '.pdf', '.pptx',
+                               '.rar', '.xlsx', '.xz', '.zip'])
+
+
+class _Pipe:
+  """Write-only, non-seekable file object that buffers output until drained."""
+
+  def __init__(self):
+    self._chunks = []
+    self._offset = 0
+
+  def write(self, data):
+    self._chunks.append(bytes(data))
+    self._offset += len(data)
+    return len(data)
+
+  def tell(self):
+    return self._offset
+
+  def flush(self):
+    pass
+
+  def drain(self):
+    data = b''.join(self._chunks)
+    self._chunks.clear()
+    return data
+
+
+def _copy_chunk(src, dest):
+  data = src.read(CHUNK_SIZE)
+  if data:
+    dest.write(data)
+  return len(data)
+
+
+def _write_data(dest, data):
+  for offset in range(0, len(data), CHUNK_SIZE):
+    dest.write(data[offset:offset + CHUNK_SIZE])
+
+
+class ZipStreamWriter:
+  def __init__(self, stream, *, loop=None):
+    self._stream = stream
+    self._loop = loop or asyncio.get_event_loop()
+    self._pipe = _Pipe()
+    self._zip_file = zipfile.ZipFile(self._pipe, 'w', zipfile.ZIP_DEFLATED)
+
+  def _run(self, func, *args):
+    return self._loop.run_in_executor(None, func, *args)
+
+  async def _flush(self):
+    data = self._pipe.drain()
+    if data:
+      await self._stream.write(data)
+
+  def _get_zinfo(self, arcname, mtime=None):
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(mtime)[:6])
+    zinfo.create_system = 0
+    if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+      zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+      zinfo.compress_type = zipfile.ZIP_DEFLATED
+    return zinfo
+
+  async def write_file(self, arcname, pathname):
+    """Add a local file as entry arcname, reading it in chunks."""
+    src = await self._run(open, pathname, 'rb')
+    try:
+      mtime = await self._run(os.path.getmtime, pathname)
+      dest = await self._run(self._zip_file.open, self._get_zinfo(arcname, mtime), 'w')
+      try:
+        while await self._run(_copy_chunk, src, dest):
+          await self._flush()
+      finally:
+        await self._run(dest.close)
+    finally:
+      await self._run(src.close)
+    await self._flush()
+
+  async def write_stream(self, arcname, read_chunk, mtime=None):
+    """Add the chunks returned by read_chunk() until it returns empty bytes as entry arcname."""
+    dest = await self._run(self._zip_file.open, self._get_zinfo(arcname, mtime), 'w')
+    try:
+      chunk = await read_chunk()
+      while chunk:
+        await self._run(dest.write, chunk)
+        await self._flush()
+        chunk = await read_chunk()
+    finally:
+      await self._run(dest.close)
+    await self._flush()
+
+  async def write_data(self, arcname, data):
+    """Add bytes or str data as entry arcname."""
+    if isinstance(data, str):
+      data = data.encode()
+    dest = await self._run(self._zip_file.open, self._get_zinfo(arcname), 'w')
+    try:
+      await self._run(_write_data, dest, data)
+    finally:
+      await self._run(dest.close)
+    await self._flush()
+
+  async def close(self):
+    """Write the central directory. The underlying stream is left open."""
+    self._zip_file.close()
+    await self._flush()